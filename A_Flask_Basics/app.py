@@ -1,22 +1,29 @@
 from flask import Flask, request, redirect, url_for
+from page_cache import PageCache
 
 app = Flask(__name__)
 
+# Pages that only depend on their url are rendered once a minute, see page_cache.py
+page_cache = PageCache(app)
+
 
 # Home / route
 @app.route("/")
+@page_cache.cached(timeout=60)
 def index():
     return "<h1>Hello</h1>"
 
 
 # /home Route
 @app.route("/home", methods=["GET"])
+@page_cache.cached(timeout=60)
 def home():
     return "<h1>Home</h1>"
 
 
 # Returning JSON
 @app.route("/json")
+@page_cache.cached(timeout=300)
 def json():
     return {"mykey": "JSON Value!", "mylist": [1, 2, 3, 4, 5]}
 
@@ -1,10 +1,15 @@
 from flask import Flask, request, redirect, url_for, render_template
+from page_cache import PageCache
 
 app = Flask(__name__)
 
+# Pages that only depend on their url are rendered once a minute, see page_cache.py
+page_cache = PageCache(app)
+
 
 # Home / route
 @app.route("/")
+@page_cache.cached(timeout=60)
 def index():
     return render_template(
         "index.html", page_name="root route", page_num=2
@@ -13,6 +18,7 @@ def index():
 
 # /home Route
 @app.route("/home", methods=["GET"])
+@page_cache.cached(timeout=60)
 def home():
     return render_template(
         "home.html", number=15, data=[{"key": "value1"}, {"key": "value3"}]
@@ -21,6 +27,7 @@ def home():
 
 # Returning JSON
 @app.route("/json")
+@page_cache.cached(timeout=300)
 def json():
     return {"mykey": "JSON Value!", "mylist": [1, 2, 3, 4, 5]}
 
@@ -0,0 +1,101 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app, make_response, request
+
+
+class PageCache:
+    """
+    Keeps the responses of GET routes in memory for a while, so a page that
+    only depends on its url is rendered once instead of on every hit.
+    A small copy of project/page_cache.py, this app doesn't need the rest.
+
+    @app.route("/home")
+    @page_cache.cached(timeout=60)
+    def home():
+        ...
+
+    Config:
+        PAGE_CACHE_ENABLED(bool): False always runs the views, read per request.
+        PAGE_CACHE_MAX_ENTRIES(int): How many pages are kept.
+    """
+
+    def __init__(self, app=None):
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PAGE_CACHE_ENABLED", True)
+        app.config.setdefault("PAGE_CACHE_MAX_ENTRIES", 256)
+
+    def cached(self, timeout=60):
+        """
+        Caches the responses of a view.
+
+        Args:
+            timeout (int): Seconds to keep a page.
+
+        Returns:
+            callable: The decorator.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                enabled = current_app.config["PAGE_CACHE_ENABLED"]
+                if not enabled or request.method not in ("GET", "HEAD"):
+                    return view(*args, **kwargs)
+
+                key = request.full_path
+                with self._lock:
+                    page = self._pages.get(key)
+                    if page is not None and page["expires"] > time.time():
+                        self._pages.move_to_end(key)
+                    else:
+                        page = None
+
+                if page is None:
+                    response = make_response(view(*args, **kwargs))
+                    # Only pages anyone may see are kept
+                    shared = "Set-Cookie" not in response.headers
+                    if response.status_code != 200 or not shared:
+                        return response
+                    page = self._store(key, response, timeout)
+
+                # Each request gets its own response, with a 304 if it is unchanged
+                response = make_response(page["body"], 200, page["headers"])
+                return response.make_conditional(request)
+
+            return wrapper
+
+        return decorator
+
+    def _store(self, key, response, timeout):
+        now = time.time()
+        response.cache_control.public = True
+        response.cache_control.max_age = timeout
+        response.last_modified = datetime.fromtimestamp(now, timezone.utc)
+        page = {
+            "body": response.get_data(),
+            "headers": list(response.headers),
+            "expires": now + timeout,
+        }
+
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > current_app.config["PAGE_CACHE_MAX_ENTRIES"]:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        """
+        Drops every cached page.
+        """
+        with self._lock:
+            self._pages.clear()
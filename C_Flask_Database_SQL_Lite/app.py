@@ -1,10 +1,14 @@
+import hashlib
+import os
 from flask import Flask, request, redirect, url_for, render_template
 from flask_sqlalchemy import SQLAlchemy  # Lib to use SQL databases
 
 app = Flask(__name__)
 
-# Configure SQL Lite URI
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///db.sqlite3"
+# Configure SQL Lite URI, DATABASE_URI points it somewhere else such as a test db
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URI", "sqlite:///db.sqlite3"
+)
 
 # Init sql db
 db = SQLAlchemy(app)
@@ -40,6 +44,8 @@ order_product = db.Table(
     "order_product",
     db.Column("order_id", db.ForeignKey("order.id"), primary_key=True),
     db.Column("product_id", db.ForeignKey("product.id"), primary_key=True),
+    # The primary key starts with order_id, this index is for going from products to orders
+    db.Index("ix_order_product_product_id_order_id", "product_id", "order_id"),
 )
 
 
@@ -60,8 +66,8 @@ class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     total = db.Column(db.Integer)
     user_id = db.Column(
-        db.ForeignKey("user.id")
-    )  # This user_id refers to user.id in User table
+        db.ForeignKey("user.id"), index=True
+    )  # This user_id refers to user.id in User table, indexed for the reports
 
     # This establishes a relationship with the User table
     # This allows you to do use order.user and get the order
@@ -98,6 +104,59 @@ class Product(db.Model):
     )
 
 
+# Content hash of each static file, added to its url as ?v=
+static_hashes = {}
+
+
+def static_hash(filename):
+    """
+    Gets the content hash of a static file, it is computed once per file.
+
+    Parameters:
+        filename(str): The file name relative to the static folder.
+
+    Returns:
+        str: The hash, or None if the file doesn't exist.
+    """
+    if filename not in static_hashes:
+        path = os.path.join(app.static_folder, filename)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as file:
+            static_hashes[filename] = hashlib.sha256(file.read()).hexdigest()[:12]
+    return static_hashes[filename]
+
+
+@app.url_defaults
+def add_static_hash(endpoint, values):
+    """
+    Adds ?v=<hash> to url_for('static', ...) so the url changes with the file.
+    """
+    if endpoint == "static" and "filename" in values:
+        values["v"] = static_hash(values["filename"])
+
+
+@app.after_request
+def cache_static(response):
+    """
+    Lets browsers cache static files forever when the url has the current hash.
+    Urls without it (or with an old hash) keep Flask's normal caching.
+
+    Returns:
+        Response: The response with the cache headers.
+    """
+    if (
+        request.endpoint == "static"
+        and response.status_code in (200, 304)
+        and request.args.get("v") == static_hash(request.view_args["filename"])
+    ):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        response.cache_control.immutable = True
+    return response
+
+
 # Home / route
 @app.route("/")
 def index():
@@ -221,6 +280,206 @@ def error():
     return "Error"
 
 
+def page_args():
+    """
+    Reads the page and per_page query parameters for the report endpoints.
+    Such as: http://localhost:5000/reports/users?page=2&per_page=20
+
+    Returns:
+        tuple: The page (starting at 1) and the number of rows per page.
+    """
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", 50, type=int), 1), 500)
+    return page, per_page
+
+
+# Order count and total per user such as: http://localhost:5000/reports/users
+@app.route("/reports/users")
+def report_users():
+    """
+    The route to the /reports/users endpoint. Counts the orders and
+    adds up the totals of each user in one GROUP BY query.
+
+    Returns:
+        object: The users with their order count and total as json.
+    """
+    page, per_page = page_args()
+
+    rows = (
+        db.session.query(
+            User.id,
+            User.name,
+            db.func.count(Order.id),
+            db.func.coalesce(db.func.sum(Order.total), 0),
+        )
+        .outerjoin(Order, Order.user_id == User.id)
+        .group_by(User.id)
+        .order_by(User.id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+
+    return {
+        "page": page,
+        "per_page": per_page,
+        "users": [
+            {"id": id, "name": name, "order_count": order_count, "order_total": total}
+            for id, name, order_count, total in rows
+        ],
+    }
+
+
+# Revenue per product such as: http://localhost:5000/reports/products
+@app.route("/reports/products")
+def report_products():
+    """
+    The route to the /reports/products endpoint. Products don't have a
+    price, so the revenue of a product is the total of the orders it is in.
+
+    Returns:
+        object: The products with their order count and revenue as json.
+    """
+    page, per_page = page_args()
+
+    rows = (
+        db.session.query(
+            Product.id,
+            Product.name,
+            db.func.count(Order.id),
+            db.func.coalesce(db.func.sum(Order.total), 0),
+        )
+        .outerjoin(order_product, order_product.c.product_id == Product.id)
+        .outerjoin(Order, Order.id == order_product.c.order_id)
+        .group_by(Product.id)
+        .order_by(Product.id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+
+    return {
+        "page": page,
+        "per_page": per_page,
+        "products": [
+            {"id": id, "name": name, "order_count": order_count, "revenue": revenue}
+            for id, name, order_count, revenue in rows
+        ],
+    }
+
+
+# Biggest spenders such as: http://localhost:5000/reports/top-customers?n=5
+@app.route("/reports/top-customers")
+def report_top_customers():
+    """
+    The route to the /reports/top-customers endpoint. Returns the n
+    users with the highest order total, n defaults to 10.
+
+    Returns:
+        object: The top customers as json.
+    """
+    n = min(max(request.args.get("n", 10, type=int), 1), 500)
+    total = db.func.sum(Order.total).label("total")
+
+    rows = (
+        db.session.query(User.id, User.name, db.func.count(Order.id), total)
+        .join(Order, Order.user_id == User.id)
+        .group_by(User.id)
+        .order_by(total.desc(), User.id)
+        .limit(n)
+        .all()
+    )
+
+    return {
+        "customers": [
+            {"id": id, "name": name, "order_count": order_count, "order_total": total}
+            for id, name, order_count, total in rows
+        ]
+    }
+
+
+def order_to_json(order, include_user=True):
+    """
+    Formats an order with its products in json format.
+
+    Args:
+        order(Order): The order with its user and products already loaded.
+        include_user(bool): Leave the user out when the caller already shows it.
+
+    Returns:
+        dict: The order formatted in json.
+    """
+    order_json = {
+        "id": order.id,
+        "total": order.total,
+        "products": [
+            {"id": product.id, "name": product.name} for product in order.products
+        ],
+    }
+    if include_user:
+        order_json["user"] = {"id": order.user.id, "name": order.user.name}
+    return order_json
+
+
+# Orders with their products such as: http://localhost:5000/orders?ids=1,2,3
+@app.route("/orders")
+def orders():
+    """
+    The route to the /orders endpoint. Loads all the orders asked for
+    in three queries no matter how many there are: the orders, their
+    users, and their products through order_product.
+
+    Returns:
+        object: The orders as json.
+    """
+    try:
+        ids = [int(id) for id in request.args.get("ids", "").split(",") if id]
+    except ValueError:
+        return {"error": "ids must be a comma separated list of numbers."}, 400
+
+    if not ids or len(ids) > 500:
+        return {"error": "ids must have between 1 and 500 order ids."}, 400
+
+    orders = (
+        Order.query.options(
+            db.selectinload(Order.user), db.selectinload(Order.products)
+        )
+        .filter(Order.id.in_(ids))
+        .order_by(Order.id)
+        .all()
+    )
+
+    return {"orders": [order_to_json(order) for order in orders]}
+
+
+# All orders of a user such as: http://localhost:5000/users/1/orders
+@app.route("/users/<int:user_id>/orders")
+def user_orders(user_id):
+    """
+    The route to the /users/<user_id>/orders endpoint. Loads the user's
+    orders and their products in a fixed number of queries.
+
+    Parameters:
+        user_id(int): The id of the user.
+
+    Returns:
+        object: The user and their orders as json.
+    """
+    user = User.query.get_or_404(user_id)
+
+    orders = (
+        Order.query.options(db.selectinload(Order.products))
+        .filter_by(user_id=user.id)
+        .order_by(Order.id)
+        .all()
+    )
+
+    return {
+        "user": {"id": user.id, "name": user.name},
+        "orders": [order_to_json(order, include_user=False) for order in orders],
+    }
+
+
 # Inserting data into database
 def insert_data():
     """
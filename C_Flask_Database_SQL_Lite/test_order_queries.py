@@ -0,0 +1,80 @@
+import os
+
+# The app connects when it is imported, so point it at a db in memory first
+os.environ["DATABASE_URI"] = "sqlite://"
+
+import pytest
+from sqlalchemy import event
+from app import Order, Product, User, app, db
+
+
+@pytest.fixture
+def client():
+    """
+    Creates 3 users with 1, 3 and 50 orders of 2 products each.
+    """
+    with app.app_context():
+        db.create_all()
+        products = [Product(name=f"Product {number}") for number in range(4)]
+        for number, order_count in enumerate((1, 3, 50), 1):
+            user = User(name=f"User {number}")
+            for index in range(order_count):
+                two_products = products[index % 3 : index % 3 + 2]
+                db.session.add(Order(total=10, user=user, products=two_products))
+        db.session.commit()
+
+        yield app.test_client()
+
+        db.session.remove()
+        db.drop_all()
+
+
+def count_queries(client, url):
+    """
+    Gets a url and counts the SQL statements it ran.
+
+    Returns:
+        tuple: The response and the number of statements.
+    """
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    return response, len(statements)
+
+
+def test_orders_query_count_does_not_grow(client):
+    counts = []
+    for order_count in (1, 3, 50):
+        ids = ",".join(str(order_id) for order_id in range(1, order_count + 1))
+        response, queries = count_queries(client, f"/orders?ids={ids}")
+
+        orders = response.json["orders"]
+        assert len(orders) == order_count
+        assert all(len(order["products"]) == 2 for order in orders)
+        counts.append(queries)
+
+    # The orders, their users and their products
+    assert counts == [3, 3, 3]
+
+
+def test_user_orders_query_count_does_not_grow(client):
+    counts = []
+    for user_id, order_count in enumerate((1, 3, 50), 1):
+        response, queries = count_queries(client, f"/users/{user_id}/orders")
+
+        assert len(response.json["orders"]) == order_count
+        counts.append(queries)
+
+    # The user, their orders and the orders' products
+    assert counts == [3, 3, 3]
@@ -1,18 +1,98 @@
 from flask import Flask
 from .views.main import main
 from .views.api import api
-from .extensions import db
+from .views.admin import admin
+from .extensions import (
+    db,
+    compress,
+    assets,
+    page_cache,
+    profiler,
+    slow_queries,
+    snapshots,
+    password_verifier,
+    metrics,
+    memory,
+)
+from .jobs import jobs
+from .topic_index import topic_index
+from .sharding import shards
+from .invalidation import invalidation
+from .queries import statement_cache_stats
+from .commands import (
+    bench,
+    seed,
+    assets_cli,
+    serve,
+    loadgen,
+    db_snapshot,
+    shards_cli,
+)
 
 
-def create_app(config_file="settings.py"):
+def create_app(config_file="settings.py", config=None):
     app = Flask(__name__)
 
     # Configure env vars from .env file
     app.config.from_pyfile(config_file)
 
+    # Settings that win over the file, such as the test db, see testing.py
+    app.config.update(config or {})
+
     # Initialize the db with app
     db.init_app(app)
 
+    # Gzip large responses for clients that accept it
+    compress.init_app(app)
+
+    # Serve the static folder with fingerprinted, long cached urls
+    assets.init_app(app)
+
+    # Keep rendered GET pages in memory, see page_cache.py
+    page_cache.init_app(app)
+
+    # Profile requests with cProfile when PROFILE_ENABLED is set
+    profiler.init_app(app)
+
+    # Record slow SQL statements when SLOW_QUERY_ENABLED is set
+    slow_queries.init_app(app)
+
+    # Count compiled statement cache hits, see queries.py
+    statement_cache_stats.init_app(app)
+
+    # Online db snapshots, scheduled when SNAPSHOT_INTERVAL is set
+    snapshots.init_app(app)
+
+    # Background jobs run after commit by JOB_WORKERS threads, see jobs.py
+    jobs.init_app(app)
+
+    # Password checks for /api/auth/verify on a bounded thread pool
+    password_verifier.init_app(app)
+
+    # tracemalloc snapshots and ORM object counts for /admin/memory, see memory.py
+    memory.init_app(app)
+
+    # In memory topic bitmaps for /api/topic/members, see topic_index.py
+    topic_index.init_app(app)
+
+    # Members split across SHARD_DATABASE_URIS when set, see sharding.py
+    shards.init_app(app)
+
+    # Prometheus metrics at /metrics when METRICS_ENABLED is set, after the
+    # shards so their queries are counted too, see metrics.py
+    metrics.init_app(app)
+
+    # Tell the caches above about changes made by other processes
+    invalidation.init_app(app)
+    with app.app_context():
+        invalidation.subscribe("member", topic_index.refresh)
+        # The page cache has no session events, so it also follows this
+        # process's commits
+        for entity in ("language", "topic"):
+            invalidation.subscribe(
+                entity, lambda ids: page_cache.clear(), own_changes=True
+            )
+
     # Registers main route from routes.py
     app.register_blueprint(main)
 
@@ -20,4 +100,16 @@ def create_app(config_file="settings.py"):
     # that when we access this route, it will be /api
     app.register_blueprint(api, url_prefix="/api")
 
+    # Admin routes need the X-Admin-Token header, see views/admin.py
+    app.register_blueprint(admin, url_prefix="/admin")
+
+    # Add the flask commands, see commands.py
+    app.cli.add_command(bench)
+    app.cli.add_command(seed)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(serve)
+    app.cli.add_command(loadgen)
+    app.cli.add_command(db_snapshot)
+    app.cli.add_command(shards_cli)
+
     return app
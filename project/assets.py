@@ -0,0 +1,176 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from flask import current_app, request, send_from_directory, url_for
+
+# Static files worth keeping a .gz copy of, fonts and images are already compressed
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".txt", ".html")
+
+
+def fingerprint(filename, digest):
+    """
+    Adds the content hash to a file name.
+    Such as: vendor/bulma/bulma.min.css -> vendor/bulma/bulma.min.3f9a1c2b4d5e.css
+
+    Args:
+        filename (str): The file name relative to the static folder.
+        digest (str): The content hash of the file.
+
+    Returns:
+        str: The fingerprinted file name.
+    """
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{digest}{extension}"
+
+
+class Assets:
+    """
+    Serves the static folder with content hashed urls.
+    A fingerprinted url changes whenever the file changes, so browsers
+    can cache it forever and repeat page loads don't fetch it again.
+    Use asset_url_for in templates the same way as url_for:
+    {{ asset_url_for('static', filename='vendor/bulma/bulma.min.css') }}
+
+    Config:
+        ASSETS_MAX_AGE(int): Seconds browsers may cache fingerprinted files.
+    """
+
+    def __init__(self, app=None):
+        self.urls = {}
+        self.files = {}
+        self.gzipped = set()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Hashes the static files and replaces the static view.
+
+        Args:
+            app (Flask): The flask app to serve the static files of.
+        """
+        app.config.setdefault("ASSETS_MAX_AGE", 365 * 24 * 60 * 60)
+
+        self.build_manifest(app.static_folder)
+
+        app.view_functions["static"] = self.send_static
+        app.add_template_global(self.asset_url_for)
+        app.extensions["assets"] = self
+
+    def build_manifest(self, static_folder):
+        """
+        Hashes every file in the static folder. A .gz file next to a
+        file is only used if it has exactly the same content.
+
+        Args:
+            static_folder (str): The path of the static folder.
+        """
+        self.urls = {}
+        self.files = {}
+        self.gzipped = set()
+
+        for root, _, names in os.walk(static_folder):
+            for name in names:
+                if name.endswith(".gz"):
+                    continue
+
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, "/")
+
+                with open(path, "rb") as file:
+                    content = file.read()
+                digest = hashlib.sha256(content).hexdigest()[:12]
+
+                self.urls[filename] = fingerprint(filename, digest)
+                self.files[self.urls[filename]] = filename
+
+                if os.path.exists(path + ".gz"):
+                    with gzip.open(path + ".gz", "rb") as file:
+                        if file.read() == content:
+                            self.gzipped.add(filename)
+
+    def asset_url_for(self, endpoint, **values):
+        """
+        Works like url_for, but static files get their fingerprinted name.
+
+        Args:
+            endpoint (str): The endpoint name, such as static.
+            **values: The url values, such as filename.
+
+        Returns:
+            str: The url.
+        """
+        if endpoint == "static" and values.get("filename") in self.urls:
+            values["filename"] = self.urls[values["filename"]]
+        return url_for(endpoint, **values)
+
+    def send_static(self, filename):
+        """
+        Sends a static file. Fingerprinted names are cached forever and
+        sent gzipped to clients that accept it, anything else is sent like
+        Flask normally does.
+
+        Args:
+            filename (str): The file name from the url.
+
+        Returns:
+            Response: The file.
+        """
+        source = self.files.get(filename)
+        if source is None:
+            return current_app.send_static_file(filename)
+
+        send_gzip = source in self.gzipped and request.accept_encodings["gzip"] > 0
+
+        response = send_from_directory(
+            current_app.static_folder,
+            source + ".gz" if send_gzip else source,
+            mimetype=mimetypes.guess_type(source)[0],
+            max_age=current_app.config["ASSETS_MAX_AGE"],
+        )
+
+        # send_file adds the .gz name here, the browser only needs the content
+        response.headers.pop("Content-Disposition", None)
+
+        if send_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        if source in self.gzipped:
+            response.vary.add("Accept-Encoding")
+
+        # The content of this url never changes, so browsers don't even revalidate
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+
+        return response
+
+    def compress_files(self, static_folder, level=9):
+        """
+        Writes a .gz copy next to each compressible static file.
+
+        Args:
+            static_folder (str): The path of the static folder.
+            level (int): The gzip level, build time is free so it defaults to 9.
+
+        Returns:
+            list: The file name, size and gzipped size of each file compressed.
+        """
+        compressed = []
+
+        for filename in sorted(self.urls):
+            if not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+
+            path = os.path.join(static_folder, filename)
+            with open(path, "rb") as file:
+                content = file.read()
+
+            data = gzip.compress(content, compresslevel=level, mtime=0)
+            with open(path + ".gz", "wb") as file:
+                file.write(data)
+
+            compressed.append((filename, len(content), len(data)))
+
+        self.build_manifest(static_folder)
+        return compressed
@@ -0,0 +1,197 @@
+import collections
+import os
+import secrets
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class VerifierBusy(Exception):
+    """
+    Raised when too many password checks are already waiting for a worker.
+    """
+
+
+class PasswordVerifier:
+    """
+    Checks passwords on a fixed size thread pool. Password hashing is slow on
+    purpose, the pool keeps a burst of logins from using every CPU, and
+    requests beyond AUTH_VERIFY_QUEUE are turned away instead of piling up.
+    hashlib releases the GIL while it hashes, so the pool threads run in parallel.
+
+    Config:
+        AUTH_VERIFY_WORKERS(int): Threads checking passwords, the CPU count by default.
+        AUTH_VERIFY_QUEUE(int): Checks running or waiting before new ones are refused.
+        AUTH_VERIFY_TIMEOUT(float): Seconds a check may wait for room in the queue.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and makes the app's thread pool.
+
+        Args:
+            app (Flask): The flask app checking passwords.
+        """
+        app.config.setdefault("AUTH_VERIFY_WORKERS", os.cpu_count() or 1)
+        app.config.setdefault(
+            "AUTH_VERIFY_QUEUE", app.config["AUTH_VERIFY_WORKERS"] * 4
+        )
+        app.config.setdefault("AUTH_VERIFY_TIMEOUT", 5.0)
+
+        pool = VerifierPool(
+            app.config["AUTH_VERIFY_WORKERS"],
+            app.config["AUTH_VERIFY_QUEUE"],
+            app.config["AUTH_VERIFY_TIMEOUT"],
+        )
+        app.extensions["password_verifier"] = pool
+        # The pool's threads stop once the app is gone
+        weakref.finalize(app, pool.shutdown)
+
+    @property
+    def _pool(self):
+        return current_app.extensions["password_verifier"]
+
+    def verify(self, password_hash, password):
+        """
+        Checks a password against its hash on the pool.
+
+        Args:
+            password_hash (str): The stored hash, None for an unknown email.
+            password (str): The password sent by the client.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        pool = self._pool
+        if not pool.slots.acquire(timeout=pool.timeout):
+            raise VerifierBusy()
+
+        try:
+            future = pool.executor.submit(
+                pool.timed,
+                "verify",
+                check_password_hash,
+                password_hash or pool.dummy_hash,
+                password,
+            )
+            matches = future.result()
+        finally:
+            pool.slots.release()
+
+        # An unknown email never matches, even if it guessed the dummy password
+        return matches and password_hash is not None
+
+    def needs_rehash(self, password_hash):
+        """
+        Checks if a hash was made with older settings than the current default,
+        such as pbkdf2 or fewer scrypt rounds.
+
+        Args:
+            password_hash (str): The stored hash.
+
+        Returns:
+            bool: True if the hash should be made again.
+        """
+        return password_hash.split("$", 1)[0] != self._pool.method
+
+    def hash(self, password):
+        """
+        Hashes one password in the calling thread, for new and edited members.
+
+        Args:
+            password (str): The password.
+
+        Returns:
+            str: The hash.
+        """
+        return self._pool.timed("hash", generate_password_hash, password)
+
+    def hash_passwords(self, passwords):
+        """
+        Hashes many passwords on the pool, for imports. Each one takes a
+        queue slot like a login, waiting for one instead of failing, and
+        at most AUTH_VERIFY_WORKERS run or wait at a time, so logins keep
+        most of the queue and wait behind a few hashes at the most.
+
+        Args:
+            passwords (list): The passwords, None where there is none.
+
+        Returns:
+            list: The hashes in the same order, None for the missing passwords.
+        """
+        pool = self._pool
+        hashes = [None] * len(passwords)
+        in_flight = collections.deque()
+        for position, password in enumerate(passwords):
+            if not password:
+                continue
+            if len(in_flight) >= pool.workers:
+                done_position, future = in_flight.popleft()
+                hashes[done_position] = future.result()
+
+            pool.slots.acquire()
+            try:
+                future = pool.executor.submit(
+                    pool.timed, "hash", generate_password_hash, password
+                )
+            except BaseException:
+                pool.slots.release()
+                raise
+            future.add_done_callback(lambda future: pool.slots.release())
+            in_flight.append((position, future))
+
+        for position, future in in_flight:
+            hashes[position] = future.result()
+        return hashes
+
+
+class VerifierPool:
+    """
+    The thread pool and queue slots of one app, kept in
+    app.extensions["password_verifier"].
+
+    Args:
+        workers (int): Threads checking passwords.
+        queue (int): Checks running or waiting before new ones are refused.
+        timeout (float): Seconds a check may wait for room in the queue.
+    """
+
+    def __init__(self, workers, queue, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        # The threads are only started by the first check
+        self.executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="password-verify"
+        )
+        self.slots = threading.BoundedSemaphore(queue)
+        # Called with ("verify" or "hash", seconds) after each password, see metrics.py
+        self.listeners = []
+
+        # A hash of a random password made with today's default method.
+        # Unknown emails are checked against it so they take as long as known ones.
+        self.dummy_hash = generate_password_hash(secrets.token_hex(16))
+        self.method = self.dummy_hash.split("$", 1)[0]
+
+    def timed(self, operation, func, *args):
+        """
+        Runs a hash function and tells the listeners how long it took.
+        """
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        for listener in self.listeners:
+            listener(operation, elapsed)
+        return result
+
+    def shutdown(self):
+        """
+        Stops the pool's threads once the checks already queued are done.
+        """
+        self.executor.shutdown(wait=False)
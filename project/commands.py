@@ -0,0 +1,502 @@
+import json
+import os
+import time
+import click
+from flask import current_app
+from sqlalchemy import func, select
+from flask.cli import AppGroup, with_appcontext
+from werkzeug.datastructures import MultiDict
+from .compression import Compress
+from . import queries
+from .extensions import assets, db, metrics, snapshots
+from .invalidation import invalidation
+from .loadgen import (
+    LatencyHistogram,
+    run_load,
+    start_server,
+    stop_server,
+    wait_for_server,
+)
+from .models import Language, Member, Topic, member_topic_table
+from .schemas import member_create_schema
+from .seed import SEED_PASSWORD, seed_members
+from .server import PreforkServer
+from .sharding import shards
+from .snapshots import SnapshotError
+from .queries import statement_cache_stats
+from .topic_index import bitmap_ids, topic_index
+
+# Benchmarks are run with: flask bench <name>
+bench = AppGroup("bench", help="Micro benchmarks for the app.")
+
+# Static file commands are run with: flask assets <name>
+assets_cli = AppGroup("assets", help="Static file commands.")
+
+# Shard commands are run with: flask shards <name>
+shards_cli = AppGroup("shards", help="Commands for the member shards.")
+
+
+def _timeit(func, repeat):
+    """
+    Runs func repeat times and returns the best time for one call.
+
+    Args:
+        func (callable): The function to time.
+        repeat (int): How many times to run it.
+
+    Returns:
+        float: The fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _sample_members(count):
+    """
+    Builds a body shaped like GET /api/member without touching the db.
+
+    Args:
+        count (int): The number of members in the body.
+
+    Returns:
+        bytes: The json body.
+    """
+    languages = ["Python", "JavaScript", "Go", "Rust", "Java"]
+    topics = ["Web Apps", "Mobile Apps", "APIs", "Games", "Data"]
+    members = []
+    for i in range(count):
+        members.append(
+            {
+                "id": i + 1,
+                "email": f"member{i}@example.com",
+                "location": "Boston",
+                "first_learn_date": "2015-06-01",
+                "fav_language": {"id": i % 5 + 1, "name": languages[i % 5]},
+                "about": "I like to code.",
+                "learn_new_interest": bool(i % 2),
+                "interest_in_topics": [
+                    {"id": t + 1, "name": topics[t]} for t in range(i % 3 + 1)
+                ],
+            }
+        )
+    return json.dumps({"members": members}).encode()
+
+
+@bench.command("compression")
+@click.option("--members", default=1000, help="Members in the sample body.")
+@click.option("--repeat", default=20, help="Runs per measurement.")
+def bench_compression(members, repeat):
+    """
+    Compares the CPU cost of gzip levels against the bytes they save.
+    """
+    body = _sample_members(members)
+    click.echo(f"Body: {len(body)} bytes ({members} members)")
+    click.echo(f"{'level':>5} {'bytes':>9} {'saved':>7} {'ms':>8} {'MB/s':>8}")
+
+    for level in (1, 6, 9):
+        compress = Compress()
+        # cache_size=0 so every run pays for the full compression
+        elapsed = _timeit(lambda: compress.compress(body, level, 0), repeat)
+        size = len(compress.compress(body, level, 0))
+        click.echo(
+            f"{level:>5} {size:>9} {1 - size / len(body):>7.1%} "
+            f"{elapsed * 1000:>8.3f} {len(body) / elapsed / 1e6:>8.1f}"
+        )
+
+    # Same body again, like a response served from a cache
+    compress = Compress()
+    compress.compress(body)
+    elapsed = _timeit(lambda: compress.compress(body), repeat)
+    click.echo(f"Cached reuse: {elapsed * 1000:.3f} ms")
+
+
+@bench.command("topic-index")
+@click.option("--all", "all_of", default="1,2", help="Topics members must all have.")
+@click.option("--none", "none_of", default="3", help="Topics members must not have.")
+@click.option("--repeat", default=5, help="Runs per measurement.")
+@with_appcontext
+def bench_topic_index(all_of, none_of, repeat):
+    """
+    Compares a topic query on the in memory bitmaps against the same query in SQL.
+    """
+    all_of = [int(topic_id) for topic_id in all_of.split(",") if topic_id]
+    none_of = [int(topic_id) for topic_id in none_of.split(",") if topic_id]
+
+    topic_index.reset()
+    start = time.perf_counter()
+    topic_index.build()
+    build_time = time.perf_counter() - start
+
+    members = topic_index.members.bit_count()
+    memory = topic_index.memory()
+    click.echo(f"Built for {members} members in {build_time:.2f}s")
+    click.echo(
+        f"Memory: {memory / 1024:.0f} KiB, "
+        f"{memory / max(members, 1):.2f} bytes per member"
+    )
+
+    # Members with every topic in all_of and none of none_of
+    topic_id = member_topic_table.c.topic_id
+    statement = (
+        select(member_topic_table.c.member_id)
+        .group_by(member_topic_table.c.member_id)
+        .having(
+            func.count(func.distinct(topic_id)).filter(topic_id.in_(all_of))
+            == len(all_of),
+            func.count().filter(topic_id.in_(none_of)) == 0,
+        )
+        .order_by(member_topic_table.c.member_id)
+    )
+
+    def run_sql():
+        return db.session.execute(statement).scalars().all()
+
+    def run_bitmap():
+        return bitmap_ids(topic_index.query(all_of, (), none_of))
+
+    sql_ids, bitmap_result = run_sql(), run_bitmap()
+    if sql_ids != bitmap_result:
+        raise click.ClickException("The bitmap and SQL results differ.")
+
+    sql_time = _timeit(run_sql, repeat)
+    count_time = _timeit(
+        lambda: topic_index.query(all_of, (), none_of).bit_count(), repeat
+    )
+    page_time = _timeit(
+        lambda: bitmap_ids(topic_index.query(all_of, (), none_of), limit=100), repeat
+    )
+    ids_time = _timeit(run_bitmap, repeat)
+
+    click.echo(f"Query all={all_of} none={none_of}: {len(sql_ids)} members")
+    click.echo(f"SQL, all ids:       {sql_time * 1000:>9.2f} ms")
+    click.echo(f"Bitmap, count:      {count_time * 1000:>9.2f} ms")
+    click.echo(f"Bitmap, first 100:  {page_time * 1000:>9.2f} ms")
+    click.echo(f"Bitmap, all ids:    {ids_time * 1000:>9.2f} ms")
+
+
+@bench.command("queries")
+@click.option("--member-id", default=1, help="The member to read.")
+@click.option("--calls", default=1000, help="Calls per run.")
+@click.option("--repeat", default=5, help="Runs per measurement.")
+@with_appcontext
+def bench_queries(member_id, calls, repeat):
+    """
+    Compares the hot queries built on every call with the lambda statements
+    in queries.py, then times whole get_member and main.index requests.
+    """
+    session = db.session
+    cases = {
+        "main.index": (
+            lambda: (Language.query.all(), Topic.query.all()),
+            lambda: (queries.languages(session), queries.topics(session)),
+        ),
+        "member page": (
+            lambda: session.scalars(
+                select(Member).order_by(Member.id).offset(50).limit(51)
+            ).all(),
+            lambda: queries.members(session, (), 50, 51),
+        ),
+    }
+
+    def per_call(func):
+        def run():
+            for _ in range(calls):
+                func()
+                # Empty the identity map so every call loads the rows again
+                session.expunge_all()
+
+        func()
+        return _timeit(run, repeat) / calls
+
+    click.echo(f"{'query':<12} {'built us':>9} {'lambda us':>10} {'saved':>7}")
+    for name, (built, cached) in cases.items():
+        before, after = per_call(built), per_call(cached)
+        click.echo(
+            f"{name:<12} {before * 1e6:>9.1f} {after * 1e6:>10.1f} "
+            f"{1 - after / before:>7.1%}"
+        )
+
+    # Whole requests, without the page cache so the view runs every time
+    client = current_app.test_client()
+    enabled = current_app.config["PAGE_CACHE_ENABLED"]
+    current_app.config["PAGE_CACHE_ENABLED"] = False
+    statement_cache_stats.reset()
+    try:
+        click.echo(f"{'request':<22} {'us':>9}")
+        for url in (f"/api/member/{member_id}", "/"):
+            if client.get(url).status_code != 200:
+                raise click.ClickException(f"GET {url} failed.")
+            elapsed = _timeit(lambda: [client.get(url) for _ in range(calls)], repeat)
+            click.echo(f"GET {url:<18} {elapsed / calls * 1e6:>9.1f}")
+    finally:
+        current_app.config["PAGE_CACHE_ENABLED"] = enabled
+
+    report = statement_cache_stats.report()
+    click.echo(
+        f"Compiled cache: {report['hits']} hits, {report['misses']} misses, "
+        f"hit rate {report['hit_rate']:.1%}"
+    )
+
+
+@bench.command("validation")
+@click.option("--repeat", default=20, help="Runs per measurement.")
+@click.option("--payloads", default=10000, help="Payloads validated per run.")
+def bench_validation(repeat, payloads):
+    """
+    Measures the cost of validating one member payload with schemas.py.
+    """
+    valid = {
+        "email": "member@example.com",
+        "password": "password",
+        "location": "Boston",
+        "first_learn_date": "2015-06-01",
+        "fav_language": {"id": 1},
+        "about": "I like to code.",
+        "learn_new_interest": True,
+        "interest_in_topics": [{"id": 1}, {"id": 3}],
+    }
+    cases = {
+        "json, valid": valid,
+        "json, invalid": {"email": "nope", "first_learn_date": "2015-13-01"},
+        "form, valid": MultiDict(
+            [
+                ("email", "member@example.com"),
+                ("password", "password"),
+                ("location", "Boston"),
+                ("first_learn_date", "2015-06-01"),
+                ("fav_language", "1"),
+                ("about", "I like to code."),
+                ("learn_new_interest", "yes"),
+                ("interest_in_topics", "1"),
+                ("interest_in_topics", "3"),
+            ]
+        ),
+    }
+
+    schema = member_create_schema
+
+    def validate_form(form):
+        return schema.validate(schema.from_form(form))
+
+    click.echo(f"{'payload':<15} {'us/payload':>10}")
+    for name, data in cases.items():
+        validate = validate_form if name.startswith("form") else schema.validate
+
+        def run():
+            for _ in range(payloads):
+                validate(data)
+
+        elapsed = _timeit(run, repeat)
+        click.echo(f"{name:<15} {elapsed / payloads * 1e6:>10.2f}")
+
+
+@click.command("seed")
+@click.option("--members", default=1000, help="How many members to add.")
+@click.option("--seed", "random_seed", default=0, help="The random seed.")
+@click.option("--batch-size", default=10000, help="Members per transaction.")
+@with_appcontext
+def seed(members, random_seed, batch_size):
+    """
+    Fills the db with generated members for load testing.
+    Example: flask seed --members 1000000 --seed 42
+    """
+    db.create_all()
+
+    start = time.perf_counter()
+    with click.progressbar(length=members, label="Seeding members") as bar:
+        rows = seed_members(members, random_seed, batch_size, progress=bar.update)
+    elapsed = time.perf_counter() - start
+
+    # The members were inserted without the session, tell running servers
+    invalidation.publish("member")
+
+    click.echo(
+        f"Inserted {members} members ({rows} rows) in {elapsed:.1f}s, "
+        f"{rows / elapsed:,.0f} rows/sec"
+    )
+    click.echo(f"Every seeded member has the password: {SEED_PASSWORD}")
+
+
+@assets_cli.command("build")
+@click.option("--level", default=9, help="The gzip level.")
+def assets_build(level):
+    """
+    Writes the .gz copies of the static files that are sent to gzip clients.
+    Run it after changing or adding a static file.
+    """
+    for filename, size, compressed in assets.compress_files(
+        current_app.static_folder, level
+    ):
+        click.echo(f"{filename}: {size} -> {compressed} bytes")
+
+
+@click.command("serve")
+@click.option("--host", default="127.0.0.1", help="The address to listen on.")
+@click.option("--port", default=8000, help="The port to listen on.")
+@click.option("--workers", default=os.cpu_count(), help="Worker processes.")
+@click.option(
+    "--max-requests", default=0, help="Replace a worker after this many requests."
+)
+@click.option(
+    "--graceful-timeout", default=30, help="Seconds workers get to finish on stop."
+)
+def serve(host, port, workers, max_requests, graceful_timeout):
+    """
+    Serves the app with several worker processes (Linux and macOS only).
+    Example: flask serve --workers 4 --max-requests 10000
+    Send SIGHUP to the master to replace the workers without downtime.
+    """
+    if not hasattr(os, "fork"):
+        raise click.UsageError("flask serve needs os.fork, use flask run instead.")
+
+    app = current_app._get_current_object()
+    # Counts of an earlier run would be added to this one's, see metrics.py
+    metrics.clear_dir()
+    PreforkServer(app, host, port, workers, max_requests, graceful_timeout).run()
+
+
+@click.command("loadgen")
+@click.option("--url", help="A running server to load, by default one is started.")
+@click.option("--workers", default=1, help="Worker processes of the started server.")
+@click.option(
+    "--rate",
+    "rates",
+    multiple=True,
+    type=float,
+    default=[50.0],
+    help="Requests per second, repeat it to step up the load.",
+)
+@click.option("--duration", default=10.0, help="Seconds to run each rate.")
+@click.option("--concurrency", default=16, help="Client threads.")
+@click.option(
+    "--mix",
+    default="list=1,get=10,create=1,form=1",
+    help="Request types and their weights.",
+)
+@click.option("--max-id", type=int, help="Highest member id, from the db by default.")
+@click.option("--seed", "random_seed", default=0, help="The random seed.")
+@with_appcontext
+def loadgen(url, workers, rates, duration, concurrency, mix, max_id, random_seed):
+    """
+    Sends a mix of API and form requests over real sockets at a fixed rate
+    and reports throughput, errors and latency percentiles.
+    Example: flask loadgen --workers 4 --rate 100 --rate 200 --rate 400
+    The rate where throughput stops keeping up and p99 jumps is the saturation point.
+    """
+    if max_id is None:
+        max_id = db.session.scalar(select(func.max(Member.id))) or 1
+
+    server_pid = None
+    if url is None:
+        if not hasattr(os, "fork"):
+            raise click.UsageError("Starting a server needs os.fork, pass --url.")
+        server_pid, url = start_server(current_app._get_current_object(), workers)
+        if not wait_for_server(url):
+            stop_server(server_pid)
+            raise click.ClickException("The server didn't start.")
+        click.echo(f"Started {url} with {workers} workers")
+
+    try:
+        click.echo(
+            f"{'rate':>7} {'req/s':>8} {'errors':>7} "
+            f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'p99.9 ms':>9} {'max ms':>8}"
+        )
+        for rate in rates:
+            result = run_load(
+                url, rate, duration, concurrency, mix, max_id, random_seed
+            )
+
+            for kind, histogram in sorted(result["histograms"].items()):
+                errors = result["errors"].get(kind, 0)
+                _echo_latency(f"  {kind}", "", errors, histogram)
+
+            overall = LatencyHistogram()
+            for histogram in result["histograms"].values():
+                overall.merge(histogram)
+            _echo_latency(
+                f"{rate:>7.0f}",
+                f"{result['throughput']:>8.1f}",
+                sum(result["errors"].values()),
+                overall,
+            )
+            click.echo(f"  statuses: {result['statuses']}")
+    finally:
+        if server_pid is not None:
+            stop_server(server_pid)
+
+
+def _echo_latency(label, throughput, errors, histogram):
+    """
+    Prints one row of the load report.
+    """
+    click.echo(
+        f"{label:>7} {throughput:>8} {errors:>7} "
+        f"{histogram.percentile(50):>8.2f} {histogram.percentile(90):>8.2f} "
+        f"{histogram.percentile(99):>8.2f} {histogram.percentile(99.9):>9.2f} "
+        f"{histogram.max / 1000:>8.2f}"
+    )
+
+
+@click.command("db-snapshot")
+@click.option("--dir", "directory", help="Where to write it, SNAPSHOT_DIR by default.")
+@click.option("--pages", type=int, help="Pages copied per step.")
+@click.option(
+    "--keep",
+    type=click.IntRange(min=1),
+    help="Snapshots to keep, SNAPSHOT_KEEP by default.",
+)
+@click.option("--max-age-days", type=float, help="Delete snapshots older than this.")
+def db_snapshot(directory, pages, keep, max_age_days):
+    """
+    Copies the sqlite db to a timestamped file while the app keeps running,
+    checks it, and deletes old snapshots.
+    Example: flask db-snapshot --keep 14
+    """
+    start = time.perf_counter()
+    try:
+        path = snapshots.take(directory, pages)
+    except SnapshotError as error:
+        raise click.ClickException(str(error))
+
+    size = os.path.getsize(path)
+    click.echo(
+        f"Wrote {path} ({size:,} bytes) in {time.perf_counter() - start:.2f}s, "
+        "integrity check ok"
+    )
+
+    try:
+        removed = snapshots.prune(directory, keep, max_age_days)
+    except SnapshotError as error:
+        raise click.ClickException(str(error))
+    for path in removed:
+        click.echo(f"Deleted {path}")
+
+
+@shards_cli.command("init")
+def shards_init():
+    """
+    Creates the tables in every shard, copies the languages and topics
+    to them and starts the member ids after the highest one.
+    """
+    if not shards.enabled:
+        raise click.ClickException("Set SHARD_DATABASE_URIS first.")
+
+    shards.create_tables()
+    click.echo(f"{len(shards.engines)} shards ready.")
+
+
+@shards_cli.command("copy-reference")
+def shards_copy_reference():
+    """
+    Copies the languages and topics of the main db to every shard.
+    Run it after adding a language or topic.
+    """
+    if not shards.enabled:
+        raise click.ClickException("Set SHARD_DATABASE_URIS first.")
+
+    shards.copy_reference_tables()
+    click.echo(f"Copied the languages and topics to {len(shards.engines)} shards.")
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+
+# Mimetypes worth compressing, anything else (images, etc..) is already compressed
+DEFAULT_MIMETYPES = [
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+]
+
+
+class Compress:
+    """
+    Gzip compresses responses for clients that send Accept-Encoding: gzip.
+    Initialize it like the db with compress.init_app(app).
+
+    Config:
+        COMPRESS_MIN_SIZE(int): Bodies smaller than this many bytes are sent as is.
+        COMPRESS_LEVEL(int): The gzip level, 1 is fastest and 9 is smallest.
+        COMPRESS_MIMETYPES(list): The mimetypes that will be compressed.
+        COMPRESS_CACHE_SIZE(int): How many compressed bodies to keep for reuse.
+    """
+
+    def __init__(self, app=None):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and registers the after request hook.
+
+        Args:
+            app (Flask): The flask app to compress responses for.
+        """
+        app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+        app.config.setdefault("COMPRESS_LEVEL", 6)
+        app.config.setdefault("COMPRESS_MIMETYPES", DEFAULT_MIMETYPES)
+        app.config.setdefault("COMPRESS_CACHE_SIZE", 64)
+
+        app.after_request(self.after_request)
+        app.extensions["compress"] = self
+
+    def after_request(self, response):
+        """
+        Compresses the response if the client accepts gzip and it is worth it.
+
+        Args:
+            response (Response): The response returned by the view.
+
+        Returns:
+            Response: The same response, compressed when possible.
+        """
+        config = current_app.config
+
+        if response.mimetype not in config["COMPRESS_MIMETYPES"]:
+            return response
+
+        # Caches in between must keep gzip and plain versions apart
+        response.vary.add("Accept-Encoding")
+
+        if (
+            request.accept_encodings["gzip"] <= 0
+            or response.status_code < 200
+            or response.status_code >= 300
+            or response.status_code == 204
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or "Content-Range" in response.headers
+        ):
+            return response
+
+        level = config["COMPRESS_LEVEL"]
+
+        if response.is_streamed:
+            # Generators have no length yet, so compress chunk by chunk as they are sent
+            response.response = _compress_stream(
+                response.iter_encoded(), level, response.response
+            )
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < config["COMPRESS_MIN_SIZE"]:
+                return response
+
+            response.set_data(self.compress(body, level, config["COMPRESS_CACHE_SIZE"]))
+
+        response.headers["Content-Encoding"] = "gzip"
+
+        # The gzip bytes are a different representation, so they need their own etag
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-gzip", weak)
+
+        return response
+
+    def compress(self, body, level=6, cache_size=64):
+        """
+        Gzips the body, reusing the compressed bytes if the same body was sent before.
+        Bodies served from a cache repeat exactly, so only the first one pays for gzip.
+
+        Args:
+            body (bytes): The uncompressed body.
+            level (int): The gzip level.
+            cache_size (int): The maximum number of compressed bodies to keep.
+
+        Returns:
+            bytes: The gzipped body.
+        """
+        key = (hashlib.sha1(body).digest(), level)
+
+        with self._lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return compressed
+
+        # mtime=0 so the same body always gives the same bytes (and the same etag)
+        compressed = gzip.compress(body, compresslevel=level, mtime=0)
+
+        with self._lock:
+            self.misses += 1
+            if cache_size > 0:
+                self._cache[key] = compressed
+                while len(self._cache) > cache_size:
+                    self._cache.popitem(last=False)
+
+        return compressed
+
+
+def _compress_stream(chunks, level, source):
+    """
+    Gzips a streamed body, flushing after every chunk so the client
+    gets each piece as soon as the view yields it.
+
+    Args:
+        chunks (iterable): The encoded body chunks.
+        level (int): The gzip level.
+        source (iterable): The view's original body, closed when the stream ends.
+
+    Yields:
+        bytes: The gzipped chunks.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Make sure the view's generator gets closed (and its context torn down)
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
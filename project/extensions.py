@@ -1,3 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
+from .assets import Assets
+from .auth import PasswordVerifier
+from .compression import Compress
+from .memory import MemoryDiagnostics
+from .metrics import Metrics
+from .page_cache import PageCache
+from .profiling import Profiler
+from .slow_queries import SlowQueryLog
+from .snapshots import Snapshots
 
 db = SQLAlchemy()
+compress = Compress()
+assets = Assets()
+page_cache = PageCache()
+profiler = Profiler()
+slow_queries = SlowQueryLog()
+snapshots = Snapshots()
+password_verifier = PasswordVerifier()
+metrics = Metrics()
+memory = MemoryDiagnostics()
@@ -0,0 +1,138 @@
+from datetime import datetime
+from sqlalchemy import func, select
+from .models import Member, member_topic_table
+
+# Largest page a client can ask for
+MAX_PER_PAGE = 500
+
+TRUE_VALUES = ("1", "true", "yes")
+FALSE_VALUES = ("0", "false", "no")
+
+
+def id_list(value):
+    """
+    Converts a comma separated string such as 1,2,3 to a list of ints.
+
+    Args:
+        value (str): The comma separated ids.
+
+    Returns:
+        list: The ids, or None if one of them is not a number.
+    """
+    try:
+        return [int(item) for item in value.split(",") if item.strip()]
+    except ValueError:
+        return None
+
+
+def whole_number(value):
+    """
+    Converts a string such as 12 to an int.
+
+    Args:
+        value (str): The number.
+
+    Returns:
+        int: The number, or None if it is not a whole number.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def member_filters(args):
+    """
+    Compiles the query string of GET /api/member into SQL conditions.
+    Each condition is backed by one of the Member indexes so only matching rows are read.
+    Example: /api/member?fav_language=1&topic=1,2&topic_match=all&location=Bos
+
+    Args:
+        args (MultiDict): The request query string.
+
+    Returns:
+        tuple: The list of conditions and a dict of errors by parameter.
+    """
+    conditions = []
+    errors = {}
+
+    if args.get("fav_language"):
+        language_ids = id_list(args["fav_language"])
+        if language_ids:
+            conditions.append(Member.fav_language.in_(language_ids))
+        else:
+            errors["fav_language"] = "Must be a comma separated list of language ids."
+
+    if args.get("topic"):
+        topic_ids = id_list(args["topic"])
+        topic_match = args.get("topic_match", "any")
+
+        if not topic_ids:
+            errors["topic"] = "Must be a comma separated list of topic ids."
+        elif topic_match not in ("any", "all"):
+            errors["topic_match"] = "Must be any or all."
+        else:
+            # Reads only the (topic_id, member_id) index, not the member table
+            member_ids = select(member_topic_table.c.member_id).where(
+                member_topic_table.c.topic_id.in_(topic_ids)
+            )
+            if topic_match == "all":
+                member_ids = member_ids.group_by(
+                    member_topic_table.c.member_id
+                ).having(
+                    func.count(member_topic_table.c.topic_id) == len(set(topic_ids))
+                )
+            conditions.append(Member.id.in_(member_ids))
+
+    learn_new_interest = args.get("learn_new_interest", "").lower()
+    if learn_new_interest in TRUE_VALUES:
+        conditions.append(Member.learn_new_interest.is_(True))
+    elif learn_new_interest in FALSE_VALUES:
+        conditions.append(Member.learn_new_interest.is_(False))
+    elif learn_new_interest:
+        errors["learn_new_interest"] = "Must be true or false."
+
+    for param, compare in (
+        ("first_learn_date_from", Member.first_learn_date.__ge__),
+        ("first_learn_date_to", Member.first_learn_date.__le__),
+    ):
+        if args.get(param):
+            try:
+                conditions.append(compare(datetime.strptime(args[param], "%Y-%m-%d")))
+            except ValueError:
+                errors[param] = "Must be a date in the format YYYY-MM-DD."
+
+    location = args.get("location")
+    if location:
+        # A range instead of LIKE 'prefix%' so sqlite can use the location index
+        conditions.append(Member.location >= location)
+        conditions.append(Member.location < location + "\U0010ffff")
+
+    return conditions, errors
+
+
+def pagination(args):
+    """
+    Reads page and per_page from the query string.
+    Pagination is optional, without either parameter all rows are returned.
+
+    Args:
+        args (MultiDict): The request query string.
+
+    Returns:
+        tuple: The page and per_page (None when not paginating), and a dict of errors.
+    """
+    if "page" not in args and "per_page" not in args:
+        return None, None, {}
+
+    errors = {}
+    # Parsed by hand, args.get(type=int) would swap page=abc for the default
+    page = whole_number(args.get("page", "1"))
+    per_page = whole_number(args.get("per_page", "50"))
+
+    if page is None or page < 1:
+        errors["page"] = "Must be a number of 1 or more."
+    if per_page is None or not 1 <= per_page <= MAX_PER_PAGE:
+        errors["per_page"] = f"Must be a number between 1 and {MAX_PER_PAGE}."
+
+    return page, per_page, errors
@@ -0,0 +1,152 @@
+import json
+from sqlalchemy.exc import SQLAlchemyError
+from . import queries
+from .extensions import db, password_verifier
+from .models import Member
+from .schemas import member_import_schema
+from .sharding import shards
+
+# Members saved per transaction, a failed chunk only loses these
+CHUNK_SIZE = 500
+
+# Longer lines are rejected without being parsed
+MAX_LINE_BYTES = 64 * 1024
+
+
+def read_lines(stream, max_bytes=MAX_LINE_BYTES):
+    """
+    Reads a stream one line at a time, never holding more than one line.
+
+    Args:
+        stream (file): The request body, such as request.stream.
+        max_bytes (int): The longest line accepted.
+
+    Yields:
+        tuple: The line number and the line, or None if it was too long.
+    """
+    number = 0
+    while True:
+        line = stream.readline(max_bytes + 1)
+        if not line:
+            return
+        number += 1
+
+        if len(line) > max_bytes and not line.endswith(b"\n"):
+            # Skip the rest of the long line
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_bytes)
+            yield number, None
+        else:
+            yield number, line
+
+
+def import_members(stream, chunk_size=CHUNK_SIZE):
+    """
+    Creates a member for each NDJSON line of a stream. Lines are validated
+    as they are read and saved in chunks of chunk_size, one commit per chunk,
+    so a bad line only fails itself and memory doesn't grow with the file.
+    Passwords are optional, members without one can't log in until they set one.
+
+    Args:
+        stream (file): The request body, one member object per line.
+        chunk_size (int): Members per commit.
+
+    Yields:
+        dict: A result per line, {"line": 3, "id": 12} or {"line": 4, "errors": {}}.
+            Bad lines are reported as they are read, saved ones after their commit.
+    """
+    # Languages and topics are small, check ids against them in memory
+    language_ids = {language.id for language in queries.languages(db.session)}
+    topic_ids = {topic.id for topic in queries.topics(db.session)}
+
+    chunk = []
+    for number, line in read_lines(stream):
+        if line is None:
+            yield {"line": number, "errors": {"line": "Line is too long."}}
+            continue
+        if not line.strip():
+            continue
+
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield {"line": number, "errors": {"line": "Not valid JSON."}}
+            continue
+
+        values, errors = member_import_schema.validate(data)
+        if not errors:
+            if values["fav_language"] not in language_ids:
+                errors["fav_language"] = "Unknown language id."
+            if not topic_ids.issuperset(values["interest_in_topics"]):
+                errors["interest_in_topics"] = "Unknown topic id."
+        if errors:
+            yield {"line": number, "errors": errors}
+            continue
+
+        chunk.append((number, values))
+        if len(chunk) >= chunk_size:
+            yield from save_chunk(chunk)
+            chunk = []
+
+    if chunk:
+        yield from save_chunk(chunk)
+
+
+def save_chunk(chunk):
+    """
+    Saves a chunk of valid members, in one transaction per shard.
+
+    Args:
+        chunk (list): The line numbers and values of the members.
+
+    Returns:
+        list: A result per line.
+    """
+    # Hash the passwords on the verifier's pool, they are the slow part
+    hashes = password_verifier.hash_passwords(
+        [values.pop("password", None) for number, values in chunk]
+    )
+
+    by_session = {}
+    for (number, values), password_hash in zip(chunk, hashes):
+        member_id = shards.new_member_id()
+        session = shards.session_for(member_id)
+        row = (number, member_id, values, password_hash)
+        by_session.setdefault(session, []).append(row)
+
+    results = []
+    for session, rows in by_session.items():
+        topics = {topic.id: topic for topic in queries.topics(session)}
+        members = []
+        for number, member_id, values, password_hash in rows:
+            # A topic added after the shard's copy of the topics was made
+            if not topics.keys() >= set(values["interest_in_topics"]):
+                errors = {"interest_in_topics": "Unknown topic id."}
+                results.append({"line": number, "errors": errors})
+                continue
+
+            member = Member(id=member_id)
+            member.set_fields(
+                values, [topics[topic_id] for topic_id in values["interest_in_topics"]]
+            )
+            member.password_hash = password_hash
+            members.append((number, member))
+
+        try:
+            session.add_all([member for number, member in members])
+            session.commit()
+        except SQLAlchemyError as error:
+            session.rollback()
+            # Only DBAPIError has orig, the driver's own message
+            message = str(getattr(error, "orig", None) or error)
+            results += [
+                {"line": number, "errors": {"db": message}}
+                for number, member in members
+            ]
+        else:
+            results += [{"line": number, "id": member.id} for number, member in members]
+
+        # Forget the saved members so memory stays flat
+        session.expunge_all()
+
+    return results
@@ -0,0 +1,332 @@
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from .models import Invalidation, Language, Member, Topic
+
+# Rows of these models are announced to the other processes when they change
+TRACKED_MODELS = (Member, Language, Topic)
+
+
+class InvalidationBus:
+    """
+    Tells every process of the app which members, languages and topics
+    another process changed, so in memory caches (the topic index, the page
+    cache) don't stay stale when several workers run, see flask serve.
+
+    Each commit that changes a tracked row also writes (entity, id) rows to
+    the invalidation table, in the same transaction. Every process polls the
+    table from a background thread, checking PRAGMA data_version first so an
+    idle poll costs no query. Other processes' changes are seen within
+    INVALIDATION_POLL_INTERVAL seconds. A process that couldn't poll for
+    INVALIDATION_RETENTION seconds may have missed pruned rows, so its
+    subscribers are told that everything changed.
+
+    A process doesn't get its own changes back from the table. Caches that
+    follow the session events themselves, like the topic index, don't need
+    them. Others subscribe with own_changes=True to also be called after
+    this process's commits:
+
+    invalidation.subscribe("member", topic_index.refresh)
+    invalidation.subscribe("topic", clear_pages, own_changes=True)
+
+    The callback gets the set of changed ids, or None when any of them may have
+    changed. Writes that skip the ORM, like flask seed, call publish themselves.
+    Members written to shards are announced in the main db's table too.
+    Subscribers and the poll thread belong to the app in current_app, so
+    subscribe inside its app context.
+
+    Config:
+        INVALIDATION_POLL_INTERVAL(float): Seconds between polls, the most a
+            cache is behind another process.
+        INVALIDATION_RETENTION(int): Seconds rows are kept before being deleted.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and listens to the session.
+
+        Args:
+            app (Flask): The flask app whose caches are kept in sync.
+        """
+        app.config.setdefault("INVALIDATION_POLL_INTERVAL", 0.5)
+        app.config.setdefault("INVALIDATION_RETENTION", 300)
+        app.extensions["invalidation"] = BusState()
+
+        db = app.extensions["sqlalchemy"]
+        for name, listener in (
+            ("after_flush", self._after_flush),
+            ("after_commit", self._after_commit),
+            ("after_soft_rollback", self._forget),
+        ):
+            if not event.contains(db.session, name, listener):
+                event.listen(db.session, name, listener)
+
+        # The thread is started by the first request of each process, so it
+        # also runs in forked workers and not in flask commands
+        app.before_request(self._ensure_started)
+
+    def subscribe(self, entity, callback, own_changes=False):
+        """
+        Calls a function when another process changes rows of an entity.
+
+        Args:
+            entity (str): The table name, member, language or topic.
+            callback (callable): Called with the set of ids, or None for all of them.
+            own_changes (bool): Also call it after this process's own commits.
+        """
+        state = current_app.extensions["invalidation"]
+        state.subscribers.setdefault(entity, []).append(callback)
+        if own_changes:
+            state.own_subscribers.setdefault(entity, []).append(callback)
+
+    def publish(self, entity, ids=None, connection=None):
+        """
+        Announces changed rows, for writes that don't go through the session.
+
+        Args:
+            entity (str): The table name.
+            ids (iterable): The changed ids, None for all of them.
+            connection (Connection): Write in this transaction, a new one by default.
+        """
+        ids = [None] if ids is None else list(ids)
+        rows = [
+            {
+                "entity": entity,
+                "entity_id": entity_id,
+                "origin": os.getpid(),
+                "created_at": time.time(),
+            }
+            for entity_id in ids
+        ]
+        if not rows:
+            return
+
+        if connection is not None:
+            connection.execute(insert(Invalidation.__table__), rows)
+        else:
+            db = current_app.extensions["sqlalchemy"]
+            with db.engine.begin() as connection:
+                connection.execute(insert(Invalidation.__table__), rows)
+
+    def _after_flush(self, session, flush_context):
+        """
+        Writes the tracked rows the flush changed, once per transaction.
+        """
+        published = session.info.setdefault("invalidations", set())
+        changed = {}
+        dirty = [
+            instance
+            for instance in session.dirty
+            # A member's topics belong to the member, not to the topic rows
+            if session.is_modified(
+                instance, include_collections=isinstance(instance, Member)
+            )
+        ]
+        for instance in (*session.new, *dirty, *session.deleted):
+            if isinstance(instance, TRACKED_MODELS):
+                key = (instance.__tablename__, instance.id)
+                if key not in published:
+                    published.add(key)
+                    changed.setdefault(key[0], []).append(key[1])
+
+        if not changed:
+            return
+        # The main db's connection, also in a shard's session, see sharding.py
+        connection = session.connection(bind_arguments={"mapper": Invalidation})
+        for entity, ids in changed.items():
+            self.publish(entity, ids, connection)
+
+    def _after_commit(self, session):
+        """
+        Calls the own_changes subscribers with the rows the transaction changed.
+        """
+        changed = {}
+        for entity, entity_id in session.info.pop("invalidations", ()):
+            changed.setdefault(entity, set()).add(entity_id)
+        if changed:
+            state = current_app.extensions["invalidation"]
+            self._notify(state.own_subscribers, changed)
+
+    def _forget(self, session, *args):
+        session.info.pop("invalidations", None)
+
+    def _notify(self, subscribers, changed):
+        for entity, ids in changed.items():
+            for callback in subscribers.get(entity, ()):
+                try:
+                    callback(ids)
+                except Exception:
+                    current_app.logger.exception("Invalidation subscriber error")
+
+    def _ensure_started(self):
+        state = current_app.extensions["invalidation"]
+        if state.pid == os.getpid():
+            return
+
+        with state.lock:
+            if state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            try:
+                # A forked worker starts after the rows its parent already had
+                state.last_id = self._newest_id()
+            except SQLAlchemyError:
+                # Reads still work, writes need the table, see db.create_all()
+                current_app.logger.exception(
+                    "Could not read the invalidation table, caches won't "
+                    "follow other processes"
+                )
+                return
+            state.last_poll = time.monotonic()
+            state.stop = threading.Event()
+            state.thread = threading.Thread(
+                target=self._run,
+                args=(current_app._get_current_object(), state.stop),
+                name="invalidation-bus",
+                daemon=True,
+            )
+            state.thread.start()
+
+    def stop(self):
+        """
+        Stops this process's poll thread, the next request starts it again.
+        """
+        state = current_app.extensions["invalidation"]
+        with state.lock:
+            state.stop.set()
+            if state.thread is not None and state.pid == os.getpid():
+                state.thread.join()
+            state.thread = None
+            state.pid = None
+
+    def _newest_id(self):
+        db = current_app.extensions["sqlalchemy"]
+        with db.engine.connect() as connection:
+            return connection.execute(select(func.max(Invalidation.id))).scalar() or 0
+
+    def _run(self, app, stop):
+        """
+        The poll loop of an app, one per process, until stop is set.
+        """
+        config = app.config
+        data_version = None
+        last_prune = 0
+        connection = None
+
+        while not stop.wait(config["INVALIDATION_POLL_INTERVAL"]):
+            try:
+                with app.app_context():
+                    db = app.extensions["sqlalchemy"]
+                    if connection is None:
+                        connection = db.engine.connect()
+                        data_version = None
+
+                    # data_version only changes when another connection commits
+                    if db.engine.dialect.name == "sqlite":
+                        version = connection.exec_driver_sql(
+                            "PRAGMA data_version"
+                        ).scalar()
+                        changed = version != data_version
+                        data_version = version
+                        connection.rollback()
+                    else:
+                        changed = True
+
+                    if changed or self._behind():
+                        self.poll(connection)
+                    app.extensions["invalidation"].last_poll = time.monotonic()
+
+                    prune_every = config["INVALIDATION_RETENTION"] / 2
+                    if time.monotonic() - last_prune > prune_every:
+                        self.prune()
+                        last_prune = time.monotonic()
+            except Exception:
+                app.logger.exception("Invalidation bus error")
+                if connection is not None:
+                    connection.close()
+                    connection = None
+
+        if connection is not None:
+            connection.close()
+
+    def _behind(self):
+        state = current_app.extensions["invalidation"]
+        retention = current_app.config["INVALIDATION_RETENTION"]
+        return time.monotonic() - state.last_poll > retention
+
+    def poll(self, connection):
+        """
+        Reads the rows added since the last poll and calls the subscribers.
+        Writers commit one at a time in sqlite, so ids show up in order.
+
+        Args:
+            connection (Connection): The connection to read with.
+        """
+        state = current_app.extensions["invalidation"]
+        table = Invalidation.__table__
+        if self._behind():
+            # Rows may have been pruned while this process wasn't polling
+            rows = [(entity, None, None) for entity in state.subscribers]
+            newest = connection.execute(select(func.max(table.c.id))).scalar()
+            state.last_id = newest or 0
+        else:
+            rows = connection.execute(
+                select(table.c.entity, table.c.entity_id, table.c.origin, table.c.id)
+                .where(table.c.id > state.last_id)
+                .order_by(table.c.id)
+            ).all()
+            if rows:
+                state.last_id = rows[-1].id
+        connection.rollback()
+
+        changed = {}
+        pid = os.getpid()
+        for entity, entity_id, origin, *_ in rows:
+            if origin == pid:
+                continue
+            if entity_id is None:
+                changed[entity] = None
+            elif changed.get(entity, set()) is not None:
+                changed.setdefault(entity, set()).add(entity_id)
+
+        self._notify(state.subscribers, changed)
+
+    def prune(self):
+        """
+        Deletes the rows older than INVALIDATION_RETENTION.
+        """
+        db = current_app.extensions["sqlalchemy"]
+        oldest = time.time() - current_app.config["INVALIDATION_RETENTION"]
+        with db.engine.begin() as connection:
+            connection.execute(
+                delete(Invalidation.__table__).where(
+                    Invalidation.__table__.c.created_at < oldest
+                )
+            )
+
+
+class BusState:
+    """
+    The subscribers of one app and its poll thread in this process.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.own_subscribers = {}
+        self.last_id = 0
+        self.last_poll = 0
+        self.thread = None
+        self.stop = threading.Event()
+        self.pid = None
+        self.lock = threading.Lock()
+
+
+# The bus of the app, it needs the models so it lives here and not in extensions.py
+invalidation = InvalidationBus()
@@ -0,0 +1,307 @@
+import json
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, event, insert, inspect, or_, update
+from .models import Job
+
+
+class JobQueue:
+    """
+    A small durable job queue kept in the job table and run by worker threads.
+    A job is added in the same transaction as the request's own changes, so
+    it only exists once they are committed, and it is dropped if they roll back.
+
+    Register a task and queue it from a view:
+
+    @jobs.task("send_welcome")
+    def send_welcome(member_id):
+        ...
+
+    jobs.enqueue("send_welcome", member_id=member.id)
+    db.session.commit()
+
+    A job that raises is retried with exponential backoff. A job whose
+    worker doesn't finish within the visibility timeout (say the process
+    died) is picked up again, so tasks must be safe to run twice.
+
+    The worker threads start with the first request of each process, so
+    flask commands and the flask serve master don't poll the table, and
+    every flask serve worker runs its own. Tasks are shared by every app,
+    the threads belong to the app they were started for.
+
+    Config:
+        JOB_WORKERS(int): Worker threads per process serving requests, 0 runs none.
+        JOB_POLL_INTERVAL(float): Seconds between checks for due jobs.
+        JOB_VISIBILITY_TIMEOUT(int): Seconds a worker has to finish a job.
+        JOB_MAX_ATTEMPTS(int): Attempts before a job is marked failed.
+        JOB_RETRY_BACKOFF(float): Seconds before the first retry, doubled each time.
+    """
+
+    def __init__(self, app=None):
+        self.tasks = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and listens for commits that queue jobs.
+
+        Args:
+            app (Flask): The flask app the jobs run in.
+        """
+        app.config.setdefault("JOB_WORKERS", 1)
+        app.config.setdefault("JOB_POLL_INTERVAL", 1.0)
+        app.config.setdefault("JOB_VISIBILITY_TIMEOUT", 60)
+        app.config.setdefault("JOB_MAX_ATTEMPTS", 5)
+        app.config.setdefault("JOB_RETRY_BACKOFF", 2.0)
+
+        app.extensions["jobs"] = WorkerState()
+
+        # Wake the workers as soon as a transaction with new jobs commits
+        db = app.extensions["sqlalchemy"]
+        if not event.contains(db.session, "after_commit", self._after_commit):
+            event.listen(db.session, "after_commit", self._after_commit)
+
+        if app.config["JOB_WORKERS"]:
+            app.before_request(self._ensure_started)
+
+    @property
+    def _state(self):
+        return current_app.extensions["jobs"]
+
+    @property
+    def threads(self):
+        """
+        list: The worker threads of the current app in this process.
+        """
+        return self._state.threads
+
+    def _ensure_started(self):
+        state = self._state
+        if state.pid == os.getpid():
+            return
+
+        with state.lock:
+            if state.pid == os.getpid():
+                return
+            state.pid = os.getpid()
+            self.start_workers()
+
+    def start_workers(self):
+        """
+        Starts JOB_WORKERS threads in this process, if the job table exists.
+        """
+        app = current_app._get_current_object()
+        state = self._state
+        db = app.extensions["sqlalchemy"]
+        if not inspect(db.engine).has_table(Job.__tablename__):
+            # Otherwise every poll would log the error, see db.create_all()
+            app.logger.error("No job table, background jobs won't run")
+            return
+
+        # Threads of the parent process don't survive a fork
+        state.threads = []
+        state.wake = threading.Event()
+        for number in range(app.config["JOB_WORKERS"]):
+            thread = threading.Thread(
+                target=self._work,
+                args=(app, state),
+                name=f"job-worker-{number}",
+                daemon=True,
+            )
+            thread.start()
+            state.threads.append(thread)
+
+    def task(self, name=None):
+        """
+        Registers a function as a task jobs can run.
+
+        Args:
+            name (str): The task name, the function name by default.
+
+        Returns:
+            callable: The decorator.
+        """
+
+        def decorator(func):
+            self.tasks[name or func.__name__] = func
+            return func
+
+        return decorator
+
+    def enqueue(self, name, delay=0, **payload):
+        """
+        Queues a task in the current db session. It is only seen by the
+        workers once the session is committed.
+
+        Args:
+            name (str): The task name.
+            delay (float): Seconds to wait before running it.
+            **payload: The task arguments, they must be json serializable.
+
+        Returns:
+            Job: The queued job.
+        """
+        db = current_app.extensions["sqlalchemy"]
+        job = Job(**self._job_values(name, delay, payload))
+        db.session.add(job)
+        db.session.info["jobs_enqueued"] = True
+        return job
+
+    def enqueue_from_flush(self, session, name, delay=0, **payload):
+        """
+        Queues a task from a session event like after_flush, where objects
+        can't be added to the session. The row is written on the session's
+        connection to the main db, shard sessions included, so it commits
+        or rolls back with the rest of the transaction.
+
+        Args:
+            session (Session): The session being flushed.
+            name (str): The task name.
+            delay (float): Seconds to wait before running it.
+            **payload: The task arguments, they must be json serializable.
+        """
+        connection = session.connection(bind_arguments={"mapper": Job})
+        connection.execute(
+            insert(Job.__table__), [self._job_values(name, delay, payload)]
+        )
+        session.info["jobs_enqueued"] = True
+
+    def _job_values(self, name, delay, payload):
+        if name not in self.tasks:
+            raise KeyError(f"Unknown task {name}")
+
+        return {
+            "name": name,
+            "payload": json.dumps(payload),
+            "status": "pending",
+            "attempts": 0,
+            "run_at": datetime.now() + timedelta(seconds=delay),
+        }
+
+    def _after_commit(self, session):
+        if session.info.pop("jobs_enqueued", False):
+            self._state.wake.set()
+
+    def _work(self, app, state):
+        """
+        The worker thread loop, runs due jobs and waits when there are none.
+        """
+        poll_interval = app.config["JOB_POLL_INTERVAL"]
+        while True:
+            try:
+                with app.app_context():
+                    ran = self.run_next()
+            except Exception:
+                app.logger.exception("Job worker error")
+                ran = False
+
+            if not ran:
+                state.wake.wait(poll_interval)
+                state.wake.clear()
+
+    def claim_next(self):
+        """
+        Takes the next due job, or one whose worker ran out of time.
+        The update only matches if nobody claimed it in between, so two
+        workers never get the same attempt.
+
+        Returns:
+            Job: The claimed job, or None if there is nothing to do.
+        """
+        db = current_app.extensions["sqlalchemy"]
+        config = current_app.config
+
+        while True:
+            now = datetime.now()
+            job = (
+                Job.query.filter(
+                    or_(
+                        and_(Job.status == "pending", Job.run_at <= now),
+                        and_(Job.status == "running", Job.locked_until < now),
+                    )
+                )
+                .order_by(Job.run_at)
+                .first()
+            )
+            if job is None:
+                db.session.rollback()
+                return None
+
+            locked_until = now + timedelta(seconds=config["JOB_VISIBILITY_TIMEOUT"])
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.attempts == job.attempts)
+                .values(
+                    status="running",
+                    attempts=Job.attempts + 1,
+                    locked_until=locked_until,
+                )
+            ).rowcount
+            db.session.commit()
+
+            if claimed:
+                return db.session.get(Job, job.id)
+
+    def run_next(self):
+        """
+        Runs one job and records how it went.
+
+        Returns:
+            bool: True if a job was run.
+        """
+        db = current_app.extensions["sqlalchemy"]
+        config = current_app.config
+
+        job = self.claim_next()
+        if job is None:
+            return False
+
+        job_id, name, attempts = job.id, job.name, job.attempts
+        payload = json.loads(job.payload)
+
+        # Only this attempt may finish the job, a later claim bumps attempts
+        mine = and_(Job.id == job_id, Job.attempts == attempts)
+
+        try:
+            self.tasks[name](**payload)
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+
+            if attempts >= config["JOB_MAX_ATTEMPTS"]:
+                values = {"status": "failed", "last_error": error}
+                current_app.logger.error("Job %s (%s) failed: %s", job_id, name, error)
+            else:
+                backoff = config["JOB_RETRY_BACKOFF"] * 2 ** (attempts - 1)
+                values = {
+                    "status": "pending",
+                    "run_at": datetime.now() + timedelta(seconds=backoff),
+                    "last_error": error,
+                }
+            db.session.execute(update(Job).where(mine).values(**values))
+        else:
+            db.session.execute(Job.__table__.delete().where(mine))
+
+        db.session.commit()
+        return True
+
+
+class WorkerState:
+    """
+    The worker threads of one app in this process.
+    """
+
+    def __init__(self):
+        self.threads = []
+        self.wake = threading.Event()
+        self.pid = None
+        self.lock = threading.Lock()
+
+
+# The queue of the app, it needs the models so it lives here and not in extensions.py
+jobs = JobQueue()
@@ -0,0 +1,343 @@
+import http.client
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+from .server import PreforkServer
+
+# The kinds of requests the load generator can send, see build_request
+REQUEST_TYPES = ("list", "get", "create", "form")
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in log-linear buckets, like an HDR histogram.
+    Each bucket is at most 1/64 (about 1.5%) wide, so percentiles are that
+    accurate at any scale while memory stays a few hundred buckets.
+    """
+
+    SUB_BUCKET_BITS = 6
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        """
+        Adds a latency.
+
+        Args:
+            seconds (float): The latency.
+        """
+        micros = max(int(seconds * 1_000_000), 1)
+        shift = max(micros.bit_length() - self.SUB_BUCKET_BITS, 0)
+        bucket = (micros >> shift) << shift
+
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.max = max(self.max, micros)
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram to this one.
+
+        Args:
+            other (LatencyHistogram): The histogram to add.
+        """
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        Gets the latency that percent of the requests were faster than.
+
+        Args:
+            percent (float): Such as 99.9.
+
+        Returns:
+            float: The latency in milliseconds.
+        """
+        if not self.total:
+            return 0.0
+
+        rank = self.total * percent / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(bucket, self.max) / 1000
+        return self.max / 1000
+
+
+def parse_mix(mix):
+    """
+    Reads a request mix such as list=1,get=10,create=1,form=1.
+
+    Args:
+        mix (str): The request types and their weights.
+
+    Returns:
+        tuple: The request types and their weights.
+    """
+    types, weights = [], []
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in REQUEST_TYPES:
+            raise ValueError(f"Unknown request type {name}, use {REQUEST_TYPES}")
+        types.append(name)
+        weights.append(float(weight or 1))
+    return types, weights
+
+
+def build_request(kind, rng, max_id):
+    """
+    Builds one request of the mix.
+
+    Args:
+        kind (str): The request type.
+        rng (Random): The random generator.
+        max_id (int): The highest member id in the db.
+
+    Returns:
+        tuple: The method, path, body and headers.
+    """
+    if kind == "list":
+        page = rng.randint(1, max(max_id // 20, 1))
+        return "GET", f"/api/member?page={page}&per_page=20", None, {}
+
+    if kind == "get":
+        return "GET", f"/api/member/{rng.randint(1, max_id)}", None, {}
+
+    email = f"load{rng.getrandbits(48)}@example.com"
+
+    if kind == "create":
+        body = {
+            "email": email,
+            "password": "password",
+            "location": "Boston",
+            "first_learn_date": "2015-06-01",
+            "fav_language": {"id": 1},
+            "about": "Made by the load generator.",
+            "learn_new_interest": True,
+            "interest_in_topics": [{"id": 1}],
+        }
+        headers = {"Content-Type": "application/json"}
+        return "POST", "/api/member", json.dumps(body), headers
+
+    body = urlencode(
+        {
+            "email": email,
+            "password": "password",
+            "location": "Boston",
+            "first_learn_date": "2015-06-01",
+            "fav_language": 1,
+            "about": "Made by the load generator.",
+            "learn_new_interest": "yes",
+            "interest_in_topics": 1,
+        }
+    )
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    return "POST", "/", body, headers
+
+
+class _Client(threading.Thread):
+    """
+    Sends the requests it takes from the schedule and records their latency.
+    Latency is measured from when the request was due, not when it was sent,
+    so a server that falls behind shows it in the numbers.
+    """
+
+    def __init__(self, base_url, schedule, max_id, seed):
+        super().__init__(daemon=True)
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.schedule = schedule
+        self.max_id = max_id
+        self.rng = random.Random(seed)
+        self.connection = None
+
+        self.histograms = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def run(self):
+        while True:
+            item = self.schedule.get()
+            if item is None:
+                return
+
+            due, kind = item
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+            ok = self.send(*build_request(kind, self.rng, self.max_id))
+
+            histogram = self.histograms.setdefault(kind, LatencyHistogram())
+            histogram.record(time.perf_counter() - due)
+            if not ok:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def send(self, method, path, body, headers):
+        """
+        Sends a request, reconnecting when the server closed the connection.
+
+        Returns:
+            bool: True if the response was a 2xx or 3xx.
+        """
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=30
+                )
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            response.read()
+
+            status = response.status
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+            return status < 400
+        except (OSError, http.client.HTTPException):
+            self.statuses["error"] = self.statuses.get("error", 0) + 1
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = None
+            return False
+
+
+def run_load(base_url, rate, duration, concurrency, mix, max_id, seed=0):
+    """
+    Sends requests at a fixed rate for a while and measures them.
+    The requests are scheduled ahead of time (open loop), so if the server
+    can't keep up, requests queue and their latency grows.
+
+    Args:
+        base_url (str): Such as http://127.0.0.1:8000.
+        rate (float): Requests per second to send.
+        duration (float): Seconds to run.
+        concurrency (int): Client threads, the most requests in flight at once.
+        mix (str): The request mix, see parse_mix.
+        max_id (int): The highest member id in the db.
+        seed (int): The random seed.
+
+    Returns:
+        dict: The throughput, errors, statuses and latency histograms by request type.
+    """
+    types, weights = parse_mix(mix)
+    rng = random.Random(seed)
+    schedule = queue.Queue()
+
+    clients = [
+        _Client(base_url, schedule, max_id, seed + number + 1)
+        for number in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+
+    start = time.perf_counter()
+    total = int(rate * duration)
+    for number in range(total):
+        schedule.put((start + number / rate, rng.choices(types, weights)[0]))
+    for _ in clients:
+        schedule.put(None)
+
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    histograms, errors, statuses = {}, {}, {}
+    for client in clients:
+        for kind, histogram in client.histograms.items():
+            histograms.setdefault(kind, LatencyHistogram()).merge(histogram)
+        for kind, count in client.errors.items():
+            errors[kind] = errors.get(kind, 0) + count
+        for status, count in client.statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+    return {
+        "rate": rate,
+        "requests": total,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0,
+        "errors": errors,
+        "statuses": statuses,
+        "histograms": histograms,
+    }
+
+
+def wait_for_server(base_url, timeout=10):
+    """
+    Waits until the server accepts connections.
+
+    Args:
+        base_url (str): The url of the server.
+        timeout (float): Seconds to wait.
+
+    Returns:
+        bool: True if the server is up.
+    """
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(
+                parts.hostname, parts.port, timeout=1
+            )
+            connection.connect()
+            connection.close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(app, workers):
+    """
+    Forks a process that serves the app with flask serve's prefork server
+    on a free local port. Its request log is silenced so it doesn't mix
+    with the report.
+
+    Args:
+        app (Flask): The app to serve.
+        workers (int): The number of worker processes.
+
+    Returns:
+        tuple: The pid of the server and its url.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    pid = os.fork()
+    if pid == 0:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 2)
+        try:
+            PreforkServer(app, "127.0.0.1", port, workers).run()
+        finally:
+            os._exit(0)
+
+    return pid, f"http://127.0.0.1:{port}"
+
+
+def stop_server(pid):
+    """
+    Stops a server started with start_server.
+
+    Args:
+        pid (int): The pid of the server.
+    """
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
@@ -0,0 +1,278 @@
+import gc
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from flask import current_app, g, request
+
+# The most stack frames tracemalloc keeps per allocation
+MAX_FRAMES = 65535
+
+# Allocations made by tracemalloc and the import system are left out of snapshots
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class MemoryDiagnostics:
+    """
+    Finds where a worker's memory goes, from the admin routes in views/admin.py:
+    tracemalloc snapshots and their diffs by file and line, the peak
+    allocation of sampled requests by route, and counts of live ORM objects.
+
+    tracemalloc is off until started, it makes the process slower and bigger
+    while it runs. Everything is per process, with flask serve each call
+    reaches one worker, the responses include its pid.
+
+    Only one sampled request is measured at a time, since the peak is shared
+    by the process, but other requests running meanwhile still add to it.
+
+    Config:
+        MEMORY_SAMPLE_RATE(float): The share of requests whose peak is measured
+            while tracing, 0.01 is 1%.
+        MEMORY_MAX_SNAPSHOTS(int): How many snapshots are kept, the oldest are dropped.
+    """
+
+    def __init__(self, app=None):
+        # tracemalloc is one per process, so its snapshots are too
+        self.snapshots = {}
+        self.next_id = 1
+        self.request_peaks = {}
+        self._lock = threading.Lock()
+        self._measuring = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and registers the request hooks.
+
+        Args:
+            app (Flask): The flask app to watch.
+        """
+        app.config.setdefault("MEMORY_SAMPLE_RATE", 0.01)
+        app.config.setdefault("MEMORY_MAX_SNAPSHOTS", 5)
+
+        app.extensions["memory"] = self
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def start(self, frames=1):
+        """
+        Starts tracemalloc.
+
+        Args:
+            frames (int): Stack frames kept per allocation, more cost more memory.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        """
+        Stops tracemalloc and drops the snapshots, they can't be compared any more.
+        """
+        tracemalloc.stop()
+        with self._lock:
+            self.snapshots.clear()
+
+    def status(self):
+        """
+        Gets the state of the diagnostics.
+
+        Returns:
+            dict: The pid, whether tracemalloc runs, the traced and resident
+                memory in bytes and the snapshots kept.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            snapshots = [
+                {"id": snapshot_id, "taken_at": taken_at}
+                for snapshot_id, (taken_at, snapshot) in self.snapshots.items()
+            ]
+        return {
+            "pid": os.getpid(),
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "rss_bytes": rss_bytes(),
+            "snapshots": snapshots,
+        }
+
+    def take_snapshot(self):
+        """
+        Takes a tracemalloc snapshot and keeps it to diff later.
+
+        Returns:
+            int: The snapshot id.
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running.")
+
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+        with self._lock:
+            snapshot_id = self.next_id
+            self.next_id += 1
+            self.snapshots[snapshot_id] = (time.time(), snapshot)
+            while len(self.snapshots) > current_app.config["MEMORY_MAX_SNAPSHOTS"]:
+                del self.snapshots[next(iter(self.snapshots))]
+        return snapshot_id
+
+    def _snapshot(self, snapshot_id):
+        with self._lock:
+            if snapshot_id not in self.snapshots:
+                raise KeyError(snapshot_id)
+            return self.snapshots[snapshot_id][1]
+
+    def top(self, snapshot_id, group_by="lineno", limit=20):
+        """
+        Gets the places holding the most memory in a snapshot.
+
+        Args:
+            snapshot_id (int): The snapshot.
+            group_by (str): lineno, filename or traceback.
+            limit (int): How many places to return.
+
+        Returns:
+            list: The places with their size in bytes and number of blocks.
+        """
+        stats = self._snapshot(snapshot_id).statistics(group_by)
+        return [
+            {
+                "where": format_traceback(stat.traceback),
+                "bytes": stat.size,
+                "blocks": stat.count,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def diff(self, old_id, new_id, group_by="lineno", limit=20):
+        """
+        Compares two snapshots, the places that grew the most come first.
+
+        Args:
+            old_id (int): The earlier snapshot.
+            new_id (int): The later snapshot.
+            group_by (str): lineno, filename or traceback.
+            limit (int): How many places to return.
+
+        Returns:
+            list: The places with their size and growth in bytes and blocks.
+        """
+        stats = self._snapshot(new_id).compare_to(self._snapshot(old_id), group_by)
+        return [
+            {
+                "where": format_traceback(stat.traceback),
+                "bytes": stat.size,
+                "bytes_diff": stat.size_diff,
+                "blocks": stat.count,
+                "blocks_diff": stat.count_diff,
+            }
+            for stat in stats[:limit]
+        ]
+
+    def orm_objects(self, limit=20):
+        """
+        Counts the live ORM objects by model, and the other objects by type.
+        It walks every object the garbage collector tracks, so it takes a
+        moment on a big process.
+
+        Args:
+            limit (int): How many other types to return.
+
+        Returns:
+            dict: The counts by model and the most common other types.
+        """
+        model = current_app.extensions["sqlalchemy"].Model
+        models = {mapper.class_ for mapper in model.registry.mappers}
+
+        gc.collect()
+        instances = Counter()
+        types = Counter()
+        for obj in gc.get_objects():
+            cls = type(obj)
+            if cls in models:
+                instances[cls.__name__] += 1
+            else:
+                types[cls.__name__] += 1
+
+        return {
+            "pid": os.getpid(),
+            "models": dict(instances.most_common()),
+            "types": dict(types.most_common(limit)),
+        }
+
+    def _before_request(self):
+        if not tracemalloc.is_tracing():
+            return
+        if random.random() >= current_app.config["MEMORY_SAMPLE_RATE"]:
+            return
+        # The peak is per process, so only one request is measured at a time
+        if not self._measuring.acquire(blocking=False):
+            return
+
+        tracemalloc.reset_peak()
+        g.memory_start = tracemalloc.get_traced_memory()[0]
+
+    def _teardown_request(self, exception=None):
+        start = g.pop("memory_start", None)
+        if start is None:
+            return
+
+        try:
+            if tracemalloc.is_tracing():
+                peak = tracemalloc.get_traced_memory()[1] - start
+                self._record_peak(request.endpoint or "(not found)", peak)
+        finally:
+            self._measuring.release()
+
+    def _record_peak(self, endpoint, peak):
+        with self._lock:
+            entry = self.request_peaks.setdefault(
+                endpoint, {"endpoint": endpoint, "count": 0, "total": 0, "max": 0}
+            )
+            entry["count"] += 1
+            entry["total"] += peak
+            entry["max"] = max(entry["max"], peak)
+
+    def peaks(self):
+        """
+        Gets the peak allocations of the sampled requests by route.
+
+        Returns:
+            list: The routes with the most memory first, in bytes above
+                what the process held when the request started.
+        """
+        with self._lock:
+            entries = [dict(entry) for entry in self.request_peaks.values()]
+        for entry in entries:
+            entry["mean"] = entry.pop("total") // entry["count"]
+        return sorted(entries, key=lambda entry: entry["max"], reverse=True)
+
+    def reset_peaks(self):
+        with self._lock:
+            self.request_peaks.clear()
+
+
+def format_traceback(traceback):
+    return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+
+
+def rss_bytes():
+    """
+    Gets the resident memory of the process, None where /proc isn't there.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
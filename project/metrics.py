@@ -0,0 +1,546 @@
+import bisect
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from .server import post_fork, worker_exit
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The labels of db queries run outside a request
+NO_ROUTE = (("blueprint", ""), ("endpoint", ""))
+
+# name -> (type, help) of every metric the app exports
+METRICS = {
+    "http_requests_total": ("counter", "Requests handled, by route and status."),
+    "http_request_duration_seconds": ("histogram", "Time spent handling requests."),
+    "http_requests_in_progress": ("gauge", "Requests being handled right now."),
+    "db_queries_total": ("counter", "SQL statements run, by route."),
+    "db_query_seconds_total": ("counter", "Time spent running SQL statements."),
+    "password_hash_duration_seconds": (
+        "histogram",
+        "Time spent hashing or checking passwords.",
+    ),
+}
+
+
+class ThreadValues:
+    """
+    The metric values of one thread. Only its own thread writes to it,
+    so recording a value takes no lock.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+
+class Metrics:
+    """
+    Exports request, db and password metrics at /metrics in the Prometheus
+    text format.
+
+    Each thread adds to its own ThreadValues, so requests never wait on a
+    shared lock to count themselves. A scrape adds the threads up. The values
+    of threads that ended are folded into one retired total, so threads that
+    come and go don't make the list grow. Every app has its own values, see
+    MetricsRegistry.
+
+    With flask serve every worker is a separate process. Set METRICS_DIR and
+    each worker writes its totals there every METRICS_WRITE_INTERVAL
+    seconds and when it exits. The worker answering the scrape writes its
+    own file first, then adds up all the files, so counters never go down
+    between scrapes. Counters of workers that exited are kept. Their gauges
+    are not, since those requests are over.
+
+    The metrics are off by default, the route shows the app's routes and
+    traffic, so set METRICS_TOKEN too unless only Prometheus can reach it.
+
+    Config:
+        METRICS_ENABLED(bool): Adds the /metrics route and records the metrics.
+        METRICS_TOKEN(str): If set, scrapes must send Authorization: Bearer <token>.
+        METRICS_DIR(str): A folder the workers of flask serve share, None if
+            there is one process.
+        METRICS_WRITE_INTERVAL(float): Seconds between writes to METRICS_DIR.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config, adds the /metrics route and the hooks.
+
+        Args:
+            app (Flask): The flask app to measure.
+        """
+        app.config.setdefault("METRICS_ENABLED", False)
+        app.config.setdefault("METRICS_TOKEN", None)
+        app.config.setdefault("METRICS_DIR", None)
+        app.config.setdefault("METRICS_WRITE_INTERVAL", 5.0)
+
+        registry = MetricsRegistry(app.config["METRICS_ENABLED"])
+        app.extensions["metrics"] = registry
+        if not registry.enabled:
+            return
+
+        app.add_url_rule("/metrics", "metrics", self.view)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        # The listeners are the registry's own methods, so each app's
+        # engines count into that app's values. Shards are counted too,
+        # init the shards before the metrics, see sharding.py
+        with app.app_context():
+            engines = [app.extensions["sqlalchemy"].engine]
+        if "shards" in app.extensions:
+            engines += app.extensions["shards"].engines
+        for engine in engines:
+            for name, listener in (
+                ("before_cursor_execute", registry.before_cursor_execute),
+                ("after_cursor_execute", registry.after_cursor_execute),
+                ("handle_error", registry.handle_error),
+            ):
+                event.listen(engine, name, listener)
+
+        verifier = app.extensions.get("password_verifier")
+        if verifier is not None:
+            verifier.listeners.append(registry.observe_password)
+
+    @property
+    def _registry(self):
+        return current_app.extensions["metrics"]
+
+    @property
+    def enabled(self):
+        """
+        bool: If the current app records metrics.
+        """
+        return self._registry.enabled
+
+    def inc(self, name, labels=(), amount=1):
+        """
+        Adds to a counter of the current app, see MetricsRegistry.inc.
+        """
+        self._registry.inc(name, labels, amount)
+
+    def observe(self, name, value, labels=()):
+        """
+        Adds a value to a histogram of the current app, see MetricsRegistry.observe.
+        """
+        self._registry.observe(name, value, labels)
+
+    def totals(self):
+        """
+        Adds up the values of every thread of this process.
+
+        Returns:
+            dict: counters, gauges and histograms by (name, labels).
+        """
+        return self._registry.totals()
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_labels = route_labels()
+        self.inc("http_requests_in_progress", g.metrics_labels)
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exception=None):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        labels = g.pop("metrics_labels")
+        status = g.pop("metrics_status", 500)
+
+        self.inc("http_requests_in_progress", labels, -1)
+        self.inc(
+            "http_requests_total",
+            labels + (("method", request.method), ("status", str(status))),
+        )
+        self.observe(
+            "http_request_duration_seconds", time.perf_counter() - start, labels
+        )
+
+    def write(self):
+        """
+        Writes this process's totals to METRICS_DIR/<pid>.json.
+        The file is replaced in one step, readers never see half of it.
+        """
+        self._registry.write(current_app.config["METRICS_DIR"])
+
+    def start_writer(self):
+        """
+        Starts the thread that writes the totals, when METRICS_DIR is set.
+        """
+        self._registry.start_writer(current_app._get_current_object())
+
+    def clear_dir(self):
+        """
+        Deletes the files of an earlier run, flask serve calls it before forking.
+        """
+        folder = current_app.config["METRICS_DIR"]
+        if not folder or not self.enabled:
+            return
+        os.makedirs(folder, exist_ok=True)
+        for path in glob.glob(os.path.join(folder, "*.json")):
+            os.remove(path)
+
+    def collect(self):
+        """
+        Gets the totals of every worker. With METRICS_DIR this process writes
+        its file first and only the files are added up. Each file only grows,
+        while this process's live values would be ahead of its file and make
+        the total drop on the next scrape answered by another worker.
+
+        Returns:
+            dict: counters, gauges and histograms by (name, labels).
+        """
+        folder = current_app.config["METRICS_DIR"]
+        if not folder:
+            return self.totals()
+
+        try:
+            self.write()
+        except OSError:
+            current_app.logger.exception("Could not write the metrics file")
+
+        totals = {"counters": {}, "gauges": {}, "histograms": {}}
+        for path in glob.glob(os.path.join(folder, "*.json")):
+            pid = int(os.path.basename(path).split(".")[0])
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+
+            alive = process_alive(pid)
+            for name, labels, value in data["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                totals["counters"][key] = totals["counters"].get(key, 0) + value
+            if alive:
+                for name, labels, value in data["gauges"]:
+                    key = (name, tuple(map(tuple, labels)))
+                    totals["gauges"][key] = totals["gauges"].get(key, 0) + value
+            for name, labels, histogram in data["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                add_histogram(totals["histograms"], key, histogram)
+        return totals
+
+    def view(self):
+        """
+        The /metrics route, in the Prometheus text format.
+        Example: http://localhost:5000/metrics
+        """
+        token = current_app.config["METRICS_TOKEN"]
+        if token and not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {token}".encode(),
+        ):
+            abort(403)
+
+        text = render(self.collect())
+        return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+class MetricsRegistry:
+    """
+    The metric values of one app in this process, kept in
+    app.extensions["metrics"]. The db and password listeners are its
+    methods, so they count into the right app even outside an app context.
+
+    Args:
+        enabled (bool): False records nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every value, a forked worker starts from zero.
+        """
+        self._local = threading.local()
+        self._threads = []
+        self._retired = ThreadValues()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @property
+    def _values(self):
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = self._local.values = ThreadValues()
+            with self._lock:
+                self._retire_dead_threads()
+                self._threads.append((threading.current_thread(), values))
+        return values
+
+    def _retire_dead_threads(self):
+        """
+        Adds the values of the threads that ended to the retired total and
+        forgets them. Called with the lock held.
+        """
+        alive = []
+        for thread, values in self._threads:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                add_values(self._retired, values)
+        self._threads = alive
+
+    def inc(self, name, labels=(), amount=1):
+        """
+        Adds to a counter, or to a gauge when amount is negative.
+
+        Args:
+            name (str): The metric name, see METRICS.
+            labels (tuple): (name, value) pairs.
+            amount (float): How much to add.
+        """
+        values = self._values
+        table = values.gauges if METRICS[name][0] == "gauge" else values.counters
+        key = (name, labels)
+        table[key] = table.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """
+        Adds a value to a histogram.
+
+        Args:
+            name (str): The metric name, see METRICS.
+            value (float): The value, such as a duration in seconds.
+            labels (tuple): (name, value) pairs.
+        """
+        histograms = self._values.histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # One count per bucket, then +Inf, then the sum
+            histogram = histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+        # Queries of job workers and commands have no route
+        labels = route_labels() if has_request_context() else NO_ROUTE
+        self.inc("db_queries_total", labels)
+        self.inc("db_query_seconds_total", labels, elapsed)
+
+    def handle_error(self, exception_context):
+        # A failed statement has no after_cursor_execute, drop its start time
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("metrics_start"):
+            conn.info["metrics_start"].pop()
+
+    def observe_password(self, operation, seconds):
+        # Called from the verifier's pool threads, see auth.py
+        self.observe(
+            "password_hash_duration_seconds", seconds, (("operation", operation),)
+        )
+
+    def totals(self):
+        """
+        Adds up the values of every thread of this process.
+
+        Returns:
+            dict: counters, gauges and histograms by (name, labels).
+        """
+        total = ThreadValues()
+        with self._lock:
+            self._retire_dead_threads()
+            threads = [values for thread, values in self._threads]
+            add_values(total, self._retired)
+
+        for values in threads:
+            add_values(total, values)
+        return {
+            "counters": total.counters,
+            "gauges": total.gauges,
+            "histograms": total.histograms,
+        }
+
+    def write(self, folder):
+        """
+        Writes this process's totals to folder/<pid>.json.
+
+        Args:
+            folder (str): METRICS_DIR, nothing is written if it is None.
+        """
+        if not folder or not self.enabled:
+            return
+
+        # The writer thread and a scrape may both write, one at a time
+        with self._write_lock:
+            totals = self.totals()
+            data = {
+                table: [
+                    [name, list(labels), value]
+                    for (name, labels), value in rows.items()
+                ]
+                for table, rows in totals.items()
+            }
+            path = os.path.join(folder, f"{os.getpid()}.json")
+            with open(path + ".tmp", "w") as file:
+                json.dump(data, file)
+            os.replace(path + ".tmp", path)
+
+    def start_writer(self, app):
+        """
+        Starts the thread that writes the totals, when METRICS_DIR is set.
+
+        Args:
+            app (Flask): The app these are the values of.
+        """
+        if self.enabled and app.config["METRICS_DIR"]:
+            threading.Thread(
+                target=self._write_loop, args=(app,), name="metrics-writer", daemon=True
+            ).start()
+
+    def _write_loop(self, app):
+        while True:
+            time.sleep(app.config["METRICS_WRITE_INTERVAL"])
+            try:
+                self.write(app.config["METRICS_DIR"])
+            except OSError:
+                app.logger.exception("Could not write the metrics file")
+
+
+def route_labels():
+    """
+    Gets the labels of the current request's route, unknown urls share one.
+
+    Returns:
+        tuple: The blueprint and endpoint labels.
+    """
+    return (
+        ("blueprint", request.blueprint or ""),
+        ("endpoint", request.endpoint or "(not found)"),
+    )
+
+
+def add_values(total, values):
+    """
+    Adds one thread's values to a total.
+
+    Args:
+        total (ThreadValues): The values added to.
+        values (ThreadValues): The values to add.
+    """
+    # dict.copy() is atomic, the owning thread may be adding a key
+    for table in ("counters", "gauges"):
+        rows = getattr(total, table)
+        for key, value in getattr(values, table).copy().items():
+            rows[key] = rows.get(key, 0) + value
+    for key, histogram in values.histograms.copy().items():
+        add_histogram(total.histograms, key, histogram)
+
+
+def add_histogram(histograms, key, histogram):
+    total = histograms.get(key)
+    if total is None:
+        histograms[key] = list(histogram)
+    else:
+        for position, value in enumerate(histogram):
+            total[position] += value
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+        value = value.replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render(totals):
+    """
+    Formats the totals in the Prometheus text exposition format.
+
+    Args:
+        totals (dict): The output of Metrics.collect.
+
+    Returns:
+        str: The text.
+    """
+    by_name = {}
+    for table in ("counters", "gauges", "histograms"):
+        for (name, labels), value in totals[table].items():
+            by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name.get(name, ())):
+            if kind != "histogram":
+                lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), value):
+                cumulative += count
+                bucket_labels = format_labels(labels + (("le", str(bound)),))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+@post_fork
+def start_metrics_writer(app):
+    """
+    Starts each worker's metrics writer, threads don't survive the fork.
+
+    Args:
+        app (Flask): The app of the worker.
+    """
+    registry = app.extensions["metrics"]
+    # The values counted in the master before forking belong to the master
+    registry.reset()
+    registry.start_writer(app)
+
+
+@worker_exit
+def write_final_metrics(app):
+    """
+    Writes the worker's last totals so its counts aren't lost.
+
+    Args:
+        app (Flask): The app of the worker.
+    """
+    app.extensions["metrics"].write(app.config["METRICS_DIR"])
+
@@ -1,5 +1,6 @@
-from .extensions import db
-from werkzeug.security import generate_password_hash
+from .extensions import db, password_verifier
+from sqlalchemy import event, insert
+from sqlalchemy.orm.attributes import flag_modified
 from datetime import datetime
 
 # Create an association table to link Topics and members
@@ -7,6 +8,8 @@ member_topic_table = db.Table(
     "member_topic",
     db.Column("member_id", db.Integer, db.ForeignKey("member.id"), primary_key=True),
     db.Column("topic_id", db.Integer, db.ForeignKey("topic.id"), primary_key=True),
+    # The primary key covers lookups by member, this one covers lookups by topic
+    db.Index("ix_member_topic_topic_id_member_id", "topic_id", "member_id"),
 )
 
 
@@ -24,20 +27,49 @@ class Member(db.Model):
         first_learn_date(date): The date the member learned to code.
         fav_language(int): The foreign key language id in the language table.
         about(str): The about information of the member.
+        version(int): Goes up by one on every edit, an edit of an older version fails.
     """
 
+    # Indexes backing the GET /api/member filters, see filters.py
+    __table_args__ = (
+        db.Index(
+            "ix_member_fav_language_first_learn_date",
+            "fav_language",
+            "first_learn_date",
+        ),
+        db.Index(
+            "ix_member_learn_new_interest_first_learn_date",
+            "learn_new_interest",
+            "first_learn_date",
+        ),
+        db.Index("ix_member_first_learn_date", "first_learn_date"),
+        db.Index("ix_member_location", "location"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(50))
-    password_hash = db.Column(db.String(50))
+    # Indexed for the login lookup in /api/auth/verify
+    email = db.Column(db.String(50), index=True)
+    # scrypt hashes are about 160 characters
+    password_hash = db.Column(db.String(255))
     location = db.Column(db.String(30))
     first_learn_date = db.Column(db.DateTime)
 
     # languages are pulled as foreign key in language table
     fav_language = db.Column(db.ForeignKey("language.id"))
+    # Loaded with one IN query for all the members a query returns, so
+    # member_to_json doesn't read the language of each member on its own.
+    # Set fav_language to change it, this side is only read.
+    language = db.relationship("Language", lazy="selectin", viewonly=True)
 
     about = db.Column(db.Text)
     learn_new_interest = db.Column(db.Boolean)
 
+    # Every UPDATE checks the version it loaded is still the one in the db and
+    # raises StaleDataError if not, so two editors can't overwrite each other.
+    # server_default fills it for the rows flask seed inserts without the ORM.
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
+
     interest_in_topics = db.relationship(
         "Topic",  # The Topic table
         secondary=member_topic_table,  # The variable above for member_topic_table association
@@ -58,7 +90,32 @@ class Member(db.Model):
         Args:
             password (str): The password to hash
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_verifier.hash(password)
+
+    def set_fields(self, values, topics):
+        """
+        Sets the member's fields from a validated payload, see schemas.py.
+        The password is only changed when one was sent.
+
+        Args:
+            values (dict): The values from the member schema.
+            topics (list): The Topic rows from member_references.
+        """
+        # Topics first, loading the old ones autoflushes, and a flush after the
+        # changes below would be a second UPDATE that bumps the version again
+        self.interest_in_topics[:] = topics
+        self.email = values["email"]
+        if values.get("password"):
+            self.password = values["password"]
+        self.location = values["location"]
+        self.first_learn_date = values["first_learn_date"]
+        self.fav_language = values["fav_language"]
+        self.about = values["about"]
+        self.learn_new_interest = values.get("learn_new_interest", False)
+
+        # Topic changes don't touch the member row, flag a column so every
+        # edit is an UPDATE that checks and bumps the version
+        flag_modified(self, "email")
 
     def member_to_json(self):
         """
@@ -74,8 +131,7 @@ class Member(db.Model):
             topics.append({"id": topic.id, "name": topic.name})
 
         # Get the language id and name
-        fav_language = Language.query.get(self.fav_language)
-        language_json = {"id": fav_language.id, "name": fav_language.name}
+        language_json = {"id": self.language.id, "name": self.language.name}
 
         # Prepared json to return
         member_json = {
@@ -87,6 +143,7 @@ class Member(db.Model):
             "about": self.about,
             "learn_new_interest": self.learn_new_interest,
             "interest_in_topics": topics,
+            "version": self.version,
         }
 
         return member_json
@@ -120,3 +177,149 @@ class Topic(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(20))
+
+
+class Job(db.Model):
+    """
+    A Job is a piece of work queued to run after the request, see jobs.py.
+    Jobs are rows so they survive a restart.
+
+    Attributes:
+        id(int): The id of the job.
+        name(str): The name of the task to run.
+        payload(str): The task arguments in json format.
+        status(str): pending, running or failed. Jobs that succeed are deleted.
+        attempts(int): How many times the job was started.
+        run_at(date): When the job can run next.
+        locked_until(date): When a running job is given up on and can run again.
+        last_error(str): The error of the last failed attempt.
+        created_at(date): When the job was queued.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(10), default="pending")
+    attempts = db.Column(db.Integer, default=0)
+    run_at = db.Column(db.DateTime, default=datetime.now)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    # Workers look for the next job by status and time
+    __table_args__ = (db.Index("ix_job_status_run_at", "status", "run_at"),)
+
+
+class MemberChange(db.Model):
+    """
+    A MemberChange records that a member was created, edited or deleted.
+    Rows are written in the same transaction as the change itself, see
+    record_member_changes, and GET /api/member/changes reads them in id order.
+
+    Attributes:
+        id(int): The position in the feed, it only ever grows.
+        member_id(int): The id of the member that changed.
+        operation(str): create, update or delete.
+        changed_at(date): When the change was flushed.
+    """
+
+    # AUTOINCREMENT so ids of deleted rows are never reused and the feed stays in order
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    member_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.now)
+
+
+@event.listens_for(db.session, "after_flush")
+def record_member_changes(session, flush_context):
+    """
+    Adds a MemberChange row for every member the flush created, edited or deleted.
+    It runs after the flush so new members have their id, and inserts on the
+    flush's connection so the change log commits or rolls back with them.
+    Topic changes count as edits because interest_in_topics belongs to Member.
+    A member is recorded once per transaction, even if autoflush flushes it twice.
+    Bulk inserts that skip the ORM, like flask seed, are not recorded.
+
+    Args:
+        session (Session): The session being flushed.
+        flush_context (UOWTransaction): The flush, not used.
+    """
+    recorded = session.info.setdefault("member_changes", set())
+    changes = []
+
+    for member in session.new:
+        if isinstance(member, Member):
+            changes.append((member.id, "create"))
+
+    for member in session.dirty:
+        if isinstance(member, Member) and session.is_modified(member):
+            changes.append((member.id, "update"))
+
+    for member in session.deleted:
+        if isinstance(member, Member):
+            changes.append((member.id, "delete"))
+
+    now = datetime.now()
+    rows = []
+    for member_id, operation in changes:
+        # An update right after a create or update in this transaction adds nothing
+        if operation == "update" and member_id in recorded:
+            continue
+        recorded.add(member_id)
+        rows.append(
+            {"member_id": member_id, "operation": operation, "changed_at": now}
+        )
+
+    if rows:
+        # The main db's connection, also in a shard's session, see sharding.py
+        connection = session.connection(bind_arguments={"mapper": MemberChange})
+        connection.execute(insert(MemberChange.__table__), rows)
+
+
+@event.listens_for(db.session, "after_commit")
+@event.listens_for(db.session, "after_soft_rollback")
+def reset_member_changes(session, *args):
+    """
+    Forgets which members were recorded once the transaction ends.
+    """
+    session.info.pop("member_changes", None)
+
+
+class IdBlock(db.Model):
+    """
+    Hands out ids in blocks when members are sharded, see sharding.py.
+    It lives in the main db so every process and shard shares one sequence.
+
+    Attributes:
+        name(str): What the ids are for, such as member.
+        next_id(int): The first id of the next block.
+    """
+
+    name = db.Column(db.String(20), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+
+class Invalidation(db.Model):
+    """
+    Announces a changed row to the other processes, see invalidation.py.
+    Rows are written in the same transaction as the change and deleted
+    after INVALIDATION_RETENTION seconds.
+
+    Attributes:
+        id(int): The position in the log, it only ever grows.
+        entity(str): The table of the changed row, such as member.
+        entity_id(int): The id of the changed row, None when any row may have changed.
+        origin(int): The pid of the process that made the change.
+        created_at(float): When the row was written, as a unix time.
+    """
+
+    # AUTOINCREMENT so pollers never see an old id again
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer)
+    origin = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.Float, nullable=False, index=True)
@@ -0,0 +1,200 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app, make_response, request
+
+
+class PageCache:
+    """
+    Keeps whole responses of GET routes in memory for a while, so a page
+    that only depends on its url is rendered once instead of on every hit.
+    Initialize it with page_cache = PageCache(app) or page_cache.init_app(app)
+    and cache a route with:
+
+    @app.route("/home")
+    @page_cache.cached(timeout=60)
+    def home():
+        ...
+
+    Only GET and HEAD requests use the cache, POST and the other methods
+    always run the view. Only 200 responses without cookies are kept.
+    The least recently used pages are dropped when the cache is full.
+    The config is read on each request, so it can be changed after init_app.
+
+    Config:
+        PAGE_CACHE_ENABLED(bool): False always runs the views, for debugging.
+        PAGE_CACHE_TIMEOUT(int): Seconds a page is kept if the route doesn't say.
+        PAGE_CACHE_MAX_ENTRIES(int): How many pages are kept.
+        PAGE_CACHE_MAX_BYTES(int): How many bytes of page bodies are kept.
+    """
+
+    def __init__(self, app=None):
+        self._pages = OrderedDict()
+        # endpoint -> header names its responses vary on, learned from the responses
+        self._vary = {}
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config.
+
+        Args:
+            app (Flask): The flask app whose pages are cached.
+        """
+        app.config.setdefault("PAGE_CACHE_ENABLED", True)
+        app.config.setdefault("PAGE_CACHE_TIMEOUT", 60)
+        app.config.setdefault("PAGE_CACHE_MAX_ENTRIES", 256)
+        app.config.setdefault("PAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+        app.extensions["page_cache"] = self
+
+    def cached(self, timeout=None, vary=(), unless=None):
+        """
+        Caches the responses of a view.
+
+        Args:
+            timeout (int): Seconds to keep a page, PAGE_CACHE_TIMEOUT by default.
+            vary (tuple): Request headers the page depends on, such as ("Cookie",).
+                The headers in the response's own Vary header are added to these.
+            unless (callable): Called before each request, True skips the cache.
+
+        Returns:
+            callable: The decorator.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                config = current_app.config
+                if (
+                    not config["PAGE_CACHE_ENABLED"]
+                    or request.method not in ("GET", "HEAD")
+                    or (unless is not None and unless())
+                ):
+                    return view(*args, **kwargs)
+
+                page = self._get(self._key(vary))
+                if page is not None:
+                    return self._respond(page)
+
+                response = make_response(view(*args, **kwargs))
+                if timeout is None:
+                    page_timeout = config["PAGE_CACHE_TIMEOUT"]
+                else:
+                    page_timeout = timeout
+                page = self._store(vary, response, page_timeout)
+                if page is None:
+                    return response
+                return self._respond(page)
+
+            return wrapper
+
+        return decorator
+
+    def _key(self, vary):
+        """
+        Makes the cache key of a request, its url and the headers it varies on.
+        """
+        names = self._vary.get(request.endpoint, vary)
+        return (
+            request.full_path,
+            tuple(request.headers.get(name, "") for name in names),
+        )
+
+    def _get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page["expires"] <= time.time():
+                self._remove(key)
+                page = None
+            if page is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return page
+
+    def _store(self, vary, response, timeout):
+        """
+        Keeps a copy of the response if it can be shared.
+
+        Returns:
+            dict: The page, or None if the response can't be cached.
+        """
+        if (
+            response.status_code != 200
+            or response.is_streamed
+            or response.direct_passthrough
+            or "Set-Cookie" in response.headers
+            or response.cache_control.no_store
+            or response.cache_control.private
+            or "*" in response.vary
+        ):
+            return None
+
+        # Tell browsers and proxies how long they may keep it too
+        now = time.time()
+        # Keep a max_age the view set, even 0
+        if response.cache_control.max_age is None:
+            response.cache_control.public = True
+            response.cache_control.max_age = timeout
+        if response.last_modified is None:
+            response.last_modified = datetime.fromtimestamp(now, timezone.utc)
+        for name in vary:
+            response.vary.add(name)
+
+        body = response.get_data()
+        page = {
+            "body": body,
+            "status": response.status_code,
+            "headers": list(response.headers),
+            "stored": now,
+            "expires": now + timeout,
+        }
+
+        config = current_app.config
+        with self._lock:
+            self._vary[request.endpoint] = tuple(response.vary)
+            key = self._key(vary)
+            if key in self._pages:
+                self._remove(key)
+            self._pages[key] = page
+            self.size += len(body)
+
+            while self._pages and (
+                len(self._pages) > config["PAGE_CACHE_MAX_ENTRIES"]
+                or self.size > config["PAGE_CACHE_MAX_BYTES"]
+            ):
+                self._remove(next(iter(self._pages)))
+
+        return page
+
+    def _remove(self, key):
+        page = self._pages.pop(key)
+        self.size -= len(page["body"])
+
+    def _respond(self, page):
+        """
+        Builds a new response from a cached page, each request gets its own
+        copy since after request hooks (like gzip) change the response.
+        A request with If-Modified-Since gets a 304 when the page is older.
+        """
+        response = make_response(page["body"], page["status"], page["headers"])
+        response.age = int(time.time() - page["stored"])
+        return response.make_conditional(request)
+
+    def clear(self):
+        """
+        Drops every cached page, call it after changing what the pages show.
+        """
+        with self._lock:
+            self._pages.clear()
+            self._vary.clear()
+            self.size = 0
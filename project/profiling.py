@@ -0,0 +1,210 @@
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+class Profiler:
+    """
+    Profiles single requests with cProfile and writes a .pstats file for each one.
+    Nothing is profiled unless PROFILE_ENABLED is set. Then a request is
+    profiled when it sends the header X-Profile: <PROFILE_TOKEN>, or when
+    it is picked by PROFILE_SAMPLE_RATE.
+
+    Config:
+        PROFILE_ENABLED(bool): Turns the profiler on.
+        PROFILE_TOKEN(str): The value of the X-Profile header that asks for a profile.
+        PROFILE_SAMPLE_RATE(float): The share of requests profiled, 0.01 is 1%.
+        PROFILE_DIR(str): Where the .pstats files are written.
+        PROFILE_MAX_FILES(int): How many files are kept, the oldest are deleted.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and registers the request hooks.
+
+        Args:
+            app (Flask): The flask app to profile.
+        """
+        app.config.setdefault("PROFILE_ENABLED", False)
+        app.config.setdefault("PROFILE_TOKEN", None)
+        app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+        app.config.setdefault(
+            "PROFILE_DIR", os.path.join(app.instance_path, "profiles")
+        )
+        app.config.setdefault("PROFILE_MAX_FILES", 100)
+        app.extensions["profiler"] = self
+
+        if not app.config["PROFILE_ENABLED"]:
+            return
+
+        app.before_request(self.start)
+        app.after_request(self.stop)
+        app.teardown_request(self.teardown)
+
+        # Count the queries of profiled requests, they go in the file name
+        with app.app_context():
+            engine = app.extensions["sqlalchemy"].engine
+            event.listen(engine, "before_cursor_execute", _count_query)
+
+    def start(self):
+        """
+        Starts the profiler if this request should be profiled.
+        """
+        config = current_app.config
+        token = config["PROFILE_TOKEN"]
+
+        # Bytes, compare_digest raises TypeError on str with non-ASCII characters
+        asked = token and hmac.compare_digest(
+            request.headers.get("X-Profile", "").encode(), token.encode()
+        )
+        sampled = random.random() < config["PROFILE_SAMPLE_RATE"]
+        if not asked and not sampled:
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running, this request goes without
+            return
+
+        g.profile = profile
+        g.profile_queries = 0
+        g.profile_start = time.perf_counter()
+
+    def stop(self, response):
+        """
+        Stops the profiler and writes the .pstats file.
+
+        Args:
+            response (Response): The response of the profiled request.
+
+        Returns:
+            Response: The same response.
+        """
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+
+        profile.disable()
+        elapsed_ms = (time.perf_counter() - g.profile_start) * 1000
+
+        directory = current_app.config["PROFILE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+
+        # Such as: 20240101-120000-123456-4242-GET-api.get_members-200-35ms-12q.pstats
+        endpoint = re.sub(r"[^\w.]", "_", request.endpoint or "unknown")
+        filename = (
+            f"{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}-{request.method}-"
+            f"{endpoint}-{response.status_code}-{elapsed_ms:.0f}ms-"
+            f"{g.profile_queries}q.pstats"
+        )
+        profile.dump_stats(os.path.join(directory, filename))
+
+        remove_old_profiles(directory, current_app.config["PROFILE_MAX_FILES"])
+        return response
+
+    def teardown(self, exception):
+        """
+        Turns the profiler off if the view raised before stop could run.
+
+        Args:
+            exception (Exception): The error raised by the view, if any.
+        """
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.disable()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Counts a query for the profiled request, if this is one.
+    """
+    if has_request_context() and "profile" in g:
+        g.profile_queries += 1
+
+
+def list_profiles(directory):
+    """
+    Lists the .pstats files, newest first.
+
+    Args:
+        directory (str): The profile directory.
+
+    Returns:
+        list: The paths of the files.
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    paths = [
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(".pstats")
+    ]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def remove_old_profiles(directory, max_files):
+    """
+    Deletes the oldest .pstats files so there are at most max_files.
+
+    Args:
+        directory (str): The profile directory.
+        max_files (int): How many files to keep.
+    """
+    for path in list_profiles(directory)[max_files:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another worker removed it first
+            pass
+
+
+def top_functions(paths, sort="cumulative", limit=20):
+    """
+    Adds up the profiles and returns the functions that took the most time.
+
+    Args:
+        paths (list): The .pstats files to add up.
+        sort (str): Either cumulative (time including calls) or total (own time).
+        limit (int): How many functions to return.
+
+    Returns:
+        list: The functions with their call count and times in seconds.
+    """
+    stats = pstats.Stats()
+    for path in paths:
+        try:
+            stats.add(path)
+        except (OSError, EOFError, ValueError):
+            # Pruned since it was listed, or still being written
+            continue
+
+    functions = []
+
+    for (filename, line, name), stat in stats.stats.items():
+        _, calls, total, cumulative, _ = stat
+        functions.append(
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "total_time": round(total, 6),
+                "cumulative_time": round(cumulative, 6),
+            }
+        )
+
+    key = "total_time" if sort == "total" else "cumulative_time"
+    functions.sort(key=lambda function: function[key], reverse=True)
+    return functions[:limit]
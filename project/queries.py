@@ -0,0 +1,169 @@
+import threading
+from sqlalchemy import event, lambda_stmt, select
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from .models import Language, Member, Topic
+
+# The hot queries of the views as lambda statements. SQLAlchemy builds and
+# compiles a lambda's SQL once, later calls only look it up by the code of
+# the lambda and read its closure variables as bound parameters. A plain
+# select() is also compiled once, but it is rebuilt and its cache key worked
+# out on every call, which is most of the python time of a small query.
+#
+# Only the closure's plain values (ids, offset, limit) may change between
+# calls. A variable holding SQL, like the conditions from filters.py, would
+# be frozen into the first statement, so filtered lists use a plain select().
+
+
+def members(session, conditions=(), offset=0, limit=None):
+    """
+    Gets the members matching the conditions in id order.
+
+    Args:
+        session (Session): The session to read with.
+        conditions (list): The filters, see filters.py.
+        offset (int): How many members to skip.
+        limit (int): The most members to return, None for all of them.
+
+    Returns:
+        list: The members.
+    """
+    if conditions:
+        statement = (
+            select(Member).where(*conditions).order_by(Member.id).offset(offset)
+        )
+        if limit is not None:
+            statement = statement.limit(limit)
+    elif limit is None:
+        statement = lambda_stmt(
+            lambda: select(Member).order_by(Member.id).offset(offset)
+        )
+    else:
+        statement = lambda_stmt(
+            lambda: select(Member).order_by(Member.id).offset(offset).limit(limit)
+        )
+    return session.scalars(statement).all()
+
+
+def languages(session):
+    """
+    Gets every language in id order.
+
+    Args:
+        session (Session): The session to read with.
+
+    Returns:
+        list: The languages.
+    """
+    statement = lambda_stmt(lambda: select(Language).order_by(Language.id))
+    return session.scalars(statement).all()
+
+
+def topics(session):
+    """
+    Gets every topic in id order.
+
+    Args:
+        session (Session): The session to read with.
+
+    Returns:
+        list: The topics.
+    """
+    statement = lambda_stmt(lambda: select(Topic).order_by(Topic.id))
+    return session.scalars(statement).all()
+
+
+def language_by_id(session, language_id):
+    """
+    Gets a language by id.
+
+    Args:
+        session (Session): The session to read with.
+        language_id (int): The language id.
+
+    Returns:
+        Language: The language, or None.
+    """
+    statement = lambda_stmt(
+        lambda: select(Language).where(Language.id == language_id)
+    )
+    return session.scalars(statement).first()
+
+
+def topics_by_id(session, topic_ids):
+    """
+    Gets the topics with the given ids, in no particular order.
+
+    Args:
+        session (Session): The session to read with.
+        topic_ids (list): The topic ids.
+
+    Returns:
+        list: The topics found.
+    """
+    statement = lambda_stmt(lambda: select(Topic).where(Topic.id.in_(topic_ids)))
+    return session.scalars(statement).all()
+
+
+class StatementCacheStats:
+    """
+    Counts how often a statement's compiled SQL came from SQLAlchemy's cache,
+    so a query that is compiled again on every request shows up as misses.
+    The counts are per process, see GET /admin/statement-cache.
+    """
+
+    def __init__(self, app=None):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Listens to the statements the engine runs.
+
+        Args:
+            app (Flask): The flask app to watch the queries of.
+        """
+        app.extensions["statement_cache_stats"] = self
+
+        with app.app_context():
+            engine = app.extensions["sqlalchemy"].engine
+            if not event.contains(engine, "after_cursor_execute", self._count):
+                event.listen(engine, "after_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        # Raw SQL strings aren't compiled, so they have nothing to cache
+        if context.compiled is None:
+            return
+        with self._lock:
+            self.counts[context.cache_hit] = self.counts.get(context.cache_hit, 0) + 1
+
+    def report(self):
+        """
+        Gets the counts and the hit rate.
+
+        Returns:
+            dict: hits, misses, uncached (statements SQLAlchemy can't cache)
+                and hit_rate, the hits over all compiled statements.
+        """
+        with self._lock:
+            counts = dict(self.counts)
+
+        hits = counts.get(CACHE_HIT, 0)
+        misses = counts.get(CACHE_MISS, 0)
+        total = sum(counts.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "uncached": total - hits - misses,
+            "hit_rate": round(hits / total, 4) if total else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+
+# The stats of the app, they live here next to the queries they are about
+statement_cache_stats = StatementCacheStats()
@@ -0,0 +1,264 @@
+from datetime import datetime
+from . import queries
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+class Field:
+    """
+    One field of a schema. parse turns the sent value into the python value,
+    or raises ValueError with the message to show.
+
+    Args:
+        required (str): The message when it is missing or empty, None if optional.
+    """
+
+    # True if the field is a list, forms send it as repeated keys
+    many = False
+
+    def __init__(self, required=None):
+        self.required = required
+
+    def parse(self, value):
+        return value
+
+
+class String(Field):
+    """
+    Text, with the surrounding spaces removed.
+
+    Args:
+        max_length (int): The longest value accepted.
+        strip (bool): False keeps the spaces, for passwords.
+    """
+
+    def __init__(self, required=None, max_length=None, strip=True):
+        super().__init__(required)
+        self.max_length = max_length
+        self.strip = strip
+
+    def parse(self, value):
+        if not isinstance(value, str):
+            raise ValueError("Must be text.")
+        if self.strip:
+            value = value.strip()
+        if self.max_length and len(value) > self.max_length:
+            raise ValueError(f"Must be at most {self.max_length} characters.")
+        return value
+
+
+class Email(String):
+    def parse(self, value):
+        value = super().parse(value)
+        local, _, domain = value.partition("@")
+        if not local or "." not in domain:
+            raise ValueError("Must be an email address.")
+        return value
+
+
+class Date(Field):
+    """
+    A date in the format YYYY-MM-DD.
+    """
+
+    def parse(self, value):
+        try:
+            return datetime.strptime(value, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            raise ValueError("Must be a date in the format YYYY-MM-DD.")
+
+
+class Boolean(Field):
+    """
+    true/false in json, yes/no (or true/false, 1/0) from a form.
+    """
+
+    def parse(self, value):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str):
+            if value.lower() in TRUE_VALUES:
+                return True
+            if value.lower() in FALSE_VALUES:
+                return False
+        raise ValueError("Must be yes or no.")
+
+
+class Integer(Field):
+    """
+    A whole number, sent as 3 or "3".
+
+    Args:
+        minimum (int): The smallest value accepted.
+    """
+
+    def __init__(self, required=None, minimum=None):
+        super().__init__(required)
+        self.minimum = minimum
+
+    def parse(self, value):
+        if isinstance(value, str):
+            # int() would take "²" past isdigit and fail with its own message
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError("Must be a whole number.")
+        # bool is an int in python, but True is not a number
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError("Must be a whole number.")
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"Must be {self.minimum} or more.")
+        return value
+
+
+class Id(Field):
+    """
+    The id of a row, sent as 3, "3" or {"id": 3} like GET /api/member returns it.
+    """
+
+    def parse(self, value):
+        if isinstance(value, dict):
+            value = value.get("id")
+        if isinstance(value, str):
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError("Must be an id.")
+        # bool is an int in python, but True is not an id
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValueError("Must be an id.")
+        return value
+
+
+class IdList(Id):
+    """
+    A list of ids, without duplicates.
+    """
+
+    many = True
+
+    def parse(self, value):
+        if not isinstance(value, list):
+            raise ValueError("Must be a list of ids.")
+        try:
+            ids = [super(IdList, self).parse(item) for item in value]
+        except ValueError:
+            raise ValueError("Must be a list of ids.")
+        return list(dict.fromkeys(ids))
+
+
+class Schema:
+    """
+    A set of fields, checked together so every error is reported at once.
+    The fields are looked at once when the schema is made, validate then
+    only runs a flat list of checks.
+
+    Args:
+        **fields (Field): The fields by name.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self._checks = [
+            (name, field.required, field.parse, field.many)
+            for name, field in fields.items()
+        ]
+
+    def validate(self, data):
+        """
+        Checks and converts a payload.
+
+        Args:
+            data (dict): The json body, or the output of from_form.
+
+        Returns:
+            tuple: The converted values and a dict of errors by field.
+        """
+        if not isinstance(data, dict):
+            return {}, {"body": "Must be a JSON object."}
+
+        values = {}
+        errors = {}
+        for name, required, parse, many in self._checks:
+            value = data.get(name)
+
+            # Missing, blank and empty lists all count as not sent
+            if value is None or value == [] or (
+                isinstance(value, str) and not value.strip()
+            ):
+                if required:
+                    errors[name] = required
+                continue
+
+            try:
+                values[name] = parse(value)
+            except ValueError as error:
+                errors[name] = str(error)
+
+        return values, errors
+
+    def from_form(self, form):
+        """
+        Reads the schema's fields from a form, lists with getlist.
+
+        Args:
+            form (MultiDict): The request form.
+
+        Returns:
+            dict: The form values by field.
+        """
+        return {
+            name: form.getlist(name) if many else form.get(name)
+            for name, required, parse, many in self._checks
+        }
+
+
+# The fields of a member, shared by the form in views/main.py and the api
+MEMBER_FIELDS = {
+    "email": Email("You must have an email address.", max_length=50),
+    "location": String("You must have a location", max_length=30),
+    "first_learn_date": Date("You must have first learn date."),
+    "fav_language": Id("You must choose a favorite language."),
+    "about": String("You must have an about section."),
+    "learn_new_interest": Boolean(),
+    "interest_in_topics": IdList("You must choose at least one topic."),
+}
+
+# New members need a password, edits keep the old one when none is sent.
+# Edits send the version they started from, the api can use If-Match instead.
+member_create_schema = Schema(
+    password=String("You must have a password.", strip=False), **MEMBER_FIELDS
+)
+member_edit_schema = Schema(
+    password=String(strip=False), version=Integer(minimum=1), **MEMBER_FIELDS
+)
+# Imported members may come without a password, they can't log in until one is set
+member_import_schema = Schema(password=String(strip=False), **MEMBER_FIELDS)
+
+
+def member_references(values, session):
+    """
+    Loads the language and topics a valid member payload points to,
+    with one query each, so unknown ids are a 400 and not a crash.
+
+    Args:
+        values (dict): The values from validate.
+        session (Session): The session the member is saved with, see sharding.py.
+
+    Returns:
+        tuple: The list of topics and a dict of errors by field.
+    """
+    errors = {}
+
+    if queries.language_by_id(session, values["fav_language"]) is None:
+        errors["fav_language"] = "Unknown language id."
+
+    topic_ids = values["interest_in_topics"]
+    topics = queries.topics_by_id(session, topic_ids)
+    if len(topics) != len(topic_ids):
+        errors["interest_in_topics"] = "Unknown topic id."
+
+    # Keep the order they were sent in
+    topics.sort(key=lambda topic: topic_ids.index(topic.id))
+    return topics, errors
@@ -0,0 +1,181 @@
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from werkzeug.security import generate_password_hash
+from .extensions import db
+from .models import Language, Member, Topic, member_topic_table
+
+# Reference data with a rough popularity weight for each row
+LANGUAGES = [
+    ("Python", 30),
+    ("JavaScript", 25),
+    ("Java", 12),
+    ("C#", 10),
+    ("Go", 8),
+    ("PHP", 6),
+    ("Rust", 5),
+    ("Ruby", 4),
+]
+
+TOPICS = [
+    ("Web Apps", 40),
+    ("APIs", 30),
+    ("Data Science", 20),
+    ("Mobile Apps", 15),
+    ("DevOps", 10),
+    ("Games", 8),
+]
+
+LOCATIONS = [
+    ("New York", 20),
+    ("London", 15),
+    ("San Francisco", 12),
+    ("Berlin", 10),
+    ("Bangalore", 10),
+    ("Toronto", 8),
+    ("Sydney", 6),
+    ("Boston", 6),
+    ("Sao Paulo", 5),
+    ("Tokyo", 4),
+]
+
+ABOUTS = [
+    "I build web apps for a living.",
+    "Learning to code in my spare time.",
+    "Backend developer who likes databases.",
+    "Student looking for a first job.",
+    "I write scripts to automate my work.",
+]
+
+# Every seeded member gets this password, hashing millions of them would take days
+SEED_PASSWORD = "password"
+
+FIRST_LEARN_START = datetime(1995, 1, 1)
+FIRST_LEARN_DAYS = (datetime(2024, 12, 31) - FIRST_LEARN_START).days
+
+
+def seed_reference_data():
+    """
+    Adds the languages and topics if the tables are empty.
+
+    Returns:
+        tuple: The language ids with weights and the topic ids with weights.
+    """
+    if not Language.query.first():
+        db.session.add_all([Language(name=name) for name, _ in LANGUAGES])
+    if not Topic.query.first():
+        db.session.add_all([Topic(name=name) for name, _ in TOPICS])
+    db.session.commit()
+
+    language_weights = dict(LANGUAGES)
+    topic_weights = dict(TOPICS)
+
+    # Rows that were not added by the seed get a weight of 1
+    languages = [
+        (language.id, language_weights.get(language.name, 1))
+        for language in Language.query.order_by(Language.id)
+    ]
+    topics = [
+        (topic.id, topic_weights.get(topic.name, 1))
+        for topic in Topic.query.order_by(Topic.id)
+    ]
+    return languages, topics
+
+
+def _weighted_sample(rng, population, weights, count):
+    """
+    Picks count different items, more popular items are picked more often.
+
+    Args:
+        rng (Random): The random generator.
+        population (list): The items to pick from.
+        weights (list): The weight of each item.
+        count (int): How many items to pick.
+
+    Returns:
+        list: The picked items.
+    """
+    picked = set()
+    while len(picked) < count:
+        picked.add(rng.choices(population, weights)[0])
+    return sorted(picked)
+
+
+def generate_members(count, seed=0, batch_size=10000):
+    """
+    Generates member rows and their member_topic rows in batches.
+    The same seed on the same (empty) db always gives the same data.
+
+    Args:
+        count (int): How many members to generate.
+        seed (int): The random seed.
+        batch_size (int): How many members are in each batch.
+
+    Yields:
+        tuple: The list of member rows and the list of member_topic rows of a batch.
+    """
+    rng = random.Random(seed)
+    languages, topics = seed_reference_data()
+    language_ids, language_weights = zip(*languages)
+    topic_ids, topic_weights = zip(*topics)
+    locations, location_weights = zip(*LOCATIONS)
+    password_hash = generate_password_hash(SEED_PASSWORD)
+
+    # Ids are set here so the member_topic rows can use them without a round trip
+    next_id = (db.session.scalar(select(func.max(Member.id))) or 0) + 1
+
+    for start in range(0, count, batch_size):
+        members = []
+        member_topics = []
+
+        end = min(start + batch_size, count)
+
+        for member_id in range(next_id + start, next_id + end):
+            # Most people learned recently, so skew the dates to the end of the range
+            days = int(rng.triangular(0, FIRST_LEARN_DAYS, FIRST_LEARN_DAYS))
+
+            members.append(
+                {
+                    "id": member_id,
+                    "email": f"member{member_id}@example.com",
+                    "password_hash": password_hash,
+                    "location": rng.choices(locations, location_weights)[0],
+                    "first_learn_date": FIRST_LEARN_START + timedelta(days=days),
+                    "fav_language": rng.choices(language_ids, language_weights)[0],
+                    "about": rng.choice(ABOUTS),
+                    "learn_new_interest": rng.random() < 0.6,
+                }
+            )
+
+            topic_count = rng.choices((1, 2, 3, 4), (40, 35, 15, 10))[0]
+            topic_count = min(topic_count, len(topic_ids))
+            for topic_id in _weighted_sample(rng, topic_ids, topic_weights, topic_count):
+                member_topics.append({"member_id": member_id, "topic_id": topic_id})
+
+        yield members, member_topics
+
+
+def seed_members(count, seed=0, batch_size=10000, progress=None):
+    """
+    Inserts generated members with core bulk inserts, one transaction per batch.
+
+    Args:
+        count (int): How many members to insert.
+        seed (int): The random seed.
+        batch_size (int): How many members are committed at a time.
+        progress (callable): Called with the number of members after each batch.
+
+    Returns:
+        int: The number of rows inserted in both tables.
+    """
+    rows = 0
+    for members, member_topics in generate_members(count, seed, batch_size):
+        db.session.execute(insert(Member.__table__), members)
+        db.session.execute(insert(member_topic_table), member_topics)
+        db.session.commit()
+
+        rows += len(members) + len(member_topics)
+        if progress is not None:
+            progress(len(members))
+
+    return rows
@@ -0,0 +1,262 @@
+import os
+import signal
+import socket
+import socketserver
+import time
+import traceback
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+import click
+
+# Functions called with the app in each worker right after it is forked
+post_fork_hooks = []
+
+# Functions called with the app in each worker right before it exits
+worker_exit_hooks = []
+
+
+def post_fork(func):
+    """
+    Registers a function to call in each new worker process, such as:
+
+    @post_fork
+    def start_threads(app):
+        ...
+
+    Args:
+        func (callable): Called with the app.
+
+    Returns:
+        callable: The same function.
+    """
+    post_fork_hooks.append(func)
+    return func
+
+
+def worker_exit(func):
+    """
+    Registers a function to call in each worker before it exits, such as
+    to save what it counted. Workers exit with os._exit, so atexit doesn't run.
+
+    Args:
+        func (callable): Called with the app.
+
+    Returns:
+        callable: The same function.
+    """
+    worker_exit_hooks.append(func)
+    return func
+
+
+@post_fork
+def dispose_db_connections(app):
+    """
+    Drops the db connections copied from the parent process.
+    Two processes must never share a connection, so each worker opens its own.
+    close=False leaves the parent's connections alone.
+
+    Args:
+        app (Flask): The app of the worker.
+    """
+    with app.app_context():
+        app.extensions["sqlalchemy"].engine.dispose(close=False)
+
+
+class WorkerServer(WSGIServer):
+    """
+    A WSGIServer that accepts connections on a socket the master already opened.
+    """
+
+    def __init__(self, listener, app):
+        socketserver.BaseServer.__init__(
+            self, listener.getsockname(), WSGIRequestHandler
+        )
+        self.socket = listener
+        host, self.server_port = listener.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.setup_environ()
+        self.set_app(app)
+        self.handled = 0
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        super().process_request(request, client_address)
+
+
+class PreforkServer:
+    """
+    Serves the app with several worker processes that share one listening socket.
+    Each worker handles one request at a time, so CPU heavy routes can use every core.
+
+    Signals to the master process:
+        SIGHUP: Starts a new set of workers, then lets the old ones finish and exit.
+        SIGTERM/SIGINT: Lets the workers finish their request and stops.
+
+    Args:
+        app (Flask): The app, loaded once before forking.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        workers (int): The number of worker processes.
+        max_requests (int): Requests per worker before it is replaced, 0 for no limit.
+        graceful_timeout (int): Seconds workers get to finish before being killed.
+    """
+
+    def __init__(
+        self, app, host, port, workers, max_requests=0, graceful_timeout=30
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+
+        # Worker pid -> generation, a reload starts a new generation
+        self.workers = {}
+        self.generation = 0
+        self.reloading = False
+        self.stopping = False
+
+    def run(self):
+        """
+        Opens the socket, starts the workers and keeps them running until stopped.
+        """
+        self.listener = socket.create_server((self.host, self.port), backlog=2048)
+        click.echo(
+            f"Listening on http://{self.host}:{self.port} "
+            f"with {self.worker_count} workers (master pid {os.getpid()})",
+            err=True,
+        )
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        for _ in range(self.worker_count):
+            self.spawn_worker()
+
+        while not self.stopping:
+            if self.reloading:
+                self.reload()
+            self.reap_workers()
+            time.sleep(0.5)
+
+        self.stop()
+
+    def _on_reload(self, signum, frame):
+        self.reloading = True
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def reload(self):
+        """
+        Starts a full set of new workers, then asks the old ones to stop.
+        The socket stays open the whole time, so no connection is refused.
+        """
+        self.reloading = False
+        old_workers = list(self.workers)
+        self.generation += 1
+
+        click.echo(f"Reloading, generation {self.generation}", err=True)
+        for _ in range(self.worker_count):
+            self.spawn_worker()
+
+        for pid in old_workers:
+            self.kill_worker(pid, signal.SIGTERM)
+
+    def reap_workers(self):
+        """
+        Collects the workers that exited and replaces the ones still needed.
+        Workers exit after max_requests, or when they crash.
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                if os.waitstatus_to_exitcode(status) != 0:
+                    click.echo(f"Worker {pid} died, starting a new one", err=True)
+                self.spawn_worker()
+
+    def kill_worker(self, pid, sig):
+        """
+        Sends a signal to a worker that may have already exited.
+
+        Args:
+            pid (int): The worker pid.
+            sig (int): The signal.
+        """
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def stop(self):
+        """
+        Stops the workers, killing the ones that don't finish in time.
+        """
+        click.echo("Stopping workers", err=True)
+        for pid in list(self.workers):
+            self.kill_worker(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+
+        for pid in list(self.workers):
+            self.kill_worker(pid, signal.SIGKILL)
+        self.reap_workers()
+        self.listener.close()
+
+    def spawn_worker(self):
+        """
+        Forks a worker process.
+        """
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            return
+
+        # In the worker from here on, it must never return to the master's loop
+        exit_code = 0
+        try:
+            self.run_worker()
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            for hook in worker_exit_hooks:
+                try:
+                    hook(self.app)
+                except Exception:
+                    traceback.print_exc()
+            os._exit(exit_code)
+
+    def run_worker(self):
+        """
+        Handles requests until told to stop or max_requests is reached.
+        """
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        for hook in post_fork_hooks:
+            hook(self.app)
+
+        # Every worker wakes up on a new connection but only one gets it,
+        # non blocking accept lets the others go back to waiting
+        self.listener.setblocking(False)
+        server = WorkerServer(self.listener, self.app)
+        server.timeout = 1
+
+        while not stopping:
+            server.handle_request()
+            if self.max_requests and server.handled >= self.max_requests:
+                break
@@ -3,3 +3,32 @@ import os
 SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI")
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 SECRET_KEY = os.environ.get("SECRET_KEY")
+
+# Admin routes are off unless a token is set, see views/admin.py
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Request profiling, see profiling.py
+PROFILE_ENABLED = os.environ.get("PROFILE_ENABLED") == "True"
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+# Slow query log, see slow_queries.py
+SLOW_QUERY_ENABLED = os.environ.get("SLOW_QUERY_ENABLED") == "True"
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 100))
+
+# Scheduled db snapshots every SNAPSHOT_INTERVAL seconds, 0 is off, see snapshots.py
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", 0))
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", 7))
+
+# Threads running background jobs in each process serving requests, see jobs.py
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+
+# Comma separated db uris to split members across, empty is off, see sharding.py
+SHARD_DATABASE_URIS = [
+    uri for uri in os.environ.get("SHARD_DATABASE_URIS", "").split(",") if uri
+]
+
+# Prometheus metrics at /metrics, see metrics.py. Set METRICS_DIR with flask serve
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED") == "True"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
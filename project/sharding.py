@@ -0,0 +1,365 @@
+import heapq
+import threading
+from flask import current_app, g
+from sqlalchemy import create_engine, delete, func, insert, inspect, select, update
+from . import queries
+from .models import (
+    IdBlock,
+    Invalidation,
+    Job,
+    Language,
+    Member,
+    MemberChange,
+    Topic,
+    member_topic_table,
+)
+from .server import post_fork
+
+# Tables copied to every shard so members can join their language and topics
+REFERENCE_TABLES = (Language.__table__, Topic.__table__)
+
+# Tables split across the shards by member id
+SHARDED_TABLES = (Member.__table__, member_topic_table)
+
+# Tables only the main db has, shard sessions write their rows there
+MAIN_TABLES = (
+    MemberChange.__tablename__,
+    Invalidation.__tablename__,
+    Job.__tablename__,
+)
+
+
+class ShardRouter:
+    """
+    Splits members and their member_topic rows across several sqlite files
+    by member id, each file has its own write lock so writes to different
+    shards don't wait for each other. Languages and topics stay in the main
+    db and are copied to every shard.
+
+    The member views go through the router, with no shards configured it
+    sends everything to db.session so the app works as before.
+
+    Ids can't come from one autoincrement any more, they are taken in
+    blocks of SHARD_ID_BLOCK from the id_block table in the main db.
+
+    Shard sessions come from db.session's factory, so the session events of
+    the change feed, the topic index and the invalidation bus see their
+    writes. The member_change, invalidation and job rows go to the main db in
+    the same session, which commits the shard and the main db one after
+    the other, not as one transaction.
+
+    Set up the shards with: flask shards init
+
+    Limits: flask seed only writes the main db, and lists and email lookups
+    read the shards one after the other. Deep pages cost more, every shard
+    returns all the rows before the page.
+
+    The engines and ids of each app are kept in app.extensions["shards"],
+    so several apps in one process, like in the tests, don't share them.
+
+    Config:
+        SHARD_DATABASE_URIS(list): One db uri per shard, empty turns sharding off.
+        SHARD_ID_BLOCK(int): How many ids a process takes from id_block at once.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and opens the shard engines.
+
+        Args:
+            app (Flask): The flask app whose members are sharded.
+        """
+        app.config.setdefault("SHARD_DATABASE_URIS", [])
+        app.config.setdefault("SHARD_ID_BLOCK", 1000)
+
+        uris = app.config["SHARD_DATABASE_URIS"]
+        state = ShardState([create_engine(uri) for uri in uris])
+        app.extensions["shards"] = state
+
+        if state.engines:
+            app.teardown_appcontext(self.close_sessions)
+
+    @property
+    def _state(self):
+        return current_app.extensions["shards"]
+
+    @property
+    def engines(self):
+        return self._state.engines
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    @property
+    def _db(self):
+        return current_app.extensions["sqlalchemy"]
+
+    def shard_for(self, member_id):
+        """
+        Gets the shard a member lives in.
+
+        Args:
+            member_id (int): The member id.
+
+        Returns:
+            int: The shard number.
+        """
+        return member_id % len(self.engines)
+
+    def session(self, shard):
+        """
+        Gets the session of a shard, one per shard for the app context.
+
+        Args:
+            shard (int): The shard number.
+
+        Returns:
+            Session: The session.
+        """
+        sessions = g.setdefault("shard_sessions", {})
+        if shard not in sessions:
+            # db.session's class, the session events are registered on it
+            session = self._db.session.session_factory()
+            session.get_bind = self._shard_bind(self.engines[shard])
+            sessions[shard] = session
+        return sessions[shard]
+
+    def _shard_bind(self, engine):
+        """
+        Makes the get_bind of a shard session. Flask-SQLAlchemy's picks
+        the engine by table and would send everything to the main db.
+        """
+        main_engine = self._db.engine
+
+        def get_bind(mapper=None, clause=None, **kwargs):
+            table = inspect(mapper).local_table if mapper is not None else clause
+            if getattr(table, "name", None) in MAIN_TABLES:
+                return main_engine
+            return engine
+
+        return get_bind
+
+    def member_engines(self):
+        """
+        Gets the engines holding members.
+
+        Returns:
+            list: The shard engines, or the main db's without shards.
+        """
+        return self.engines or [self._db.engine]
+
+    def engine_for(self, member_id):
+        """
+        Gets the engine holding a member.
+
+        Args:
+            member_id (int): The member id.
+
+        Returns:
+            Engine: The shard's engine, or the main db's without shards.
+        """
+        if not self.enabled:
+            return self._db.engine
+        return self.engines[self.shard_for(member_id)]
+
+    def session_for(self, member_id):
+        """
+        Gets the session to read and write a member with.
+
+        Args:
+            member_id (int): The member id.
+
+        Returns:
+            Session: The shard's session, or db.session without shards.
+        """
+        if not self.enabled:
+            return self._db.session
+        return self.session(self.shard_for(member_id))
+
+    def close_sessions(self, exception=None):
+        for session in g.pop("shard_sessions", {}).values():
+            session.close()
+
+    def new_member_id(self):
+        """
+        Gets an id for a new member, taking a new block when this one is used up.
+
+        Returns:
+            int: The id, or None without shards so the db picks it.
+        """
+        if not self.enabled:
+            return None
+
+        state = self._state
+        size = current_app.config["SHARD_ID_BLOCK"]
+        with state.lock:
+            if state.next_id >= state.end_id:
+                state.end_id = self._take_block(size)
+                state.next_id = state.end_id - size
+
+            member_id = state.next_id
+            state.next_id += 1
+            return member_id
+
+    def _take_block(self, size):
+        """
+        Moves id_block forward by size in one statement, so two processes
+        never get the same block. It runs on its own connection so it
+        doesn't commit the request's transaction.
+
+        Returns:
+            int: The end of the block, the first id not in it.
+        """
+        table = IdBlock.__table__
+        with self._db.engine.begin() as connection:
+            end_id = connection.execute(
+                update(table)
+                .where(table.c.name == "member")
+                .values(next_id=table.c.next_id + size)
+                .returning(table.c.next_id)
+            ).scalar()
+
+        if end_id is None:
+            raise RuntimeError("No member id block, run flask shards init.")
+        return end_id
+
+    def get_member(self, member_id):
+        """
+        Gets a member from its shard. It goes through the session's identity
+        map, so a member the request already loaded costs no query.
+
+        Args:
+            member_id (int): The member id.
+
+        Returns:
+            Member: The member, or None.
+        """
+        return self.session_for(member_id).get(Member, member_id)
+
+    def find_member(self, condition):
+        """
+        Gets the first member matching a condition, looking in every shard.
+        Used for lookups that aren't by id, like the email in /api/auth/verify.
+
+        Args:
+            condition: The filter, such as Member.email == email.
+
+        Returns:
+            Member: The member with the lowest id, or None.
+        """
+        members = self.members([condition], limit=1)
+        return members[0] if members else None
+
+    def members(self, conditions=(), offset=0, limit=None):
+        """
+        Gets the members matching the conditions in id order.
+        Every shard returns its first offset + limit members, merged
+        they hold the first offset + limit members overall.
+
+        Args:
+            conditions (list): The filters, see filters.py.
+            offset (int): How many members to skip.
+            limit (int): The most members to return, None for all of them.
+
+        Returns:
+            list: The members.
+        """
+        if not self.enabled:
+            return queries.members(self._db.session, conditions, offset, limit)
+
+        shard_limit = None if limit is None else offset + limit
+        results = [
+            queries.members(self.session(shard), conditions, 0, shard_limit)
+            for shard in range(len(self.engines))
+        ]
+        members = list(heapq.merge(*results, key=lambda member: member.id))
+        return members[offset:] if limit is None else members[offset : offset + limit]
+
+    def create_tables(self):
+        """
+        Creates the tables in the main db and in every shard, copies the
+        reference tables and starts id_block after the highest member id.
+        """
+        self._db.create_all()
+
+        for engine in self.engines:
+            self._db.metadata.create_all(
+                engine, tables=[*REFERENCE_TABLES, *SHARDED_TABLES]
+            )
+        self.copy_reference_tables()
+
+        highest = 0
+        for engine in [self._db.engine, *self.engines]:
+            with engine.connect() as connection:
+                member_id = connection.execute(select(func.max(Member.id))).scalar()
+                highest = max(highest, member_id or 0)
+
+        table = IdBlock.__table__
+        with self._db.engine.begin() as connection:
+            next_id = connection.execute(
+                select(table.c.next_id).where(table.c.name == "member")
+            ).scalar()
+            if next_id is None:
+                connection.execute(
+                    insert(table).values(name="member", next_id=highest + 1)
+                )
+            elif next_id <= highest:
+                connection.execute(
+                    update(table)
+                    .where(table.c.name == "member")
+                    .values(next_id=highest + 1)
+                )
+
+    def copy_reference_tables(self):
+        """
+        Replaces the languages and topics of every shard with the main db's.
+        Run it again after adding a language or topic.
+        """
+        with self._db.engine.connect() as connection:
+            rows = {
+                table: [row._asdict() for row in connection.execute(select(table))]
+                for table in REFERENCE_TABLES
+            }
+
+        for engine in self.engines:
+            with engine.begin() as connection:
+                for table, table_rows in rows.items():
+                    connection.execute(delete(table))
+                    if table_rows:
+                        connection.execute(insert(table), table_rows)
+
+
+class ShardState:
+    """
+    The shard engines of one app and the block of ids this process hands out.
+    """
+
+    def __init__(self, engines):
+        self.engines = engines
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.end_id = 0
+
+
+@post_fork
+def dispose_shard_connections(app):
+    """
+    Drops the shard connections copied from the parent process, like the main
+    db's, and the parent's id block, two workers must not hand out the same ids.
+
+    Args:
+        app (Flask): The app of the worker.
+    """
+    state = app.extensions["shards"]
+    for engine in state.engines:
+        engine.dispose(close=False)
+    state.next_id = state.end_id = 0
+
+
+# The router of the app, it needs the models so it lives here and not in extensions.py
+shards = ShardRouter()
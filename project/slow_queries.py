@@ -0,0 +1,227 @@
+import re
+import threading
+import time
+from flask import has_request_context, request
+from sqlalchemy import event
+
+# Literals are replaced so the same statement with other values is counted together
+_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDERS = re.compile(r"\(\s*\?(\s*,\s*\?)*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+# Statements sqlite can show a plan for
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+
+def normalize(statement):
+    """
+    Normalizes a statement so all the calls of one query look the same.
+    Such as: SELECT ... WHERE id IN (?, ?, ?) -> SELECT ... WHERE id IN (?)
+
+    Args:
+        statement (str): The SQL statement.
+
+    Returns:
+        str: The normalized statement.
+    """
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _PLACEHOLDERS.sub("(?)", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+def redact(parameters):
+    """
+    Replaces parameter values with their type, emails and password hashes
+    should never end up in a log.
+
+    Args:
+        parameters (tuple|dict|list): The parameters sent with the statement.
+
+    Returns:
+        tuple|dict|list: The parameters with only their type names.
+    """
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [
+            redact(value) if isinstance(value, (list, tuple, dict))
+            else type(value).__name__
+            for value in parameters
+        ]
+    return type(parameters).__name__
+
+
+class SlowQueryLog:
+    """
+    Records the SQL statements that take longer than SLOW_QUERY_THRESHOLD_MS,
+    with the route that ran them and their EXPLAIN QUERY PLAN.
+    Statements are grouped by their normalized SQL so the report shows
+    which query is slow, not every single call.
+
+    Config:
+        SLOW_QUERY_ENABLED(bool): Turns the log on.
+        SLOW_QUERY_THRESHOLD_MS(float): Statements slower than this are recorded.
+        SLOW_QUERY_MAX_STATEMENTS(int): How many different statements are kept.
+    """
+
+    def __init__(self, app=None):
+        self.statements = {}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and listens to the engine's cursor events.
+
+        Args:
+            app (Flask): The flask app to watch the queries of.
+        """
+        app.config.setdefault("SLOW_QUERY_ENABLED", False)
+        app.config.setdefault("SLOW_QUERY_THRESHOLD_MS", 100.0)
+        app.config.setdefault("SLOW_QUERY_MAX_STATEMENTS", 200)
+        app.extensions["slow_queries"] = self
+
+        if not app.config["SLOW_QUERY_ENABLED"]:
+            return
+
+        self.threshold = app.config["SLOW_QUERY_THRESHOLD_MS"] / 1000
+        self.max_statements = app.config["SLOW_QUERY_MAX_STATEMENTS"]
+
+        with app.app_context():
+            engine = app.extensions["sqlalchemy"].engine
+            event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+            event.listen(engine, "handle_error", self.handle_error)
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """
+        Remembers when the statement started.
+        """
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        """
+        Records the statement if it was slower than the threshold.
+        """
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if elapsed < self.threshold:
+            return
+
+        route = request.endpoint if has_request_context() else "(no request)"
+        key = normalize(statement)
+
+        with self._lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                if len(self.statements) >= self.max_statements:
+                    # Make room by dropping the statement that costs the least overall
+                    cheapest = min(
+                        self.statements.values(), key=lambda entry: entry["total"]
+                    )
+                    del self.statements[cheapest["statement"]]
+
+                entry = self.statements[key] = {
+                    "statement": key,
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "routes": {},
+                    "parameters": None,
+                    "plan": None,
+                }
+
+            entry["count"] += 1
+            entry["total"] += elapsed
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+
+            if elapsed >= entry["max"]:
+                entry["max"] = elapsed
+                entry["parameters"] = redact(parameters)
+
+        # The plan is captured once per statement, plans don't change between calls
+        if entry["plan"] is None and not executemany:
+            entry["plan"] = self.explain(conn, statement, parameters)
+
+    def handle_error(self, exception_context):
+        """
+        Forgets the start time of a statement that failed.
+        """
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+    def explain(self, conn, statement, parameters):
+        """
+        Gets the sqlite query plan of a statement.
+        It runs on the raw connection so it doesn't trigger these events again.
+
+        Args:
+            conn (Connection): The connection that ran the statement.
+            statement (str): The SQL statement.
+            parameters (tuple): Its parameters.
+
+        Returns:
+            list: The lines of the plan, or None if it couldn't be explained.
+        """
+        if conn.dialect.name != "sqlite":
+            return None
+        if not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+                return [row[-1] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as error:
+            return [f"Could not explain: {error}"]
+
+    def report(self, limit=20, sort="total"):
+        """
+        Gets the slowest statements.
+
+        Args:
+            limit (int): How many statements to return.
+            sort (str): total (time across all calls), max, or count.
+
+        Returns:
+            list: The statements with their times in milliseconds.
+        """
+        if sort not in ("total", "max", "count"):
+            sort = "total"
+
+        with self._lock:
+            entries = sorted(
+                self.statements.values(), key=lambda entry: entry[sort], reverse=True
+            )[:limit]
+
+            return [
+                {
+                    "statement": entry["statement"],
+                    "count": entry["count"],
+                    "total_ms": round(entry["total"] * 1000, 3),
+                    "avg_ms": round(entry["total"] * 1000 / entry["count"], 3),
+                    "max_ms": round(entry["max"] * 1000, 3),
+                    "routes": dict(entry["routes"]),
+                    "parameters": entry["parameters"],
+                    "plan": entry["plan"],
+                }
+                for entry in entries
+            ]
+
+    def reset(self):
+        """
+        Forgets all the recorded statements.
+        """
+        with self._lock:
+            self.statements.clear()
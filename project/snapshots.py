@@ -0,0 +1,309 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # Windows, where flask serve doesn't run either
+    fcntl = None
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot can't be taken or fails its integrity check.
+    """
+
+
+class Snapshots:
+    """
+    Copies the live sqlite db to timestamped files with sqlite's online backup API.
+    The copy is made a few pages at a time, so writers only wait for one
+    step instead of the whole copy. Take one with: flask db-snapshot
+
+    sqlite starts the copy over whenever another connection writes to the
+    db, so under steady writes it might never finish. After
+    SNAPSHOT_MAX_RESTARTS restarts the rest is copied in one step, which
+    makes writers wait for the whole copy that one time.
+
+    Scheduled snapshots start with the first request of each process, so
+    flask commands and the flask serve master never run them. Every worker
+    checks the age of the newest snapshot under a lock file, so only one of
+    them takes each snapshot.
+
+    Config:
+        SNAPSHOT_DIR(str): Where the snapshots are written.
+        SNAPSHOT_PAGES(int): Pages copied per step, fewer blocks writers for less time.
+        SNAPSHOT_SLEEP(float): Seconds to wait before trying a step again when
+            a writer has the db locked.
+        SNAPSHOT_MAX_RESTARTS(int): Restarts before the copy is made in one step.
+        SNAPSHOT_KEEP(int): How many snapshots are kept, at least 1, the
+            oldest are deleted.
+        SNAPSHOT_MAX_AGE_DAYS(float): Older snapshots are deleted, None keeps them.
+        SNAPSHOT_INTERVAL(int): Seconds between scheduled snapshots, 0 turns them off.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Sets the default config and schedules the snapshots if asked for.
+
+        Args:
+            app (Flask): The flask app whose db is copied.
+        """
+        app.config.setdefault(
+            "SNAPSHOT_DIR", os.path.join(app.instance_path, "snapshots")
+        )
+        app.config.setdefault("SNAPSHOT_PAGES", 100)
+        app.config.setdefault("SNAPSHOT_SLEEP", 0.005)
+        app.config.setdefault("SNAPSHOT_MAX_RESTARTS", 3)
+        app.config.setdefault("SNAPSHOT_KEEP", 7)
+        app.config.setdefault("SNAPSHOT_MAX_AGE_DAYS", None)
+        app.config.setdefault("SNAPSHOT_INTERVAL", 0)
+
+        app.extensions["snapshots"] = SnapshotSchedule()
+
+        if app.config["SNAPSHOT_INTERVAL"]:
+            app.before_request(self._ensure_scheduled)
+
+    def _ensure_scheduled(self):
+        schedule = current_app.extensions["snapshots"]
+        if schedule.pid == os.getpid():
+            return
+
+        with schedule.lock:
+            if schedule.pid == os.getpid():
+                return
+            schedule.pid = os.getpid()
+            threading.Thread(
+                target=self._run_schedule,
+                args=(current_app._get_current_object(),),
+                name="db-snapshots",
+                daemon=True,
+            ).start()
+
+    def take(self, directory=None, pages=None, sleep=None):
+        """
+        Writes a snapshot of the db. It is written to a .tmp file, checked
+        with PRAGMA integrity_check, then renamed, so a snapshot file is
+        always complete.
+
+        Args:
+            directory (str): Where to write it, SNAPSHOT_DIR by default.
+            pages (int): Pages per step, SNAPSHOT_PAGES by default.
+            sleep (float): Seconds to wait on a locked db, SNAPSHOT_SLEEP by default.
+
+        Returns:
+            str: The path of the snapshot.
+        """
+        config = current_app.config
+        directory = directory or config["SNAPSHOT_DIR"]
+        pages = pages or config["SNAPSHOT_PAGES"]
+        sleep = config["SNAPSHOT_SLEEP"] if sleep is None else sleep
+
+        engine = current_app.extensions["sqlalchemy"].engine
+
+        if engine.dialect.name != "sqlite":
+            raise SnapshotError("Snapshots only work with a sqlite db.")
+
+        os.makedirs(directory, exist_ok=True)
+        name = f"snapshot-{datetime.now():%Y%m%d-%H%M%S-%f}.sqlite3"
+        path = os.path.join(directory, name)
+        temp_path = path + ".tmp"
+
+        source = engine.raw_connection()
+        target = sqlite3.connect(temp_path)
+        try:
+            backup_database(
+                source.driver_connection,
+                target,
+                pages,
+                sleep,
+                config["SNAPSHOT_MAX_RESTARTS"],
+            )
+
+            result = target.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                raise SnapshotError(f"Integrity check failed: {result}")
+        except BaseException:
+            target.close()
+            os.remove(temp_path)
+            raise
+        finally:
+            source.close()
+
+        target.close()
+        os.replace(temp_path, path)
+        return path
+
+    def prune(self, directory=None, keep=None, max_age_days=None):
+        """
+        Deletes all but the newest keep snapshots, and any older than max_age_days.
+
+        Args:
+            directory (str): The snapshot directory, SNAPSHOT_DIR by default.
+            keep (int): How many to keep, SNAPSHOT_KEEP by default.
+            max_age_days (float): The oldest to keep, SNAPSHOT_MAX_AGE_DAYS by default.
+
+        Returns:
+            list: The paths deleted.
+        """
+        config = current_app.config
+        directory = directory or config["SNAPSHOT_DIR"]
+        keep = config["SNAPSHOT_KEEP"] if keep is None else keep
+        if keep < 1:
+            # 0 would delete the snapshot just taken
+            raise SnapshotError("Keep at least 1 snapshot.")
+        if max_age_days is None:
+            max_age_days = config["SNAPSHOT_MAX_AGE_DAYS"]
+
+        snapshots = list_snapshots(directory)
+        removed = snapshots[keep:]
+
+        if max_age_days is not None:
+            oldest = time.time() - max_age_days * 24 * 60 * 60
+            removed += [
+                path for path in snapshots[:keep] if os.path.getmtime(path) < oldest
+            ]
+
+        for path in removed:
+            os.remove(path)
+        return removed
+
+    def seconds_until_due(self):
+        """
+        Gets how long until the next scheduled snapshot, SNAPSHOT_INTERVAL
+        after the newest one, so a restart doesn't start the wait again.
+
+        Returns:
+            float: The seconds, 0 or less when one is due.
+        """
+        config = current_app.config
+        snapshots = list_snapshots(config["SNAPSHOT_DIR"])
+        if not snapshots:
+            return 0
+        age = time.time() - os.path.getmtime(snapshots[0])
+        return config["SNAPSHOT_INTERVAL"] - age
+
+    def _run_schedule(self, app):
+        """
+        Takes and prunes a snapshot whenever the newest one is SNAPSHOT_INTERVAL old.
+        """
+        config = app.config
+        while True:
+            with app.app_context():
+                due_in = self.seconds_until_due()
+            time.sleep(max(due_in, 1))
+            try:
+                with schedule_lock(config["SNAPSHOT_DIR"]) as locked, app.app_context():
+                    # Another worker may have taken it while this one waited
+                    if locked and self.seconds_until_due() <= 0:
+                        self.take()
+                        self.prune()
+            except Exception:
+                app.logger.exception("Scheduled db snapshot failed")
+                time.sleep(config["SNAPSHOT_INTERVAL"])
+
+
+class SnapshotSchedule:
+    """
+    Which process runs the snapshot schedule of one app.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.lock = threading.Lock()
+
+
+class BackupRestarted(Exception):
+    """
+    Stops an online backup that started over too many times.
+    """
+
+
+def backup_database(source, target, pages, sleep, max_restarts):
+    """
+    Copies a sqlite db with the online backup API, pages at a time. If
+    the copy starts over more than max_restarts times, because other
+    connections keep writing, it is made again in one step.
+
+    Args:
+        source (sqlite3.Connection): The db to copy.
+        target (sqlite3.Connection): The db written to.
+        pages (int): Pages per step.
+        sleep (float): Seconds to wait when the db is locked.
+        max_restarts (int): Restarts allowed before the one step copy.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # Each step leaves fewer pages, unless the copy started over
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarted()
+        last_remaining = remaining
+
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+    except BackupRestarted:
+        source.backup(target, pages=-1, sleep=sleep)
+
+
+@contextmanager
+def schedule_lock(directory):
+    """
+    Holds a lock file in the snapshot directory while a worker takes the
+    scheduled snapshot, without waiting for it.
+
+    Args:
+        directory (str): The snapshot directory.
+
+    Yields:
+        bool: True if this process has the lock.
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "schedule.lock"), "a") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def list_snapshots(directory):
+    """
+    Lists the snapshots, newest first.
+
+    Args:
+        directory (str): The snapshot directory.
+
+    Returns:
+        list: The paths of the snapshots.
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    names = [
+        name
+        for name in os.listdir(directory)
+        if name.startswith("snapshot-") and name.endswith(".sqlite3")
+    ]
+    # The timestamp in the name sorts the same as the time they were taken
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
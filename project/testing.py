@@ -0,0 +1,169 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from sqlalchemy import event
+from . import create_app
+from .extensions import db, page_cache
+from .seed import seed_members
+from .topic_index import topic_index
+
+# Config for test apps, no background threads and nothing cached between tests
+TEST_CONFIG = {
+    "TESTING": True,
+    "SECRET_KEY": "test",
+    "JOB_WORKERS": 0,
+    "SNAPSHOT_INTERVAL": 0,
+    "SHARD_DATABASE_URIS": [],
+    "METRICS_DIR": None,
+    "PAGE_CACHE_ENABLED": False,
+    # The bus thread would only wait, tests run in one process
+    "INVALIDATION_POLL_INTERVAL": 3600,
+    "AUTH_VERIFY_WORKERS": 2,
+}
+
+
+def build_template(path, members=1000, seed=0):
+    """
+    Creates a seeded db to copy into each test, once. It is written next to
+    path and renamed at the end, so parallel test runs never read half a file.
+    Delete the file to build it again after changing the models.
+
+    Args:
+        path (str): Where the template is kept, such as .pytest_cache/template.sqlite3.
+        members (int): How many members flask seed would add.
+        seed (int): The random seed, the same seed gives the same members.
+
+    Returns:
+        str: The path.
+    """
+    if os.path.exists(path):
+        return path
+
+    building = f"{path}.{os.getpid()}.tmp"
+    app = create_test_app(building)
+    with app.app_context():
+        db.create_all()
+        seed_members(members, seed)
+        db.engine.dispose()
+    os.replace(building, path)
+    return path
+
+
+def create_test_app(database_path, **config):
+    """
+    Creates an app on a sqlite file with TEST_CONFIG.
+    Creating an app costs more than a test should, make one per session
+    and reset its db with restore_database or rolled_back.
+
+    Args:
+        database_path (str): The sqlite file.
+        **config: Settings to change, such as ADMIN_TOKEN="test".
+
+    Returns:
+        Flask: The app.
+    """
+    return create_app(
+        config={
+            **TEST_CONFIG,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.abspath(database_path)}",
+            **config,
+        }
+    )
+
+
+def copy_database(source_path, target_path):
+    """
+    Copies a sqlite db page by page with the sqlite backup API, it takes a
+    few milliseconds for a few MB. The target is replaced completely.
+
+    Args:
+        source_path (str): The db to copy, such as the template.
+        target_path (str): The db to overwrite.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def restore_database(app, template_path):
+    """
+    Puts the app's db back to the template, call it before each test.
+    The in memory caches are emptied too, they may hold the last test's rows.
+
+    Args:
+        app (Flask): An app from create_test_app.
+        template_path (str): The template from build_template.
+    """
+    with app.app_context():
+        # Close the pooled connections so none of them is in a transaction
+        db.session.remove()
+        db.engine.dispose()
+        copy_database(template_path, db.engine.url.database)
+        topic_index.reset()
+        page_cache.clear()
+
+
+@contextmanager
+def rolled_back(app):
+    """
+    Runs a test in one transaction that is rolled back at the end, so
+    nothing it writes stays, even what the views commit. Commits become
+    savepoints. Requests made inside share the app context and the session.
+
+    Only db.session is rolled back. Writes on other connections, like the
+    member id blocks of sharding.py or the topic index's reads after commit,
+    don't see the test's rows, use restore_database for those tests.
+
+    Args:
+        app (Flask): An app from create_test_app.
+
+    Yields:
+        Session: The session, also reachable as db.session.
+    """
+    with app.app_context():
+        engine = db.engine
+        _explicit_transactions(engine)
+
+        connection = engine.connect()
+        transaction = connection.begin()
+        session = db.session.session_factory(
+            bind=connection, join_transaction_mode="create_savepoint"
+        )
+        # Flask-SQLAlchemy picks the engine by table, use the test's connection
+        session.get_bind = lambda *args, **kwargs: connection
+        db.session.registry.set(session)
+        try:
+            yield session
+        finally:
+            session.close()
+            db.session.registry.clear()
+            transaction.rollback()
+            connection.close()
+            topic_index.reset()
+            page_cache.clear()
+
+
+def _explicit_transactions(engine):
+    """
+    Lets SQLAlchemy send BEGIN itself. Python's sqlite3 starts transactions
+    on its own and breaks SAVEPOINT, see "Serializable isolation / Savepoints"
+    in the SQLAlchemy sqlite docs.
+    """
+    if event.contains(engine, "begin", _begin):
+        return
+    event.listen(engine, "connect", _connect)
+    event.listen(engine, "begin", _begin)
+    # Connections already in the pool were opened without _connect
+    engine.dispose()
+
+
+def _connect(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _begin(connection):
+    connection.exec_driver_sql("BEGIN")
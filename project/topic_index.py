@@ -0,0 +1,382 @@
+import os
+import sys
+import threading
+from flask import current_app
+from sqlalchemy import event, select
+from .invalidation import invalidation
+from .jobs import jobs
+from .models import Member, member_topic_table
+from .sharding import shards
+
+# The positions of the set bits in each byte value, BYTE_BITS[5] == (0, 2)
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def ids_to_bitmap(member_ids):
+    """
+    Packs member ids into one python int, bit n is set when id n is in the set.
+    It goes through a bytearray since setting bits on a big int one by one
+    copies the whole int every time.
+
+    Args:
+        member_ids (iterable): The member ids.
+
+    Returns:
+        int: The bitmap.
+    """
+    member_ids = list(member_ids)
+    if not member_ids:
+        return 0
+
+    bits = bytearray(max(member_ids) // 8 + 1)
+    for member_id in member_ids:
+        bits[member_id >> 3] |= 1 << (member_id & 7)
+    return int.from_bytes(bits, "little")
+
+
+def bitmap_ids(bitmap, after=0, limit=None):
+    """
+    Gets the ids set in a bitmap in order.
+    The bitmap is read a byte at a time, with the set bits of each
+    byte value looked up in BYTE_BITS.
+
+    Args:
+        bitmap (int): The bitmap.
+        after (int): Only ids greater than this are returned.
+        limit (int): The most ids to return, None for all of them.
+
+    Returns:
+        list: The member ids.
+    """
+    # Drop the ids up to after, bit 0 is now id after + 1
+    bitmap >>= after + 1
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+
+    member_ids = []
+    for position, byte in enumerate(data):
+        if not byte:
+            continue
+        base = after + 1 + position * 8
+        member_ids.extend(base + bit for bit in BYTE_BITS[byte])
+        if limit is not None and len(member_ids) >= limit:
+            return member_ids[:limit]
+
+    return member_ids
+
+
+class TopicIndex:
+    """
+    Keeps the members of each topic as a bitmap in memory, so set queries
+    like "topic 1 and 2 but not 3" are a few integer operations instead of
+    self joins on member_topic. A bitmap costs one bit per member id per topic.
+
+    It is built from the db on first use and kept up to date by the session
+    events: members written in a transaction are read again after it commits,
+    by a refresh_topic_index job when JOB_WORKERS is set, so the request
+    doesn't wait for the reads, or right after the commit otherwise.
+    Members written by other processes come from the invalidation bus.
+    Writes that skip the ORM, like flask seed, need a reset().
+
+    One thread builds at a time, the others wait for its bitmaps. Members
+    committed while it reads the db are read again once it is done.
+
+    The bitmaps of each app are kept in app.extensions["topic_index"].
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Listens to the session so the index follows member writes.
+
+        Args:
+            app (Flask): The flask app whose members are indexed.
+        """
+        app.extensions["topic_index"] = TopicBitmaps()
+
+        db = app.extensions["sqlalchemy"]
+        for name, listener in (
+            ("after_flush", self._after_flush),
+            ("after_commit", self._after_commit),
+            ("after_soft_rollback", self._after_rollback),
+        ):
+            if not event.contains(db.session, name, listener):
+                event.listen(db.session, name, listener)
+
+    @property
+    def _state(self):
+        return current_app.extensions["topic_index"]
+
+    @property
+    def topics(self):
+        return self._state.topics
+
+    @property
+    def members(self):
+        return self._state.members
+
+    def build(self):
+        """
+        Reads member and member_topic and makes the bitmaps.
+        The members bitmap holds every member, it is what NOT is taken from.
+        Updates that arrive while it reads are kept and replayed after.
+        """
+        state = self._state
+        with state.build_lock:
+            with state.lock:
+                state.building = True
+                state.pending = set()
+                generation = state.generation
+
+            try:
+                members, topics = self._read_bitmaps()
+            finally:
+                with state.lock:
+                    state.building = False
+                    pending, state.pending = state.pending, set()
+
+            with state.lock:
+                # A reset() while reading means the rows read may be out of date
+                if generation != state.generation:
+                    return
+                state.members = members
+                state.topics = topics
+
+            if pending:
+                self.refresh(pending)
+
+    def _read_bitmaps(self):
+        member_ids = []
+        rows = []
+        # Every shard's members, on connections of their own so the
+        # caller's session isn't held open, see sharding.py
+        for engine in shards.member_engines():
+            with engine.connect() as connection:
+                member_ids += connection.execute(select(Member.id)).scalars()
+                rows += connection.execute(
+                    select(
+                        member_topic_table.c.topic_id, member_topic_table.c.member_id
+                    )
+                )
+
+        members = ids_to_bitmap(member_ids)
+        topic_members = {}
+        for topic_id, member_id in rows:
+            topic_members.setdefault(topic_id, []).append(member_id)
+
+        topics = {
+            topic_id: ids_to_bitmap(member_ids)
+            for topic_id, member_ids in topic_members.items()
+        }
+        return members, topics
+
+    def reset(self):
+        """
+        Drops the index, it is built again on the next query.
+        """
+        state = self._state
+        with state.lock:
+            state.topics = None
+            state.members = 0
+            state.generation += 1
+
+    def _current(self):
+        """
+        Gets the topic bitmaps and the members bitmap, building them if needed.
+        Updates replace the bitmaps but never change them, so they can be
+        used without the lock.
+        """
+        state = self._state
+        while True:
+            with state.lock:
+                if state.topics is not None:
+                    return state.topics, state.members
+            with state.build_lock:
+                if state.topics is None:
+                    self.build()
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """
+        Finds the members matching a topic query.
+
+        Args:
+            all_of (list): Topic ids the members must all have.
+            any_of (list): Topic ids the members must have at least one of.
+            none_of (list): Topic ids the members must not have.
+
+        Returns:
+            int: The bitmap of the matching members.
+        """
+        topics, result = self._current()
+
+        for topic_id in all_of:
+            result &= topics.get(topic_id, 0)
+
+        if any_of:
+            either = 0
+            for topic_id in any_of:
+                either |= topics.get(topic_id, 0)
+            result &= either
+
+        for topic_id in none_of:
+            result &= ~topics.get(topic_id, 0)
+
+        return result
+
+    def memory(self):
+        """
+        Gets the bytes used by the bitmaps.
+
+        Returns:
+            int: The size of the bitmaps in bytes.
+        """
+        topics, members = self._current()
+        bitmaps = [members, *topics.values()]
+        return sum(sys.getsizeof(bitmap) for bitmap in bitmaps)
+
+    def _after_flush(self, session, flush_context):
+        """
+        Remembers the members the transaction wrote, and queues their
+        refresh in the same transaction when the job workers run.
+        """
+        changed = session.info.setdefault("topic_index_members", set())
+        flushed = {
+            instance.id
+            for instance in (*session.new, *session.dirty, *session.deleted)
+            if isinstance(instance, Member)
+        }
+        # One job per flush, for the members the earlier flushes didn't queue
+        queued = flushed - changed
+        changed |= flushed
+        if queued and current_app.config["JOB_WORKERS"]:
+            jobs.enqueue_from_flush(
+                session,
+                "refresh_topic_index",
+                member_ids=sorted(queued),
+                origin=os.getpid(),
+            )
+
+    def _after_rollback(self, session, previous_transaction):
+        session.info.pop("topic_index_members", None)
+
+    def _after_commit(self, session):
+        """
+        Reads the topics of the committed members again and updates their bits,
+        unless a job does it.
+        """
+        member_ids = session.info.pop("topic_index_members", None)
+        if member_ids and not current_app.config["JOB_WORKERS"]:
+            self.refresh(member_ids)
+
+    def refresh(self, member_ids):
+        """
+        Reads the topics of some members again, such as members another
+        process changed, see invalidation.py.
+
+        Args:
+            member_ids (set): The member ids, None when any member may have changed.
+        """
+        if member_ids is None:
+            self.reset()
+            return
+        # Not built, the build will read them. A build that started may
+        # have read them already, update() keeps them for after it.
+        state = self._state
+        if state.topics is None and not state.building:
+            return
+
+        # Members by the db holding them, one db without shards
+        by_engine = {}
+        for member_id in member_ids:
+            by_engine.setdefault(shards.engine_for(member_id), []).append(member_id)
+
+        # The session can't run queries in after_commit, so use new connections
+        existing = set()
+        rows = []
+        for engine, ids in by_engine.items():
+            with engine.connect() as connection:
+                existing.update(
+                    connection.execute(
+                        select(Member.id).where(Member.id.in_(ids))
+                    ).scalars()
+                )
+                rows += connection.execute(
+                    select(
+                        member_topic_table.c.topic_id, member_topic_table.c.member_id
+                    ).where(member_topic_table.c.member_id.in_(ids))
+                )
+
+        self.update(member_ids, existing, rows)
+
+    def update(self, member_ids, existing, rows):
+        """
+        Replaces the bits of some members. Only the topics a member joined
+        or left get a new bitmap, the others are kept as they are.
+
+        Args:
+            member_ids (set): The members to update.
+            existing (set): The ones still in the db, the others were deleted.
+            rows (list): Their (topic_id, member_id) rows.
+        """
+        mask = ids_to_bitmap(member_ids)
+        topic_members = {}
+        for topic_id, member_id in rows:
+            topic_members.setdefault(topic_id, []).append(member_id)
+
+        state = self._state
+        with state.lock:
+            if state.topics is None:
+                if state.building:
+                    state.pending |= set(member_ids)
+                return
+
+            # bitmap & mask is the bits the members have now, xor flips
+            # the ones that differ from the bits they should have
+            state.members ^= (state.members & mask) ^ ids_to_bitmap(existing)
+            topics = dict(state.topics)
+            for topic_id in topics.keys() | topic_members.keys():
+                bitmap = topics.get(topic_id, 0)
+                changed = (bitmap & mask) ^ ids_to_bitmap(
+                    topic_members.get(topic_id, ())
+                )
+                if changed:
+                    topics[topic_id] = bitmap ^ changed
+            state.topics = topics
+
+
+class TopicBitmaps:
+    """
+    The bitmaps of one app and what its builds are doing.
+    """
+
+    def __init__(self):
+        self.topics = None
+        self.members = 0
+        self.lock = threading.Lock()
+        self.build_lock = threading.RLock()
+        self.building = False
+        self.pending = set()
+        self.generation = 0
+
+
+# The index of the app, it needs the models so it lives here and not in extensions.py
+topic_index = TopicIndex()
+
+
+@jobs.task("refresh_topic_index")
+def refresh_topic_index(member_ids, origin):
+    """
+    Reads the topics of committed members again, queued by their transaction.
+    A worker of another process also tells the process that wrote them,
+    through the invalidation bus, since that process doesn't get its own
+    changes from the bus.
+
+    Args:
+        member_ids (list): The members the transaction wrote.
+        origin (int): The pid of the process that wrote them.
+    """
+    topic_index.refresh(set(member_ids))
+    if origin != os.getpid():
+        invalidation.publish("member", member_ids)
@@ -0,0 +1,267 @@
+import hmac
+from flask import Blueprint, abort, current_app, jsonify, request
+from project.extensions import memory, slow_queries
+from project.filters import whole_number
+from project.memory import MAX_FRAMES
+from project.profiling import list_profiles, top_functions
+from project.queries import statement_cache_stats
+
+admin = Blueprint("admin", __name__)
+
+
+@admin.before_request
+def check_token():
+    """
+    Only lets requests in that send the header X-Admin-Token: <ADMIN_TOKEN>.
+    Without an ADMIN_TOKEN in the config the admin routes don't exist.
+    """
+    token = current_app.config.get("ADMIN_TOKEN")
+    if not token:
+        abort(404)
+
+    # Bytes, compare_digest raises TypeError on str with non-ASCII characters
+    sent = request.headers.get("X-Admin-Token", "").encode()
+    if not hmac.compare_digest(sent, token.encode()):
+        abort(403)
+
+
+def number_args(defaults):
+    """
+    Reads whole numbers of 1 or more from the query string.
+
+    Args:
+        defaults (dict): The parameter names and their defaults, None if required.
+
+    Returns:
+        tuple: A dict of the numbers and a dict of errors.
+    """
+    numbers = {}
+    errors = {}
+    for name, default in defaults.items():
+        value = request.args.get(name)
+        number = default if value is None else whole_number(value)
+        if number is None or number < 1:
+            errors[name] = "Must be a number of 1 or more."
+        numbers[name] = number
+    return numbers, errors
+
+
+@admin.route("/profiles", methods=["GET"])
+def profiles():
+    """
+    Lists the functions that took the most time across the recent profiles.
+    Example: http://localhost:5000/admin/profiles?files=10&sort=total&limit=20
+
+    Returns:
+        dict: The profile files used and the top functions.
+    """
+    numbers, errors = number_args({"files": 10, "limit": 20})
+    if errors:
+        return jsonify({"errors": errors}), 400
+    sort = request.args.get("sort", "cumulative")
+
+    paths = list_profiles(current_app.config["PROFILE_DIR"])[: numbers["files"]]
+
+    return jsonify(
+        {
+            "profiles": [path.rsplit("/", 1)[-1] for path in paths],
+            "functions": top_functions(paths, sort, numbers["limit"]),
+        }
+    )
+
+
+@admin.route("/slow-queries", methods=["GET"])
+def get_slow_queries():
+    """
+    Lists the slowest SQL statements with their routes and query plans.
+    Example: http://localhost:5000/admin/slow-queries?sort=max&limit=10
+    sort can be total (default), max or count.
+
+    Returns:
+        dict: The slow statements.
+    """
+    numbers, errors = number_args({"limit": 20})
+    if errors:
+        return jsonify({"errors": errors}), 400
+    sort = request.args.get("sort", "total")
+
+    return jsonify(
+        {
+            "threshold_ms": current_app.config["SLOW_QUERY_THRESHOLD_MS"],
+            "statements": slow_queries.report(numbers["limit"], sort),
+        }
+    )
+
+
+@admin.route("/slow-queries", methods=["DELETE"])
+def reset_slow_queries():
+    """
+    Clears the slow query log.
+
+    Returns:
+        dict: An empty list of statements.
+    """
+    slow_queries.reset()
+    return jsonify({"statements": []})
+
+
+@admin.route("/statement-cache", methods=["GET"])
+def get_statement_cache():
+    """
+    Shows how often SQLAlchemy reused a compiled statement in this process.
+    A low hit rate means some query is built differently on every request.
+    Example: http://localhost:5000/admin/statement-cache
+
+    Returns:
+        dict: The hits, misses and hit rate.
+    """
+    return jsonify(statement_cache_stats.report())
+
+
+@admin.route("/statement-cache", methods=["DELETE"])
+def reset_statement_cache():
+    """
+    Starts the counts again from zero.
+
+    Returns:
+        dict: The empty counts.
+    """
+    statement_cache_stats.reset()
+    return jsonify(statement_cache_stats.report())
+
+
+def memory_group_by():
+    """
+    Reads group_by and limit from the query string of the memory routes.
+
+    Returns:
+        tuple: group_by, limit and a dict of errors.
+    """
+    numbers, errors = number_args({"limit": 20})
+    group_by = request.args.get("group_by", "lineno")
+    if group_by not in ("lineno", "filename", "traceback"):
+        errors["group_by"] = "Must be lineno, filename or traceback."
+    return group_by, numbers["limit"], errors
+
+
+@admin.route("/memory", methods=["GET"])
+def get_memory():
+    """
+    Shows the memory of this worker and the peak allocation of sampled requests.
+    Example: http://localhost:5000/admin/memory
+
+    Returns:
+        dict: The status and the request peaks by route.
+    """
+    return jsonify({**memory.status(), "requests": memory.peaks()})
+
+
+@admin.route("/memory/tracing", methods=["POST"])
+def start_tracing():
+    """
+    Starts tracemalloc in this worker.
+    Example: POST http://localhost:5000/admin/memory/tracing?frames=5
+
+    Returns:
+        dict: The status.
+    """
+    numbers, errors = number_args({"frames": 1})
+    if not errors and numbers["frames"] > MAX_FRAMES:
+        errors["frames"] = f"Must be a number from 1 to {MAX_FRAMES}."
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    memory.start(numbers["frames"])
+    return jsonify(memory.status())
+
+
+@admin.route("/memory/tracing", methods=["DELETE"])
+def stop_tracing():
+    """
+    Stops tracemalloc and drops the snapshots and request peaks.
+
+    Returns:
+        dict: The status.
+    """
+    memory.stop()
+    memory.reset_peaks()
+    return jsonify(memory.status())
+
+
+@admin.route("/memory/snapshots", methods=["POST"])
+def take_memory_snapshot():
+    """
+    Takes a snapshot, take another later and diff them to see what grew.
+    Example: POST http://localhost:5000/admin/memory/snapshots?limit=10
+
+    Returns:
+        dict: The snapshot id and the places holding the most memory.
+    """
+    group_by, limit, errors = memory_group_by()
+    if errors:
+        return jsonify({"errors": errors}), 400
+    try:
+        snapshot_id = memory.take_snapshot()
+    except RuntimeError as error:
+        return jsonify({"errors": {"tracing": str(error)}}), 409
+
+    top = memory.top(snapshot_id, group_by, limit)
+    return jsonify({"id": snapshot_id, "top": top})
+
+
+@admin.route("/memory/snapshots/<int:snapshot_id>", methods=["GET"])
+def get_memory_snapshot(snapshot_id):
+    """
+    Lists the places holding the most memory in a snapshot.
+    Example: http://localhost:5000/admin/memory/snapshots/1?group_by=filename
+
+    Args:
+        snapshot_id (int): The snapshot id.
+
+    Returns:
+        dict: The places with their bytes and blocks.
+    """
+    group_by, limit, errors = memory_group_by()
+    if errors:
+        return jsonify({"errors": errors}), 400
+    try:
+        top = memory.top(snapshot_id, group_by, limit)
+    except KeyError:
+        return jsonify({"errors": {"id": "Unknown snapshot."}}), 404
+    return jsonify({"id": snapshot_id, "top": top})
+
+
+@admin.route("/memory/diff", methods=["GET"])
+def diff_memory_snapshots():
+    """
+    Compares two snapshots, the places that grew the most come first.
+    Example: http://localhost:5000/admin/memory/diff?from=1&to=2&limit=10
+
+    Returns:
+        dict: The places with their size and growth.
+    """
+    group_by, limit, errors = memory_group_by()
+    ids, id_errors = number_args({"from": None, "to": None})
+    errors.update(id_errors)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    try:
+        diff = memory.diff(ids["from"], ids["to"], group_by, limit)
+    except KeyError:
+        return jsonify({"errors": {"id": "Unknown snapshot."}}), 404
+    return jsonify({"diff": diff})
+
+
+@admin.route("/memory/objects", methods=["GET"])
+def get_memory_objects():
+    """
+    Counts the live ORM objects by model and the most common other types.
+    Example: http://localhost:5000/admin/memory/objects?limit=10
+
+    Returns:
+        dict: The counts.
+    """
+    numbers, errors = number_args({"limit": 20})
+    if errors:
+        return jsonify({"errors": errors}), 400
+    return jsonify(memory.orm_objects(numbers["limit"]))
@@ -1,7 +1,24 @@
-from datetime import datetime
-from flask import Blueprint, jsonify, request
-from project.models import Member, Topic
-from project.extensions import db
+import json
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from sqlalchemy import update
+from sqlalchemy.orm.exc import StaleDataError
+from project.models import Member, MemberChange
+from project.extensions import db, password_verifier
+from project.auth import VerifierBusy
+from project.schemas import member_create_schema, member_edit_schema, member_references
+from project.filters import (
+    MAX_PER_PAGE,
+    id_list,
+    member_filters,
+    pagination,
+    whole_number,
+)
+from project.topic_index import bitmap_ids, topic_index
+from project.sharding import shards
+from project.importer import import_members
+
+# Largest number of changes a client can ask for at once
+MAX_CHANGES = 1000
 
 api = Blueprint("api", __name__)
 
@@ -11,15 +28,152 @@ def get_members():
     """
     Gets all members in json format.
     Example: http://localhost:5000/api/member
+    Filter and paginate with the query string, see filters.py:
+    http://localhost:5000/api/member?topic=1,2&topic_match=all&page=2&per_page=20
 
     Returns:
         dict: All members in json format
     """
-    # Get all the members
-    members = Member.query.all()
+    conditions, errors = member_filters(request.args)
+    page, per_page, page_errors = pagination(request.args)
+    errors.update(page_errors)
+
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    # Members are read in id order so pages don't shift around between requests,
+    # from every shard when they are sharded, see sharding.py
+    if page is None:
+        # Get all the members
+        members = shards.members(conditions)
+
+        # Call member_to_json with a list comprehension and jsonify it in members key:
+        return jsonify({"members": [member.member_to_json() for member in members]})
+
+    # Get one extra row to know if there is a next page without a count(*)
+    members = shards.members(conditions, (page - 1) * per_page, per_page + 1)
+
+    return jsonify(
+        {
+            "members": [member.member_to_json() for member in members[:per_page]],
+            "page": page,
+            "per_page": per_page,
+            "has_next": len(members) > per_page,
+        }
+    )
+
+
+@api.route("/member/changes", methods=["GET"])
+def get_member_changes():
+    """
+    Gets the member changes after a cursor, oldest first, so a client can
+    stay in sync without downloading every member again.
+    Start with a full GET /api/member and the cursor from
+    http://localhost:5000/api/member/changes?limit=0
+    then poll with the last cursor it returned:
+    http://localhost:5000/api/member/changes?since=120&limit=100&payload=true
+    With payload=true each change has the member as it is now, null if deleted.
+
+    Returns:
+        dict: The changes, the cursor to send next time and if more are waiting.
+    """
+    since = whole_number(request.args.get("since", "0"))
+    limit = whole_number(request.args.get("limit", "100"))
+    with_payload = request.args.get("payload", "false").lower() in ("1", "true", "yes")
+
+    errors = {}
+    if since is None or since < 0:
+        errors["since"] = "Must be a cursor of 0 or more."
+    if limit is None or not 0 <= limit <= MAX_CHANGES:
+        errors["limit"] = f"Must be a number between 0 and {MAX_CHANGES}."
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    if limit == 0:
+        # Only the current cursor, to start following the feed from now
+        latest = db.session.query(db.func.max(MemberChange.id)).scalar()
+        return jsonify({"changes": [], "cursor": latest or 0, "has_more": False})
+
+    # Get one extra row to know if more are waiting
+    changes = (
+        MemberChange.query.filter(MemberChange.id > since)
+        .order_by(MemberChange.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    members = {}
+    if with_payload and changes:
+        member_ids = {change.member_id for change in changes}
+        members = {
+            member.id: member.member_to_json()
+            for member in shards.members([Member.id.in_(member_ids)])
+        }
+
+    changes_json = []
+    for change in changes:
+        change_json = {
+            "cursor": change.id,
+            "member_id": change.member_id,
+            "operation": change.operation,
+            "changed_at": change.changed_at.isoformat(),
+        }
+        if with_payload:
+            change_json["member"] = members.get(change.member_id)
+        changes_json.append(change_json)
+
+    return jsonify(
+        {
+            "changes": changes_json,
+            "cursor": changes[-1].id if changes else since,
+            "has_more": has_more,
+        }
+    )
+
+
+@api.route("/topic/members", methods=["GET"])
+def get_topic_members():
+    """
+    Gets the ids of the members matching a topic query, from the in memory
+    topic index. Pages are read with the after cursor, the last id returned.
+    Example, members in topics 1 and 2 but not 3:
+    http://localhost:5000/api/topic/members?all=1,2&none=3&limit=100
+    http://localhost:5000/api/topic/members?any=1,4&after=5120
+
+    Returns:
+        dict: The member ids, how many match in total and the next cursor.
+    """
+    errors = {}
+    topic_ids = {}
+    for param in ("all", "any", "none"):
+        topic_ids[param] = id_list(request.args.get(param, ""))
+        if topic_ids[param] is None:
+            errors[param] = "Must be a comma separated list of topic ids."
 
-    # Call member_to_json with a list comprehension and jsonify it in members key:
-    return jsonify({"members": [member.member_to_json() for member in members]})
+    after = whole_number(request.args.get("after", "0"))
+    limit = whole_number(request.args.get("limit", "100"))
+
+    if not errors and not (topic_ids["all"] or topic_ids["any"]):
+        errors["all"] = "Send all or any with at least one topic id."
+    if after is None or after < 0:
+        errors["after"] = "Must be a member id of 0 or more."
+    if limit is None or not 1 <= limit <= MAX_PER_PAGE:
+        errors["limit"] = f"Must be a number between 1 and {MAX_PER_PAGE}."
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    matches = topic_index.query(topic_ids["all"], topic_ids["any"], topic_ids["none"])
+    member_ids = bitmap_ids(matches, after, limit + 1)
+
+    return jsonify(
+        {
+            "member_ids": member_ids[:limit],
+            "count": matches.bit_count(),
+            "after": member_ids[limit - 1] if len(member_ids) > limit else None,
+        }
+    )
 
 
 @api.route("/member/<int:member_id>", methods=["GET"])
@@ -34,8 +188,51 @@ def get_member(member_id):
     Returns:
         dict: The member in json format.
     """
-    member = Member.query.get(member_id)
-    return jsonify({"member": member.member_to_json()})
+    member = shards.get_member(member_id) or abort(404)
+    return member_response(member)
+
+
+def member_response(member, status=200, errors=None):
+    """
+    Formats a member with its version as the ETag, send it back in
+    If-Match to edit the member.
+
+    Args:
+        member (Member): The member.
+        status (int): The status code.
+        errors (dict): Errors to send with the member.
+
+    Returns:
+        Response: The json response.
+    """
+    body = {"member": member.member_to_json()}
+    if errors:
+        body["errors"] = errors
+    response = jsonify(body)
+    response.status_code = status
+    response.set_etag(f"v{member.version}")
+    return response
+
+
+def if_match_version(member):
+    """
+    Reads the version a client edited from the If-Match header.
+
+    Args:
+        member (Member): The member being edited, * means its current version.
+
+    Returns:
+        int: The version, 0 for an etag that isn't a member version.
+    """
+    if request.if_match.star_tag:
+        return member.version
+
+    for etag in request.if_match.as_set(include_weak=True):
+        # Gzipped responses have their etag changed, see compression.py
+        etag = etag.removesuffix("-gzip")
+        if etag.startswith("v") and etag[1:].isdigit():
+            return int(etag[1:])
+    return 0
 
 
 @api.route("/member", methods=["POST"])
@@ -50,33 +247,54 @@ def create_member():
     Returns:
         dict: The member created in json format.
     """
-    # Get all the data from requeset
-    member_req_data = request.get_json()
+    # Check the request data before any query or password hash, see schemas.py
+    values, errors = member_create_schema.validate(request.get_json(silent=True))
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    # The new id picks the db the member is saved in, see sharding.py
+    member_id = shards.new_member_id()
+    session = shards.session_for(member_id)
+
+    topics, errors = member_references(values, session)
+    if errors:
+        return jsonify({"errors": errors}), 400
 
     # Create a new member class with data from request
-    member = Member(
-        about=member_req_data.get("about"),
-        email=member_req_data.get("email"),
-        password=member_req_data.get("password"),
-        fav_language=member_req_data["fav_language"].get("id"),
-        first_learn_date=datetime.strptime(
-            member_req_data.get("first_learn_date"), "%Y-%m-%d"
-        ),
-        location=member_req_data.get("location"),
-        learn_new_interest=member_req_data.get("learn_new_interest"),
-    )
+    member = Member(id=member_id)
+    member.set_fields(values, topics)
 
-    # Get data for topics and append to the member object
-    interest_in_topics = member_req_data.get("interest_in_topics")
+    session.add(member)
+    session.commit()
 
-    for member_topic in interest_in_topics:
-        topic = Topic.query.get(member_topic["id"])
-        member.interest_in_topics.append(topic)
+    return member_response(member)
 
-    db.session.add(member)
-    db.session.commit()
 
-    return jsonify({"member": member.member_to_json()})
+@api.route("/member/import", methods=["POST"])
+def import_member_lines():
+    """
+    Creates many members from a streamed NDJSON body, one member per line
+    in the same format as POST /api/member. The body is read a line at a
+    time and saved in chunks, see importer.py, so any size of file works.
+    Example:
+    curl -X POST -H "Content-Type: application/x-ndjson" \\
+        --data-binary @members.ndjson http://localhost:5000/api/member/import
+
+    Returns:
+        Response: A streamed NDJSON result per line, then a summary line.
+    """
+
+    def results():
+        created = failed = 0
+        for result in import_members(request.stream):
+            if "id" in result:
+                created += 1
+            else:
+                failed += 1
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "created": created, "failed": failed}) + "\n"
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
 
 
 @api.route("/member/<int:member_id>", methods=["PUT", "PATCH"])
@@ -88,6 +306,9 @@ def edit_member(member_id):
     http://localhost:5000/api/member/1
     Remove the "member" wrapper object and add a password field.
     Use that for the PUT request.
+    Send the version you got, in the body or as If-Match: "v3" (the ETag).
+    If the member was changed since, nothing is saved and you get the
+    current member with a 409 (412 with If-Match).
 
     Args:
         member_id (int): The id of the member to edit
@@ -95,35 +316,102 @@ def edit_member(member_id):
     Returns:
         dict: The member edited
     """
-    member_req_data = request.get_json()
+    values, errors = member_edit_schema.validate(request.get_json(silent=True))
+    if errors:
+        return jsonify({"errors": errors}), 400
 
     # Get the existing member to update
-    member = Member.query.get(member_id)
+    member = shards.get_member(member_id) or abort(404)
+    session = shards.session_for(member_id)
 
-    # Update fields
-    member.email = member_req_data.get("email")
-    member.location = member_req_data.get("location")
+    # The version the client started from, edits of an older one are refused
+    if "If-Match" in request.headers:
+        version = if_match_version(member)
+        conflict_status = 412
+    else:
+        version = values.get("version")
+        conflict_status = 409
 
-    member.first_learn_date = datetime.strptime(
-        member_req_data.get("first_learn_date"), "%Y-%m-%d"
-    )
-    member.fav_language = member_req_data["fav_language"].get("id")
-    member.about = member_req_data.get("about")
-    member.learn_new_interest = member_req_data.get("learn_new_interest")
+    if version is None:
+        errors = {"version": "Send the version you edited, or an If-Match header."}
+        return jsonify({"errors": errors}), 428
+
+    conflict = {"version": "The member was changed since, this is the current one."}
+    if version != member.version:
+        return member_response(member, conflict_status, conflict)
+
+    topics, errors = member_references(values, session)
+    if errors:
+        return jsonify({"errors": errors}), 400
+
+    # Update fields, the password only if one was sent
+    member.set_fields(values, topics)
+
+    # The UPDATE only matches the version we read, no lock is held in between
+    try:
+        session.commit()
+    except StaleDataError:
+        session.rollback()
+        return member_response(member, conflict_status, conflict)
+
+    return member_response(member)
+
+
+@api.route("/auth/verify", methods=["POST"])
+def verify_password():
+    """
+    Checks an email and password.
+    Do a POST with {"email": "...", "password": "..."} to
+    http://localhost:5000/api/auth/verify
+    Hashes made with older settings are upgraded when the password is right.
+
+    Returns:
+        dict: The member in json format, or errors with a 401 if they don't match.
+    """
+    auth_req_data = request.get_json(silent=True)
+    if not isinstance(auth_req_data, dict):
+        # A list or a string is as good as no email and password
+        auth_req_data = {}
+    email = auth_req_data.get("email")
+    password = auth_req_data.get("password")
+
+    errors = {}
+    if not isinstance(email, str) or not email:
+        errors["email"] = "You must send an email."
+    if not isinstance(password, str) or not password:
+        errors["password"] = "You must send a password."
+    if errors:
+        return jsonify({"errors": errors}), 400
 
-    # Check if password exists
-    if member_req_data.get("password"):
-        member.password = member_req_data.get("password")
+    member = shards.find_member(Member.email == email)
 
-    # Topics
-    # Delete all topics then loop through and re-add
-    member.interest_in_topics[:] = []
-    interest_in_topics = member_req_data.get("interest_in_topics")
+    # Unknown emails are still checked against a dummy hash,
+    # so the response time doesn't tell which emails exist
+    try:
+        matches = password_verifier.verify(
+            member.password_hash if member else None, password
+        )
+    except VerifierBusy:
+        response = jsonify({"errors": {"auth": "Too many logins, try again."}})
+        response.headers["Retry-After"] = "1"
+        return response, 503
 
-    for member_topic in interest_in_topics:
-        topic = Topic.query.get(member_topic["id"])
-        member.interest_in_topics.append(topic)
+    if not matches:
+        return jsonify({"errors": {"auth": "Wrong email or password."}}), 401
 
-    db.session.commit()
+    if password_verifier.needs_rehash(member.password_hash):
+        # A plain UPDATE, the member wasn't edited so its version stays and no
+        # change is recorded. It only matches the hash that was checked.
+        new_hash = password_verifier.hash(password)
+        session = shards.session_for(member.id)
+        session.execute(
+            update(Member.__table__)
+            .where(
+                Member.__table__.c.id == member.id,
+                Member.__table__.c.password_hash == member.password_hash,
+            )
+            .values(password_hash=new_hash)
+        )
+        session.commit()
 
     return jsonify({"member": member.member_to_json()})
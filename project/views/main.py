@@ -1,13 +1,25 @@
-from datetime import datetime
-from ..extensions import db
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from ..models import Language, Topic, Member
+from flask import Blueprint, abort, render_template, request, redirect, url_for, flash
+from sqlalchemy.orm.exc import StaleDataError
+from ..extensions import db, page_cache
+from ..models import Member
+from .. import queries
+from ..schemas import member_create_schema, member_edit_schema, member_references
+from ..sharding import shards
 
 main = Blueprint("main", __name__)
 
+# Shown above the form, which is filled again with the member as it is now
+VERSION_CONFLICT = (
+    "Someone else changed this member while you were editing. "
+    "The form now shows their changes, make yours again and submit."
+)
+
 
 @main.route("/", methods=["GET", "POST"], defaults={"member_id": None})
 @main.route("/<int:member_id>", methods=["GET", "POST"])
+# The empty form only shows the languages and topics, so it is cached.
+# A member's form always shows their latest version.
+@page_cache.cached(unless=lambda: request.view_args["member_id"] is not None)
 def index(member_id):
     """
     The Default root route of /.
@@ -21,84 +33,51 @@ def index(member_id):
     """
     member = None
     if member_id:
-        member = Member.query.get_or_404(member_id)
+        member = shards.get_member(member_id) or abort(404)
 
     errors = {}
 
     if request.method == "POST":
-        # Get all the form input
-        email = request.form["email"]
-        password = request.form["password"]
-        location = request.form["location"]
-        first_learn_date = request.form["first_learn_date"]
-        fav_language = request.form["fav_language"]
-        about = request.form["about"]
-        learn_new_interest = request.form["learn_new_interest"]
-        interest_in_topics = request.form.getlist("interest_in_topics")
-
-        # Form validation dictionary
-        if not email:
-            errors["email"] = "You must have an email address."
-        if not password and not member_id:
-            errors["password"] = "You must have a password."
-        if not location:
-            errors["location"] = "You must have a location"
-        if not first_learn_date:
-            errors["first_learn_date"] = "You must have first learn date."
-        if not about:
-            errors["about"] = "You must have an about section."
-        if not interest_in_topics:
-            errors["interest_in_topics"] = "You must choose at least one topic."
+        # Check all the form input before touching the db, see schemas.py
+        schema = member_edit_schema if member else member_create_schema
+        values, errors = schema.validate(schema.from_form(request.form))
+
+        # An edit must start from the version in the db, or it would undo someone's edit
+        if not errors and member and values.get("version") != member.version:
+            errors["version"] = VERSION_CONFLICT
+
+        # New members get their id first, it picks the db they live in, see sharding.py
+        if not errors:
+            new_id = member.id if member else shards.new_member_id()
+            session = shards.session_for(new_id)
+
+            # Check that the language and topics exist
+            topics, errors = member_references(values, session)
 
         # Check that we have no errors
         if not errors:
             # Check if member already exists, and if so, do an edit vs new member
-            if member:
-                member.email = email
-                if password:
-                    member.password = password
-                member.location = location
-                # Convert first_learn_date to a date w/ a format Year-Month-Day
-                member.first_learn_date = datetime.strptime(
-                    first_learn_date, "%Y-%m-%d"
-                )
-                member.fav_language = fav_language
-                member.about = about
-                member.learn_new_interest = (
-                    True if learn_new_interest == "yes" else False
-                )
-
-                # Clear out all the topics
-                member.interest_in_topics[:] = []
-            else:
-                # Create a new member
-                member = Member(
-                    email=email,
-                    password=password,
-                    location=location,
-                    # Convert first_learn_date to a date w/ a format Year-Month-Day
-                    first_learn_date=datetime.strptime(first_learn_date, "%Y-%m-%d"),
-                    fav_language=fav_language,
-                    about=about,
-                    learn_new_interest=(True if learn_new_interest == "yes" else False),
-                )
-
-                # Add member to the DB
-                db.session.add(member)
-
-            # Loop through all topics and append topic to members
-            for topic_id in interest_in_topics:
-                topic = Topic.query.get(int(topic_id))
-                member.interest_in_topics.append(topic)
-
-            db.session.commit()
+            if not member:
+                # Create a new member and add it to the DB
+                member = Member(id=new_id)
+                session.add(member)
+
+            member.set_fields(values, topics)
 
+            # The UPDATE only matches the version we read, no lock is held in between
+            try:
+                session.commit()
+            except StaleDataError:
+                session.rollback()
+                errors["version"] = VERSION_CONFLICT
+
+        if not errors:
             # Redirect back to main page and use member_id if we have one so /1 /2 etc..
             # So can edit their profile if there is one vs seeing new form.
             return redirect(url_for("main.index", member_id=member.id))
 
-    languages = Language.query.all()
-    topics = Topic.query.all()
+    languages = queries.languages(db.session)
+    topics = queries.topics(db.session)
 
     # Create context so we can unpack and send to form
     # These variables are available in the template i.e. form.html
@@ -110,5 +89,6 @@ def index(member_id):
         "errors": errors,
     }
 
-    # Passed the languages/topics to context
-    return render_template("form.html", **context)
+    # Passed the languages/topics to context, a 409 if the edit clashed with another
+    status = 409 if "version" in errors else 200
+    return render_template("form.html", **context), status
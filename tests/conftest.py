@@ -0,0 +1,72 @@
+import pytest
+from project.testing import (
+    build_template,
+    create_test_app,
+    restore_database,
+    rolled_back,
+)
+
+# Members in the template, enough for pages and topic queries
+TEMPLATE_MEMBERS = 1000
+
+
+class TemplateDatabase:
+    """
+    The app's db between tests. It is copied from the template only when a
+    test may have changed it, rolled back tests leave it as it was.
+    """
+
+    def __init__(self, app, template):
+        self.app = app
+        self.template = template
+        self.changed = True
+
+    def reset(self):
+        if self.changed:
+            restore_database(self.app, self.template)
+            self.changed = False
+
+
+@pytest.fixture(scope="session")
+def template(tmp_path_factory):
+    """
+    The seeded db every test starts from, built once per run.
+    """
+    path = tmp_path_factory.getbasetemp() / "template.sqlite3"
+    return build_template(str(path), members=TEMPLATE_MEMBERS)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """
+    One app for the run, use client or db_session to get its db back to
+    the template. Modules that need other settings define their own app.
+    """
+    return create_test_app(str(tmp_path_factory.getbasetemp() / "test.sqlite3"))
+
+
+@pytest.fixture(scope="session")
+def database(app, template):
+    return TemplateDatabase(app, template)
+
+
+@pytest.fixture
+def client(app, database):
+    """
+    A test client on a copy of the template, for tests that need real
+    commits, like the topic index or several connections.
+    """
+    database.reset()
+    yield app.test_client()
+    database.changed = True
+
+
+@pytest.fixture
+def db_session(app, database):
+    """
+    The session of a transaction rolled back after the test, the fast way.
+    Requests made with app.test_client() in the test run inside it.
+    """
+    database.reset()
+    with rolled_back(app) as session:
+        yield session
@@ -0,0 +1,134 @@
+import warnings
+from datetime import datetime
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import LegacyAPIWarning
+from project.extensions import db
+from project.models import Member
+
+
+@pytest.fixture
+def statements(app, db_session):
+    """
+    The SQL statements run while the test makes its requests.
+    """
+    run = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        run.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    yield run
+    event.remove(engine, "before_cursor_execute", count)
+
+
+def test_a_page_reads_the_languages_at_once(app, statements):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", LegacyAPIWarning)
+        response = app.test_client().get("/api/member?page=1&per_page=50")
+
+    members = response.get_json()["members"]
+    assert len(members) == 50
+    assert all(member["fav_language"]["name"] for member in members)
+
+    # One query for the languages of the whole page
+    assert len([sql for sql in statements if "FROM language" in sql]) == 1
+
+
+def test_an_edit_returns_its_new_language(app, db_session):
+    client = app.test_client()
+    member = client.get("/api/member/1").get_json()["member"]
+    language_id = member["fav_language"]["id"] % 3 + 1
+
+    response = client.put(
+        "/api/member/1", json={**member, "fav_language": language_id}
+    )
+
+    assert response.get_json()["member"]["fav_language"]["id"] == language_id
+
+
+def member_ids(client, **query):
+    response = client.get("/api/member", query_string=query)
+    assert response.status_code == 200
+    return [member["id"] for member in response.get_json()["members"]]
+
+
+def test_pages_follow_each_other_in_id_order(app, db_session):
+    client = app.test_client()
+    first = client.get("/api/member?page=1&per_page=10").get_json()
+    second = client.get("/api/member?page=2&per_page=10").get_json()
+
+    ids = [member["id"] for member in first["members"] + second["members"]]
+    first_ids = select(Member.id).order_by(Member.id).limit(20)
+    assert ids == db_session.scalars(first_ids).all()
+    assert first["has_next"] and first["page"] == 1 and first["per_page"] == 10
+
+
+def test_the_last_page_has_no_next(app, db_session):
+    count = db_session.scalar(select(func.count(Member.id)))
+    page = (count - 1) // 300 + 1
+    response = app.test_client().get(f"/api/member?page={page}&per_page=300")
+
+    body = response.get_json()
+    assert len(body["members"]) == count - (page - 1) * 300
+    assert not body["has_next"]
+
+
+def test_filters_match_the_members_in_the_db(app, db_session):
+    client = app.test_client()
+    members = db_session.scalars(select(Member).order_by(Member.id)).all()
+
+    def expected(keep):
+        ids = [member.id for member in members if keep(member)]
+        # Each filter keeps some members and drops others
+        assert 0 < len(ids) < len(members)
+        return ids
+
+    def topics(member):
+        return {topic.id for topic in member.interest_in_topics}
+
+    assert member_ids(client, fav_language="1,2") == expected(
+        lambda member: member.fav_language in (1, 2)
+    )
+    assert member_ids(client, topic="1,2") == expected(
+        lambda member: topics(member) & {1, 2}
+    )
+    assert member_ids(client, topic="1,2", topic_match="all") == expected(
+        lambda member: topics(member) >= {1, 2}
+    )
+    assert member_ids(client, learn_new_interest="no") == expected(
+        lambda member: not member.learn_new_interest
+    )
+    assert member_ids(
+        client, first_learn_date_from="2020-01-01", first_learn_date_to="2021-12-31"
+    ) == expected(
+        lambda member: datetime(2020, 1, 1)
+        <= member.first_learn_date
+        <= datetime(2021, 12, 31)
+    )
+
+    location = members[0].location[:3]
+    assert member_ids(client, location=location) == expected(
+        lambda member: member.location.startswith(location)
+    )
+
+
+@pytest.mark.parametrize(
+    "query, param",
+    [
+        ("fav_language=python", "fav_language"),
+        ("topic=1,x", "topic"),
+        ("topic=1&topic_match=some", "topic_match"),
+        ("learn_new_interest=maybe", "learn_new_interest"),
+        ("first_learn_date_from=01/01/2020", "first_learn_date_from"),
+        ("page=0", "page"),
+        ("page=abc", "page"),
+        ("per_page=501", "per_page"),
+    ],
+)
+def test_bad_filters_get_400(app, db_session, query, param):
+    response = app.test_client().get(f"/api/member?{query}")
+
+    assert response.status_code == 400
+    assert list(response.get_json()["errors"]) == [param]
@@ -0,0 +1,65 @@
+import pytest
+from werkzeug.security import generate_password_hash
+from project.extensions import db
+from project.models import Member, MemberChange
+from project.seed import SEED_PASSWORD
+
+
+@pytest.fixture
+def email(app, db_session):
+    return db_session.get(Member, 1).email
+
+
+@pytest.mark.parametrize("body", [[1, 2], "password", 3, None, {}])
+def test_bodies_without_an_email_and_password_are_refused(app, db_session, body):
+    response = app.test_client().post("/api/auth/verify", json=body)
+
+    assert response.status_code == 400
+    assert set(response.get_json()["errors"]) == {"email", "password"}
+
+
+def test_the_right_password_returns_the_member(app, email):
+    response = app.test_client().post(
+        "/api/auth/verify", json={"email": email, "password": SEED_PASSWORD}
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["member"]["id"] == 1
+
+
+def test_a_wrong_password_gets_401(app, email):
+    response = app.test_client().post(
+        "/api/auth/verify", json={"email": email, "password": "wrong"}
+    )
+
+    assert response.status_code == 401
+    assert "auth" in response.get_json()["errors"]
+
+
+def test_an_unknown_email_gets_the_same_401(app, db_session):
+    response = app.test_client().post(
+        "/api/auth/verify",
+        json={"email": "nobody@example.com", "password": SEED_PASSWORD},
+    )
+
+    assert response.status_code == 401
+    assert response.get_json()["errors"] == {"auth": "Wrong email or password."}
+
+
+def test_an_old_hash_is_upgraded_without_a_new_version(app, db_session, email):
+    member = db_session.get(Member, 1)
+    member.password_hash = generate_password_hash(SEED_PASSWORD, "pbkdf2:sha256")
+    db_session.commit()
+    version = member.version
+    cursor = db_session.query(db.func.max(MemberChange.id)).scalar()
+
+    response = app.test_client().post(
+        "/api/auth/verify", json={"email": email, "password": SEED_PASSWORD}
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["member"]["version"] == version
+    db_session.refresh(member)
+    assert member.password_hash.startswith("scrypt")
+    assert member.version == version
+    assert db_session.query(db.func.max(MemberChange.id)).scalar() == cursor
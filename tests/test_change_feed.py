@@ -0,0 +1,89 @@
+import pytest
+from project.models import Member
+
+NEW_MEMBER = {
+    "email": "feed@example.com",
+    "password": "password",
+    "location": "Boston",
+    "first_learn_date": "2020-01-01",
+    "fav_language": 1,
+    "about": "Feed",
+    "interest_in_topics": [1],
+}
+
+
+def changes(client, **query):
+    response = client.get("/api/member/changes", query_string=query)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_the_feed_follows_creates_edits_and_deletes(app, db_session):
+    client = app.test_client()
+    start = changes(client, limit=0)
+    assert start["changes"] == []
+
+    member = client.post("/api/member", json=NEW_MEMBER).get_json()["member"]
+    edited = {**NEW_MEMBER, "location": "Oslo", "version": member["version"]}
+    client.put(f"/api/member/{member['id']}", json=edited)
+    db_session.delete(db_session.get(Member, member["id"]))
+    db_session.commit()
+
+    feed = changes(client, since=start["cursor"])
+    operations = [
+        (change["member_id"], change["operation"]) for change in feed["changes"]
+    ]
+    assert operations == [
+        (member["id"], "create"),
+        (member["id"], "update"),
+        (member["id"], "delete"),
+    ]
+    assert feed["cursor"] == feed["changes"][-1]["cursor"] > start["cursor"]
+    assert not feed["has_more"]
+
+    # Nothing new after the last cursor
+    assert changes(client, since=feed["cursor"]) == {
+        "changes": [],
+        "cursor": feed["cursor"],
+        "has_more": False,
+    }
+
+
+def test_limit_pages_through_the_feed(app, db_session):
+    client = app.test_client()
+    start = changes(client, limit=0)["cursor"]
+    for number in range(3):
+        email = f"feed{number}@example.com"
+        client.post("/api/member", json={**NEW_MEMBER, "email": email})
+
+    first = changes(client, since=start, limit=2)
+    rest = changes(client, since=first["cursor"], limit=2)
+
+    assert len(first["changes"]) == 2 and first["has_more"]
+    assert len(rest["changes"]) == 1 and not rest["has_more"]
+
+
+def test_payload_has_the_member_as_it_is_now(app, db_session):
+    client = app.test_client()
+    start = changes(client, limit=0)["cursor"]
+    member = client.post("/api/member", json=NEW_MEMBER).get_json()["member"]
+    edited = {**NEW_MEMBER, "location": "Oslo", "version": member["version"]}
+    client.put(f"/api/member/{member['id']}", json=edited)
+
+    feed = changes(client, since=start, payload="true")
+
+    assert [change["member"]["location"] for change in feed["changes"]] == [
+        "Oslo",
+        "Oslo",
+    ]
+
+
+@pytest.mark.parametrize(
+    "query, param",
+    [("since=-1", "since"), ("since=x", "since"), ("limit=1001", "limit")],
+)
+def test_bad_cursors_get_400(app, db_session, query, param):
+    response = app.test_client().get(f"/api/member/changes?{query}")
+
+    assert response.status_code == 400
+    assert list(response.get_json()["errors"]) == [param]
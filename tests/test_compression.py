@@ -0,0 +1,75 @@
+import gzip
+import json
+import pytest
+
+
+def get_members(app, **headers):
+    return app.test_client().get("/api/member?page=1&per_page=20", headers=headers)
+
+
+def test_gzip_is_sent_to_clients_that_accept_it(app, db_session):
+    plain = get_members(app)
+    zipped = get_members(app, **{"Accept-Encoding": "gzip, deflate"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert len(zipped.data) < len(plain.data)
+    assert gzip.decompress(zipped.data) == plain.data
+    assert "Accept-Encoding" in plain.headers["Vary"]
+    assert "Accept-Encoding" in zipped.headers["Vary"]
+
+
+@pytest.mark.parametrize("accept", ["identity", "gzip;q=0", "br"])
+def test_gzip_is_not_sent_to_clients_that_refuse_it(app, db_session, accept):
+    response = get_members(app, **{"Accept-Encoding": accept})
+
+    assert "Content-Encoding" not in response.headers
+    assert response.get_json()["members"]
+
+
+def test_small_bodies_are_sent_as_is(app, db_session):
+    response = app.test_client().get(
+        "/api/topic/members?all=999", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert response.status_code == 200
+    assert len(response.data) < app.config["COMPRESS_MIN_SIZE"]
+    assert "Content-Encoding" not in response.headers
+
+
+def test_errors_are_sent_as_is(app, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, "COMPRESS_MIN_SIZE", 0)
+    response = app.test_client().get(
+        "/api/member?page=abc", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert response.status_code == 400
+    assert "Content-Encoding" not in response.headers
+
+
+def test_gzipped_etags_are_their_own(app, db_session, monkeypatch):
+    # One member is smaller than COMPRESS_MIN_SIZE
+    monkeypatch.setitem(app.config, "COMPRESS_MIN_SIZE", 0)
+    plain = app.test_client().get("/api/member/1")
+    zipped = app.test_client().get(
+        "/api/member/1", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert zipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+
+
+def test_streamed_responses_are_gzipped_chunk_by_chunk(app, db_session):
+    lines = b'{"email": "bad"}\n' * 50
+
+    response = app.test_client().post(
+        "/api/member/import",
+        data=lines,
+        content_type="application/x-ndjson",
+        headers={"Accept-Encoding": "gzip"},
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    results = gzip.decompress(response.data).splitlines()
+    assert json.loads(results[-1]) == {"done": True, "created": 0, "failed": 50}
@@ -0,0 +1,98 @@
+import json
+import pytest
+from sqlalchemy import select
+from project.extensions import db
+from project.models import Language, Member, Topic
+from project.sharding import shards
+from project.testing import create_test_app
+
+MEMBER = {
+    "email": "imported@example.com",
+    "location": "Boston",
+    "first_learn_date": "2020-01-01",
+    "fav_language": 1,
+    "about": "Imported",
+    "interest_in_topics": [1, 2],
+}
+
+
+def ndjson(*lines):
+    return b"".join(
+        (line if isinstance(line, bytes) else json.dumps(line).encode()) + b"\n"
+        for line in lines
+    )
+
+
+def import_lines(client, body):
+    response = client.post(
+        "/api/member/import", data=body, content_type="application/x-ndjson"
+    )
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data().splitlines()]
+
+
+def test_bad_lines_fail_alone(app, db_session):
+    results = import_lines(
+        app.test_client(),
+        ndjson(
+            MEMBER,
+            b"{not json",
+            {**MEMBER, "email": "other@example.com", "fav_language": 999},
+            b"",
+            {**MEMBER, "email": "third@example.com", "interest_in_topics": []},
+            {**MEMBER, "email": "fourth@example.com"},
+        ),
+    )
+
+    assert results[0] == {"line": 2, "errors": {"line": "Not valid JSON."}}
+    assert results[1] == {"line": 3, "errors": {"fav_language": "Unknown language id."}}
+    assert results[2]["line"] == 5 and "interest_in_topics" in results[2]["errors"]
+    assert [result["line"] for result in results[3:5]] == [1, 6]
+    assert results[-1] == {"done": True, "created": 2, "failed": 3}
+
+    member = db_session.get(Member, results[3]["id"])
+    assert member.email == "imported@example.com"
+    assert [topic.id for topic in member.interest_in_topics] == [1, 2]
+
+
+def test_long_lines_are_refused_unread(app, db_session):
+    results = import_lines(
+        app.test_client(), ndjson({**MEMBER, "about": "x" * 70000}, MEMBER)
+    )
+
+    assert results[0] == {"line": 1, "errors": {"line": "Line is too long."}}
+    assert results[1]["line"] == 2 and "id" in results[1]
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    uris = [f"sqlite:///{tmp_path / f's{number}.sqlite3'}" for number in range(2)]
+    app = create_test_app(
+        str(tmp_path / "main.sqlite3"), SHARD_DATABASE_URIS=uris, SHARD_ID_BLOCK=1
+    )
+    with app.app_context():
+        shards.create_tables()
+        db.session.add_all([Language(name="Python"), Topic(name="Web apps")])
+        db.session.commit()
+        shards.copy_reference_tables()
+    return app
+
+
+def test_a_topic_missing_from_a_shard_fails_its_line(sharded_app):
+    with sharded_app.app_context():
+        # Added after the shards got their copy, so only the main db has it
+        db.session.add(Topic(name="New"))
+        db.session.commit()
+        new_topic = db.session.scalar(select(Topic.id).where(Topic.name == "New"))
+
+    results = import_lines(
+        sharded_app.test_client(),
+        ndjson(
+            {**MEMBER, "interest_in_topics": [new_topic]},
+            {**MEMBER, "email": "ok@example.com", "interest_in_topics": [1]},
+        ),
+    )
+
+    assert {"line": 1, "errors": {"interest_in_topics": "Unknown topic id."}} in results
+    assert any(result.get("line") == 2 and "id" in result for result in results)
+    assert results[-1] == {"done": True, "created": 1, "failed": 1}
@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from project.extensions import db, page_cache
+from project.invalidation import invalidation
+from project.models import Topic
+from project.testing import create_test_app
+
+POLL_INTERVAL = 0.2
+
+# Runs in a second process, adds a language to the db in argv[1]
+ADD_LANGUAGE = """
+import sys
+from project.extensions import db
+from project.models import Language
+from project.testing import create_test_app
+
+app = create_test_app(sys.argv[1])
+with app.app_context():
+    language = Language(name="Rust")
+    db.session.add(language)
+    db.session.commit()
+    print(language.id)
+"""
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "bus.sqlite3")
+
+
+@pytest.fixture
+def app(db_path):
+    """
+    An app whose bus polls every POLL_INTERVAL seconds, on an empty db.
+    """
+    app = create_test_app(db_path, INVALIDATION_POLL_INTERVAL=POLL_INTERVAL)
+    with app.app_context():
+        db.create_all()
+    yield app
+
+    with app.app_context():
+        invalidation.stop()
+
+
+def test_sees_another_process_commit_within_the_poll_interval(app, db_path):
+    seen = []
+    changed = threading.Event()
+
+    def on_language(ids):
+        seen.append((ids, time.monotonic()))
+        changed.set()
+
+    with app.app_context():
+        invalidation.subscribe("language", on_language)
+    # The first request of a process starts its poll thread
+    app.test_client().get("/api/member/changes?limit=0")
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", ADD_LANGUAGE, db_path],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": root},
+        check=True,
+    )
+    committed = time.monotonic()
+    language_id = int(result.stdout.split()[-1])
+
+    # One interval, plus a little for the poll itself
+    assert changed.wait(POLL_INTERVAL + 0.5)
+    ids, at = seen[0]
+    assert ids == {language_id}
+    assert at - committed <= POLL_INTERVAL + 0.5
+
+
+def test_own_commits_clear_the_page_cache(app, monkeypatch):
+    from_table = []
+    cleared = []
+    monkeypatch.setattr(page_cache, "clear", lambda: cleared.append(True))
+
+    with app.app_context():
+        invalidation.subscribe("topic", from_table.append)
+        db.session.add(Topic(name="Testing"))
+        db.session.commit()
+
+    # own_changes subscribers run after this process's commit,
+    # the others only hear about other processes
+    assert cleared == [True]
+    assert from_table == []
@@ -0,0 +1,80 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from project.extensions import db
+from project.jobs import jobs
+from project.models import Job, Member, Topic
+from project.testing import create_test_app, restore_database
+from project.topic_index import bitmap_ids, topic_index
+
+calls = []
+
+
+@jobs.task("test_flaky")
+def flaky(fail):
+    calls.append(fail)
+    if fail:
+        raise ValueError("Flaky")
+
+
+@pytest.fixture(scope="module")
+def jobs_app(tmp_path_factory):
+    """
+    An app that queues jobs. The tests make no requests, so no worker
+    threads start and the jobs only run when run_next is called.
+    """
+    path = tmp_path_factory.mktemp("jobs") / "jobs.sqlite3"
+    return create_test_app(
+        str(path), JOB_WORKERS=1, JOB_RETRY_BACKOFF=10, JOB_MAX_ATTEMPTS=2
+    )
+
+
+@pytest.fixture
+def context(jobs_app, template):
+    restore_database(jobs_app, template)
+    calls.clear()
+    with jobs_app.app_context():
+        yield
+        topic_index.reset()
+
+
+def test_member_writes_queue_a_topic_index_refresh(context):
+    member = db.session.get(Member, 1)
+    known = [topic.id for topic in member.interest_in_topics]
+    topic = Topic.query.filter(Topic.id.not_in(known)).first()
+    assert 1 not in bitmap_ids(topic_index.query(all_of=[topic.id]))
+    member.interest_in_topics.append(topic)
+    db.session.commit()
+
+    job = Job.query.one()
+    assert job.name == "refresh_topic_index"
+    assert job.payload == f'{{"member_ids": [1], "origin": {os.getpid()}}}'
+
+    # The index is behind until the job runs
+    assert 1 not in bitmap_ids(topic_index.query(all_of=[topic.id]))
+    assert jobs.run_next()
+    assert 1 in bitmap_ids(topic_index.query(all_of=[topic.id]))
+    assert Job.query.count() == 0
+    assert not jobs.run_next()
+
+
+def test_a_failed_job_is_retried_with_backoff_then_failed(context):
+    jobs.enqueue("test_flaky", fail=True)
+    db.session.commit()
+
+    before = datetime.now()
+    assert jobs.run_next()
+    job = Job.query.one()
+    assert (job.status, job.attempts) == ("pending", 1)
+    assert "ValueError: Flaky" in job.last_error
+    assert job.run_at >= before + timedelta(seconds=10)
+
+    # Not due before the backoff is over
+    assert not jobs.run_next()
+
+    job.run_at = datetime.now()
+    db.session.commit()
+    assert jobs.run_next()
+    job = Job.query.one()
+    assert (job.status, job.attempts) == ("failed", 2)
+    assert calls == [True, True]
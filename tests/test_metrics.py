@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from project.extensions import db, metrics
+from project.sharding import shards
+from project.testing import create_test_app
+
+
+@pytest.fixture(scope="module")
+def metrics_app(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("metrics")
+    uris = [f"sqlite:///{folder / 'shard.sqlite3'}"]
+    app = create_test_app(
+        str(folder / "main.sqlite3"),
+        METRICS_ENABLED=True,
+        METRICS_TOKEN="scrape",
+        SHARD_DATABASE_URIS=uris,
+    )
+    with app.app_context():
+        shards.create_tables()
+    return app
+
+
+def scrape(app):
+    response = app.test_client().get(
+        "/metrics", headers={"Authorization": "Bearer scrape"}
+    )
+    assert response.status_code == 200
+    return response.get_data(as_text=True).splitlines()
+
+
+def sample(lines, prefix):
+    return sum(
+        float(line.rsplit(" ", 1)[1]) for line in lines if line.startswith(prefix)
+    )
+
+
+def test_metrics_are_off_by_default(app):
+    assert app.test_client().get("/metrics").status_code == 404
+
+
+@pytest.mark.parametrize("header", [None, "Bearer wrong", "Bearer scrapé"])
+def test_scrapes_need_the_token(metrics_app, header):
+    headers = {"Authorization": header} if header else {}
+    assert metrics_app.test_client().get("/metrics", headers=headers).status_code == 403
+
+
+def test_requests_are_counted_by_route_and_status(metrics_app):
+    client = metrics_app.test_client()
+    before = scrape(metrics_app)
+    client.get("/api/member/1")
+    client.get("/api/member/1")
+
+    lines = scrape(metrics_app)
+    name = (
+        'http_requests_total{blueprint="api",endpoint="api.get_member",'
+        'method="GET",status="404"}'
+    )
+    assert sample(lines, name) - sample(before, name) == 2
+
+    latency = 'http_request_duration_seconds_count{blueprint="api"'
+    assert sample(lines, latency) >= 2
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    # The shard was asked for member 1
+    assert sample(lines, 'db_queries_total{blueprint="api"') > 0
+
+
+def test_shard_queries_are_counted(metrics_app):
+    with metrics_app.app_context():
+        before = metrics.totals()["counters"]
+        with shards.engines[0].connect() as connection:
+            connection.execute(text("SELECT 1"))
+        after = metrics.totals()["counters"]
+
+    key = ("db_queries_total", (("blueprint", ""), ("endpoint", "")))
+    assert after[key] == before.get(key, 0) + 1
+
+
+def test_failed_statements_leave_no_start_time(metrics_app):
+    with metrics_app.app_context():
+        with db.engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM no_such_table"))
+            assert connection.info["metrics_start"] == []
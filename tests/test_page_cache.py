@@ -0,0 +1,72 @@
+import pytest
+from flask import Flask, request
+from project.extensions import page_cache
+from project.page_cache import PageCache
+
+
+@pytest.fixture
+def cached_client(client, app, monkeypatch):
+    """
+    The test client with the page cache on and empty.
+    """
+    monkeypatch.setitem(app.config, "PAGE_CACHE_ENABLED", True)
+    with app.app_context():
+        page_cache.clear()
+    yield client
+    with app.app_context():
+        page_cache.clear()
+
+
+def test_form_is_cached(cached_client):
+    hits = page_cache.hits
+
+    first = cached_client.get("/")
+    second = cached_client.get("/")
+
+    assert first.status_code == second.status_code == 200
+    assert second.data == first.data
+    assert page_cache.hits == hits + 1
+    assert second.cache_control.public
+
+
+def test_if_modified_since_gets_304(cached_client):
+    first = cached_client.get("/")
+
+    response = cached_client.get(
+        "/", headers={"If-Modified-Since": first.headers["Last-Modified"]}
+    )
+
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_post_and_member_forms_are_not_cached(cached_client):
+    hits = page_cache.hits
+
+    cached_client.post("/", data={})
+    cached_client.get("/1")
+    cached_client.get("/1")
+
+    assert page_cache.hits == hits
+
+
+def test_vary_header_splits_the_cache():
+    app = Flask(__name__)
+    cache = PageCache(app)
+    renders = []
+
+    @app.route("/greeting")
+    @cache.cached(timeout=60)
+    def greeting():
+        renders.append(1)
+        language = request.headers.get("Accept-Language", "en")
+        return "hello" if language == "en" else "bonjour", {"Vary": "Accept-Language"}
+
+    client = app.test_client()
+    english = client.get("/greeting", headers={"Accept-Language": "en"})
+    french = client.get("/greeting", headers={"Accept-Language": "fr"})
+    again = client.get("/greeting", headers={"Accept-Language": "fr"})
+
+    assert english.data == b"hello"
+    assert french.data == again.data == b"bonjour"
+    assert len(renders) == 2
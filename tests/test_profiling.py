@@ -0,0 +1,54 @@
+import cProfile
+import pytest
+from project.extensions import db
+from project.profiling import list_profiles, top_functions
+from project.testing import create_test_app
+
+
+def write_profile(path):
+    profile = cProfile.Profile()
+    profile.runcall(sorted, range(100))
+    profile.dump_stats(path)
+
+
+def test_top_functions_skips_files_pruned_meanwhile(tmp_path):
+    path = str(tmp_path / "one.pstats")
+    write_profile(path)
+    (tmp_path / "half.pstats").write_bytes(b"\x00")
+
+    functions = top_functions(
+        [str(tmp_path / "gone.pstats"), path, str(tmp_path / "half.pstats")]
+    )
+
+    assert any("sorted" in function["function"] for function in functions)
+    assert top_functions([str(tmp_path / "gone.pstats")]) == []
+
+
+@pytest.fixture(scope="module")
+def profiled_app(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("profiles")
+    app = create_test_app(
+        str(folder / "db.sqlite3"),
+        PROFILE_ENABLED=True,
+        PROFILE_TOKEN="secret",
+        PROFILE_DIR=str(folder),
+    )
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.mark.parametrize(
+    "header, profiled",
+    [("secret", True), ("secret!", False), ("sécret", False)],
+)
+def test_only_the_token_asks_for_a_profile(profiled_app, header, profiled):
+    folder = profiled_app.config["PROFILE_DIR"]
+    before = len(list_profiles(folder))
+
+    response = profiled_app.test_client().get(
+        "/api/member/1", headers={"X-Profile": header}
+    )
+
+    assert response.status_code == 404
+    assert len(list_profiles(folder)) == before + profiled
@@ -0,0 +1,59 @@
+import pytest
+from project.schemas import Id, Integer, member_create_schema, member_edit_schema
+
+MEMBER = {
+    "email": "new@example.com",
+    "password": " secret ",
+    "location": " Boston ",
+    "first_learn_date": "2020-01-01",
+    "fav_language": "1",
+    "about": "New",
+    "learn_new_interest": "yes",
+    "interest_in_topics": [1, {"id": 2}, "1"],
+}
+
+
+def test_a_valid_member_is_converted():
+    values, errors = member_create_schema.validate(MEMBER)
+
+    assert errors == {}
+    assert values["location"] == "Boston"
+    assert values["password"] == " secret "
+    assert values["fav_language"] == 1
+    assert values["learn_new_interest"] is True
+    assert values["interest_in_topics"] == [1, 2]
+
+
+def test_every_error_is_reported_at_once():
+    values, errors = member_create_schema.validate(
+        {**MEMBER, "email": "", "fav_language": True, "interest_in_topics": []}
+    )
+
+    assert set(errors) == {"email", "fav_language", "interest_in_topics"}
+    assert errors["fav_language"] == "Must be an id."
+
+
+@pytest.mark.parametrize("body", [None, [MEMBER], "member"])
+def test_a_body_that_is_not_an_object_is_one_error(body):
+    values, errors = member_create_schema.validate(body)
+
+    assert errors == {"body": "Must be a JSON object."}
+
+
+@pytest.mark.parametrize("value", ["²", "1.5", "--3", "three", 2.0, True])
+def test_integers_refuse_what_is_not_a_whole_number(value):
+    with pytest.raises(ValueError, match="^Must be a whole number.$"):
+        Integer().parse(value)
+
+
+@pytest.mark.parametrize("value", ["²", "0", "-1", "x", {"id": "²"}, False])
+def test_ids_refuse_what_is_not_an_id(value):
+    with pytest.raises(ValueError, match="^Must be an id.$"):
+        Id().parse(value)
+
+
+def test_edits_check_the_version():
+    values, errors = member_edit_schema.validate({**MEMBER, "version": "0"})
+
+    assert errors == {"version": "Must be 1 or more."}
+    assert member_edit_schema.validate({**MEMBER, "version": " 3 "})[0]["version"] == 3
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+import time
+import pytest
+from project.extensions import snapshots
+from project.snapshots import SnapshotError, backup_database, list_snapshots
+
+
+def test_a_snapshot_is_a_checked_copy(app, client, tmp_path):
+    with app.app_context():
+        path = snapshots.take(str(tmp_path))
+
+    assert list_snapshots(str(tmp_path)) == [path]
+    copy = sqlite3.connect(path)
+    try:
+        assert copy.execute("SELECT count(*) FROM member").fetchone()[0] > 0
+    finally:
+        copy.close()
+
+
+def test_prune_keeps_the_newest(app, tmp_path):
+    for number in range(3):
+        (tmp_path / f"snapshot-2024010{number}-000000-000000.sqlite3").touch()
+
+    with app.app_context():
+        removed = snapshots.prune(str(tmp_path), keep=1)
+        with pytest.raises(SnapshotError):
+            snapshots.prune(str(tmp_path), keep=0)
+
+    assert len(removed) == 2
+    assert list_snapshots(str(tmp_path)) == [
+        str(tmp_path / "snapshot-20240102-000000-000000.sqlite3")
+    ]
+
+
+def test_the_command_refuses_to_keep_none(app, tmp_path):
+    result = app.test_cli_runner().invoke(
+        args=["db-snapshot", "--dir", str(tmp_path), "--keep", "0"]
+    )
+
+    assert result.exit_code == 2
+    assert list_snapshots(str(tmp_path)) == []
+
+
+def test_a_copy_restarted_by_writers_still_finishes(tmp_path):
+    source_path = str(tmp_path / "busy.sqlite3")
+    source = sqlite3.connect(source_path, check_same_thread=False)
+    source.execute("CREATE TABLE row (text TEXT)")
+    source.executemany("INSERT INTO row VALUES (?)", [("x" * 500,)] * 5000)
+    source.commit()
+
+    # Writes through another connection make the backup start over
+    writer = sqlite3.connect(source_path, check_same_thread=False)
+    stop = threading.Event()
+    deadline = time.monotonic() + 10
+
+    def write():
+        while not stop.is_set() and time.monotonic() < deadline:
+            writer.execute("INSERT INTO row VALUES ('y')")
+            writer.commit()
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    target = sqlite3.connect(str(tmp_path / "copy.sqlite3"))
+    try:
+        started = time.monotonic()
+        backup_database(source, target, pages=1, sleep=0.001, max_restarts=2)
+        elapsed = time.monotonic() - started
+    finally:
+        stop.set()
+        thread.join()
+
+    assert elapsed < 2
+    assert target.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert target.execute("SELECT count(*) FROM row").fetchone()[0] >= 5000
+    for connection in (target, writer, source):
+        connection.close()
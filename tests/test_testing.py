@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+from sqlalchemy import func, select
+from project.extensions import db
+from project.models import Member
+
+NEW_MEMBER = {
+    "email": "new@example.com",
+    "password": "password",
+    "location": "Boston",
+    "first_learn_date": "2020-01-01",
+    "fav_language": 1,
+    "about": "New",
+    "interest_in_topics": [1],
+}
+
+
+def edit_first_member(client):
+    """
+    Moves member 1 to Edited and adds a member, checking neither was there yet.
+    """
+    member = client.get("/api/member/1").get_json()["member"]
+    assert member["version"] == 1
+    assert member["location"] != "Edited"
+
+    del member["id"]
+    response = client.put("/api/member/1", json={**member, "location": "Edited"})
+    assert response.status_code == 200
+    assert response.get_json()["member"]["version"] == 2
+
+    response = client.post("/api/member", json=NEW_MEMBER)
+    assert response.status_code == 200
+
+
+def member_count(session):
+    return session.scalar(select(func.count(Member.id)))
+
+
+@pytest.fixture
+def template_members(template):
+    connection = sqlite3.connect(template)
+    try:
+        return connection.execute("SELECT count(*) FROM member").fetchone()[0]
+    finally:
+        connection.close()
+
+
+# Each mode runs twice, the second run fails if the first one's edits stayed
+@pytest.mark.parametrize("run", [1, 2])
+def test_restored_edits_do_not_leak(client, app, template_members, run):
+    edit_first_member(client)
+
+    with app.app_context():
+        assert db.session.get(Member, 1).location == "Edited"
+        assert member_count(db.session) == template_members + 1
+
+
+@pytest.mark.parametrize("run", [1, 2])
+def test_rolled_back_edits_do_not_leak(db_session, app, template_members, run):
+    edit_first_member(app.test_client())
+
+    assert db_session.get(Member, 1).location == "Edited"
+    assert member_count(db_session) == template_members + 1
@@ -0,0 +1,65 @@
+import pytest
+from project.topic_index import bitmap_ids, ids_to_bitmap, topic_index
+
+NEW_MEMBER = {
+    "email": "topics@example.com",
+    "password": "password",
+    "location": "Boston",
+    "first_learn_date": "2020-01-01",
+    "fav_language": 1,
+    "about": "Topics",
+    "interest_in_topics": [1],
+}
+
+
+def topic_member_ids(client, **query):
+    response = client.get("/api/topic/members", query_string={**query, "limit": 500})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.mark.parametrize("ids", [[], [1], [1, 7, 8, 9, 64, 1000]])
+def test_bitmaps_round_trip(ids):
+    bitmap = ids_to_bitmap(ids)
+
+    assert bitmap_ids(bitmap) == ids
+    assert bitmap_ids(bitmap, after=7, limit=2) == [i for i in ids if i > 7][:2]
+
+
+def test_the_index_follows_commits(client):
+    # Built before the writes, so they have to update it
+    count = topic_member_ids(client, all="1")["count"]
+
+    member = client.post("/api/member", json=NEW_MEMBER).get_json()["member"]
+    # Only the new member is after the ones that were there
+    after = member["id"] - 1
+    new_in_topic_1 = topic_member_ids(client, all="1", after=after)["member_ids"]
+    assert new_in_topic_1 == [member["id"]]
+    assert topic_member_ids(client, all="1")["count"] == count + 1
+
+    edited = {**NEW_MEMBER, "interest_in_topics": [2], "version": member["version"]}
+    assert client.put(f"/api/member/{member['id']}", json=edited).status_code == 200
+
+    new_in_topic_2 = topic_member_ids(client, all="2", after=after)["member_ids"]
+    assert topic_member_ids(client, all="1", after=after)["member_ids"] == []
+    assert new_in_topic_2 == [member["id"]]
+    assert topic_member_ids(client, all="1")["count"] == count
+
+
+def test_updates_only_replace_the_topics_that_changed(app):
+    with app.app_context():
+        state = app.extensions["topic_index"]
+        state.members = ids_to_bitmap([1, 200, 300])
+        state.topics = {1: ids_to_bitmap([1, 200]), 2: ids_to_bitmap([200])}
+        untouched = state.topics[2]
+        try:
+            # Member 1 leaves topic 1 for topic 3, member 300 is deleted
+            topic_index.update({1, 300}, {1}, [(3, 1)])
+
+            assert state.topics[2] is untouched
+            assert bitmap_ids(state.topics[1]) == [200]
+            assert bitmap_ids(state.topics[3]) == [1]
+            assert bitmap_ids(state.members) == [1, 200]
+            assert bitmap_ids(topic_index.query(none_of=[1])) == [1]
+        finally:
+            topic_index.reset()
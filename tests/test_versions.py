@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def member(app, db_session):
+    """
+    Member 1 as GET /api/member/1 returns it, with its ETag.
+    """
+    response = app.test_client().get("/api/member/1")
+    return response.get_json()["member"], response.headers["ETag"]
+
+
+def edit(app, body, **headers):
+    return app.test_client().put("/api/member/1", json=body, headers=headers)
+
+
+def test_an_edit_without_a_version_gets_428(app, member):
+    body, etag = member
+    del body["version"]
+
+    response = edit(app, body)
+
+    assert response.status_code == 428
+    assert "version" in response.get_json()["errors"]
+
+
+def test_an_edit_of_the_current_version_bumps_it(app, member):
+    body, etag = member
+
+    response = edit(app, {**body, "location": "Lisbon"}, **{"If-Match": etag})
+
+    assert response.status_code == 200
+    assert response.get_json()["member"]["version"] == body["version"] + 1
+    assert response.headers["ETag"] == f'"v{body["version"] + 1}"'
+
+
+def test_an_old_version_in_the_body_gets_409(app, member):
+    body, etag = member
+    edit(app, {**body, "location": "Lisbon"})
+
+    response = edit(app, {**body, "location": "Oslo"})
+
+    assert response.status_code == 409
+    assert response.get_json()["member"]["location"] == "Lisbon"
+
+
+def test_an_old_if_match_gets_412(app, member):
+    body, etag = member
+    edit(app, {**body, "location": "Lisbon"})
+
+    response = edit(app, {**body, "location": "Oslo"}, **{"If-Match": etag})
+
+    assert response.status_code == 412
+    assert response.get_json()["member"]["location"] == "Lisbon"